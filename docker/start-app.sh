@@ -0,0 +1,29 @@
+#!/bin/sh
+# Starts the app with the server named by APP_SERVER:
+#   gunicorn   (default) gunicorn.conf.py, WSGI workers or, with SERVE_ASGI=True, uvicorn workers
+#   uvicorn    a single uvicorn process
+#   runserver  Django's development server, with autoreload
+# Set RUN_MIGRATIONS=False on all but one of several app containers sharing a database.
+set -e
+
+if [ "${RUN_MIGRATIONS:-True}" = "True" ]; then
+    pipenv run python manage.py migrate
+    pipenv run python manage.py init_storage
+fi
+
+case "${APP_SERVER:-gunicorn}" in
+    gunicorn)
+        pipenv run python manage.py collectstatic --noinput
+        exec pipenv run gunicorn
+        ;;
+    uvicorn)
+        exec pipenv run uvicorn flickr_clone.asgi:application --host 0.0.0.0 --port "${PORT:-8000}"
+        ;;
+    runserver)
+        exec pipenv run python manage.py runserver "0.0.0.0:${PORT:-8000}"
+        ;;
+    *)
+        echo "Unknown APP_SERVER: $APP_SERVER" >&2
+        exit 1
+        ;;
+esac
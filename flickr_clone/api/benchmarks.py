@@ -0,0 +1,54 @@
+import time
+from typing import Dict
+
+from flickrapp.models import Album, Image
+
+from .serializers import AlbumSerializer, AlbumValuesSerializer, ImageSerializer, ImageValuesSerializer
+
+
+# (queryset, ModelSerializer, ValuesSerializer) of every list endpoint
+LISTS = {
+    'albums': (Album.objects.order_by('date_created', 'id'), AlbumSerializer, AlbumValuesSerializer),
+    'images': (Image.objects.order_by('date_uploaded', 'id'), ImageSerializer, ImageValuesSerializer),
+}
+
+
+def _best_of(repeat: int, build) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        build()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def compare_serializers(rows: int = 10000, repeat: int = 5) -> Dict[str, dict]:
+    """
+    Times building one page of every list endpoint with its ModelSerializer and with its
+    ValuesSerializer: fetching the rows and turning them into response dicts.
+
+    :param rows: Integer number of rows per page
+    :param repeat: Integer number of runs, the fastest counts
+    :return: Dict of list name to the rows, both timings in ms and the speedup
+    :raises ValueError: if there is nothing to list, or the serializers disagree
+    """
+    results = {}
+    for name, (queryset, serializer_class, values_serializer_class) in LISTS.items():
+        page = queryset[:rows]
+
+        def build_with_serializer():
+            return serializer_class(list(page), many=True).data
+
+        def build_with_values():
+            return values_serializer_class.serialize(values_serializer_class.get_rows(page))
+
+        expected = build_with_serializer()
+        if not expected:
+            raise ValueError(f'There are no {name} to serialize, run seed_benchmark first')
+        if [dict(row) for row in expected] != build_with_values():
+            raise ValueError(f'{values_serializer_class.__name__} output differs from {serializer_class.__name__}')
+        serializer = _best_of(repeat, build_with_serializer) * 1000
+        values = _best_of(repeat, build_with_values) * 1000
+        results[name] = {'rows': len(expected), 'serializer_ms': serializer, 'values_ms': values,
+                         'speedup': serializer / values if values else 0}
+    return results
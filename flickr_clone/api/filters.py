@@ -0,0 +1,14 @@
+import django_filters
+
+from flickrapp.models import Image
+
+
+class ImageFilter(django_filters.FilterSet):
+    # ?taken_at_after= and ?taken_at_before=, ISO 8601 date-times, both inclusive
+    taken_at = django_filters.IsoDateTimeFromToRangeFilter()
+    min_width = django_filters.NumberFilter(field_name='width', lookup_expr='gte')
+    min_height = django_filters.NumberFilter(field_name='height', lookup_expr='gte')
+
+    class Meta:
+        model = Image
+        fields = ['album', 'orientation', 'camera_make', 'camera_model']
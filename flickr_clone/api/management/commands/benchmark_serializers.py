@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import benchmarks
+
+
+class Command(BaseCommand):
+    help = ('Compares building a page of the album and image lists with the ModelSerializers and with the '
+            '.values() fast path the API lists use, on the data in the database (see seed_benchmark).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='Number of rows per page')
+        parser.add_argument('--repeat', type=int, default=5, help='Number of runs, the fastest counts')
+
+    def handle(self, *args, **options):
+        try:
+            results = benchmarks.compare_serializers(rows=options['rows'], repeat=options['repeat'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f"{'list':<10}{'rows':>8}{'serializer ms':>15}{'values ms':>11}{'speedup':>9}")
+        for name, result in results.items():
+            self.stdout.write(f"{name:<10}{result['rows']:>8}{result['serializer_ms']:>15.1f}"
+                              f"{result['values_ms']:>11.1f}{result['speedup']:>8.1f}x")
@@ -0,0 +1,94 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from functools import reduce
+from operator import or_
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Forward-only keyset (seek) pagination. The cursor holds the sort key of the last row of
+    the previous page, so every page is a range scan of page_size rows no matter how deep it
+    is, instead of an OFFSET that has to skip over all previous rows.
+
+    Views set ``keyset_fields`` to a unique ordering, e.g. ('date_created', 'id').
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.fields = view.keyset_fields
+        self.page_size = self.get_page_size(request)
+
+        position = self.decode_cursor(request, queryset.model)
+        if position is not None:
+            queryset = queryset.filter(self.get_seek_filter(position))
+        rows = list(queryset.order_by(*self.fields)[:self.page_size + 1])
+
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_seek_filter(self, position):
+        # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+        clauses = []
+        for i, field in enumerate(self.fields):
+            equal = {f: value for f, value in zip(self.fields[:i], position[:i])}
+            clauses.append(Q(**equal, **{f'{field}__gt': position[i]}))
+        return reduce(or_, clauses)
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            raw = json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            if len(raw) != len(self.fields):
+                raise ValueError()
+            return [model._meta.get_field(field).to_python(value) for field, value in zip(self.fields, raw)]
+        except (TypeError, ValueError, ValidationError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, row):
+        values = [row[field] if isinstance(row, dict) else getattr(row, field) for field in self.fields]
+        raw = json.dumps(values, default=str)
+        return urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -1,15 +1,133 @@
+from datetime import date, datetime, timezone
+from typing import Iterable, List
+
 from rest_framework import serializers
 
+from flickrapp import uploads
 from flickrapp.models import Album, Image
+from flickrapp.utils import file_utils
 
 
 class AlbumSerializer(serializers.ModelSerializer):
     class Meta:
         model = Album
-        fields = ('id', 'owner', 'name', 'is_public', 'date_created')
+        fields = ('id', 'owner', 'name', 'is_public', 'date_created', 'image_count', 'last_uploaded', 'cover_image')
+        # Maintained from the album's images
+        read_only_fields = ('image_count', 'last_uploaded', 'cover_image')
+
+
+class StorageLocationField(serializers.CharField):
+    """
+    A stored location, shown as the URL it resolves to.
+    """
+    def to_representation(self, value):
+        return file_utils.get_public_url(value)
 
 
 class ImageSerializer(serializers.ModelSerializer):
+    location = StorageLocationField(max_length=120)
+    thumbnail = serializers.CharField(source='thumbnail_url', read_only=True)
+    medium = serializers.CharField(source='medium_url', read_only=True)
+
     class Meta:
         model = Image
-        fields = ('id', 'album', 'title', 'location', 'date_uploaded')
+        fields = ('id', 'album', 'title', 'location', 'thumbnail', 'medium', 'date_uploaded', 'width', 'height',
+                  'orientation', 'taken_at', 'camera_make', 'camera_model')
+
+
+class ValuesSerializer:
+    """
+    Read-only fast path for list responses. Rows are fetched with .values() for exactly the
+    serialized fields and turned into the response dicts directly, without a serializer field
+    per value. Subclasses list the model fields in ``fields`` and must produce the same
+    output as their ModelSerializer counterpart.
+    """
+    fields = ()
+
+    @classmethod
+    def get_rows(cls, queryset):
+        """
+        :param queryset: QuerySet of the model
+        :return: QuerySet of dicts holding the fields
+        """
+        return queryset.values(*cls.fields)
+
+    @staticmethod
+    def to_value(value):
+        # Dates and times are rendered as ISO 8601 like DRF does by default, times in UTC with a Z
+        if isinstance(value, datetime):
+            value = value.astimezone(timezone.utc).isoformat()
+            return value[:-len('+00:00')] + 'Z' if value.endswith('+00:00') else value
+        if isinstance(value, date):
+            return value.isoformat()
+        return value
+
+    @classmethod
+    def to_representation(cls, row: dict) -> dict:
+        return {name: cls.to_value(value) for name, value in row.items()}
+
+    @classmethod
+    def serialize(cls, rows: Iterable[dict]) -> List[dict]:
+        return [cls.to_representation(row) for row in rows]
+
+
+class AlbumValuesSerializer(ValuesSerializer):
+    fields = AlbumSerializer.Meta.fields
+
+
+class ImageValuesSerializer(ValuesSerializer):
+    fields = ('id', 'album', 'title', 'location', 'thumbnail_location', 'medium_location', 'date_uploaded', 'width',
+              'height', 'orientation', 'taken_at', 'camera_make', 'camera_model')
+
+    @classmethod
+    def to_representation(cls, row: dict) -> dict:
+        location = row['location']
+        return {
+            'id': row['id'],
+            'album': row['album'],
+            'title': row['title'],
+            'location': file_utils.get_public_url(location),
+            # Image.thumbnail_url and medium_url
+            'thumbnail': file_utils.get_public_url(row['thumbnail_location'] or location),
+            'medium': file_utils.get_public_url(row['medium_location'] or location),
+            'date_uploaded': row['date_uploaded'].isoformat(),
+            'width': row['width'],
+            'height': row['height'],
+            'orientation': row['orientation'],
+            'taken_at': cls.to_value(row['taken_at']),
+            'camera_make': row['camera_make'],
+            'camera_model': row['camera_model'],
+        }
+
+
+class BulkUploadSerializer(serializers.Serializer):
+    album = serializers.PrimaryKeyRelatedField(queryset=Album.objects.none())
+    files = serializers.ListField(child=serializers.FileField(allow_empty_file=True), allow_empty=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Users can only upload to their own albums
+        self.fields['album'].queryset = Album.objects.filter(owner=self.context['request'].user)
+
+
+class DirectUploadSerializer(serializers.Serializer):
+    album = serializers.PrimaryKeyRelatedField(queryset=Album.objects.none())
+    filename = serializers.CharField(max_length=255)
+    title = serializers.CharField(max_length=80, required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Users can only upload to their own albums
+        self.fields['album'].queryset = Album.objects.filter(owner=self.context['request'].user)
+
+    def validate(self, attrs):
+        attrs['title'] = attrs.get('title') or uploads.get_title(attrs['filename'])
+        attrs['object_name'] = file_utils.get_object_name(attrs['filename'], attrs['title'])
+        # Caught here, before the client uploads anything, rather than when the image is created
+        if len(attrs['object_name']) > file_utils.MAX_OBJECT_NAME_LENGTH:
+            raise serializers.ValidationError('The file name is too long.')
+        return attrs
+
+
+class FinalizeUploadSerializer(serializers.Serializer):
+    token = serializers.CharField()
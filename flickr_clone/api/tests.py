@@ -1,9 +1,20 @@
+import json
+from io import StringIO
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+
 from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.files.uploadedfile import SimpleUploadedFile
 from rest_framework import status
 from rest_framework.test import APITestCase
 
 from flickrapp.models import Album, Image
 
+from .serializers import AlbumSerializer, AlbumValuesSerializer, ImageSerializer, ImageValuesSerializer
+
 
 class AlbumTests(APITestCase):
     @classmethod
@@ -28,26 +39,35 @@ class AlbumTests(APITestCase):
                 'owner': owner1.id,
                 'name': 'Ski mountain 2021',
                 'is_public': False,
-                'date_created': '2021-01-01'
+                'date_created': '2021-01-01',
+                'image_count': 0,
+                'last_uploaded': None,
+                'cover_image': None
             },
             {
                 'id': 1,
                 'owner': owner1.id,
                 'name': 'Beach Vacation Summer 2021',
                 'is_public': True,
-                'date_created': '2021-06-01'
+                'date_created': '2021-06-01',
+                'image_count': 0,
+                'last_uploaded': None,
+                'cover_image': None
             },
             {
                 'id': 3,
                 'owner': owner2.id,
                 'name': 'Labrador',
                 'is_public': True,
-                'date_created': '2022-01-01'
+                'date_created': '2022-01-01',
+                'image_count': 0,
+                'last_uploaded': None,
+                'cover_image': None
             }
         ]
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data, expected_data)
+        self.assertEqual(response.data['results'], expected_data)
 
     def test_get_albums_for_user(self):
         owner = User.objects.get(id=1)
@@ -58,19 +78,63 @@ class AlbumTests(APITestCase):
                 'owner': owner.id,
                 'name': 'Ski mountain 2021',
                 'is_public': False,
-                'date_created': '2021-01-01'
+                'date_created': '2021-01-01',
+                'image_count': 0,
+                'last_uploaded': None,
+                'cover_image': None
             },
             {
                 'id': 1,
                 'owner': owner.id,
                 'name': 'Beach Vacation Summer 2021',
                 'is_public': True,
-                'date_created': '2021-06-01'
+                'date_created': '2021-06-01',
+                'image_count': 0,
+                'last_uploaded': None,
+                'cover_image': None
             },
         ]
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data, expected_data)
+        self.assertEqual(response.data['results'], expected_data)
+
+
+class PaginationTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        test_user = User.objects.create_user(username='testUser123')
+        # Several albums share a date, so the id has to break the ties
+        for i in range(1, 8):
+            Album.objects.create(owner=test_user, name=f'Album {i}', is_public=True,
+                                 date_created=f'2021-01-{str((i + 1) // 2).zfill(2)}')
+
+    def test_walking_cursor_returns_every_album_once_in_order(self):
+        url = '/api/v1/albums/?page_size=2'
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 2)
+            seen.extend(album['id'] for album in response.data['results'])
+            url = response.data['next']
+        expected = list(Album.objects.order_by('date_created', 'id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_last_page_has_no_next_link(self):
+        response = self.client.get('/api/v1/albums/?page_size=10')
+        self.assertEqual(len(response.data['results']), 7)
+        self.assertIsNone(response.data['next'])
+
+    def test_cursor_respects_filters(self):
+        other_user = User.objects.create_user(username='testUser789')
+        Album.objects.create(owner=other_user, name='Labrador', is_public=True, date_created='2021-01-02')
+        response = self.client.get(f'/api/v1/albums/?owner={other_user.id}&page_size=1')
+        self.assertEqual([album['name'] for album in response.data['results']], ['Labrador'])
+        self.assertIsNone(response.data['next'])
+
+    def test_invalid_cursor_returns_404(self):
+        response = self.client.get('/api/v1/albums/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
 
 class ImageTests(APITestCase):
@@ -92,13 +156,21 @@ class ImageTests(APITestCase):
                 'id': 1,
                 'album': album.id,
                 'title': 'Beach House (front)',
-                'location': 'file.txt',
-                'date_uploaded': '2021-06-02'
+                'location': 'http://localhost:9000/uploads/file.txt',
+                'thumbnail': 'http://localhost:9000/uploads/file.txt',
+                'medium': 'http://localhost:9000/uploads/file.txt',
+                'date_uploaded': '2021-06-02',
+                'width': None,
+                'height': None,
+                'orientation': '',
+                'taken_at': None,
+                'camera_make': '',
+                'camera_model': ''
             },
         ]
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data, expected_data)
+        self.assertEqual(response.data['results'], expected_data)
 
     def test_get_image_for_album(self):
         album = Album.objects.get(id=1)
@@ -109,10 +181,330 @@ class ImageTests(APITestCase):
                 'id': 1,
                 'album': album.id,
                 'title': 'Beach House (front)',
-                'location': 'file.txt',
-                'date_uploaded': '2021-06-02'
+                'location': 'http://localhost:9000/uploads/file.txt',
+                'thumbnail': 'http://localhost:9000/uploads/file.txt',
+                'medium': 'http://localhost:9000/uploads/file.txt',
+                'date_uploaded': '2021-06-02',
+                'width': None,
+                'height': None,
+                'orientation': '',
+                'taken_at': None,
+                'camera_make': '',
+                'camera_model': ''
             },
         ]
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data, expected_data)
+        self.assertEqual(response.data['results'], expected_data)
+
+    def test_unfinished_images_are_not_listed(self):
+        album = Album.objects.get(id=1)
+        pending = Image.objects.create(album=album, title='Pending', location='pending.jpg', date_uploaded='2021-06-03',
+                                       status=Image.Status.PENDING)
+        Image.objects.create(album=album, title='Failed', location='failed.jpg', date_uploaded='2021-06-03',
+                             status=Image.Status.FAILED)
+        response = self.client.get('/api/v1/images/')
+        self.assertEqual([image['id'] for image in response.data['results']], [1])
+        response = self.client.get(f'/api/v1/images/{pending.id}/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_images_serves_renditions(self):
+        Image.objects.filter(id=1).update(thumbnail_location='file.thumbnail.jpg', medium_location='file.medium.jpg')
+        response = self.client.get('/api/v1/images/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['thumbnail'],
+                         'http://localhost:9000/uploads/file.thumbnail.jpg')
+        self.assertEqual(response.data['results'][0]['medium'], 'http://localhost:9000/uploads/file.medium.jpg')
+
+
+class BulkUploadTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user(username='testUser123', password='testUser123pass')
+        User.objects.create_user(username='testUser789', password='testUser789pass')
+        test_user = User.objects.get(id=1)
+        test_user2 = User.objects.get(id=2)
+        Album.objects.create(owner=test_user, name='Beach Vacation Summer 2021', is_public=True,
+                             date_created='2021-06-01')
+        Album.objects.create(owner=test_user2, name='Labrador', is_public=True, date_created='2022-01-01')
+
+    def post_files(self, album_id, *files):
+        return self.client.post('/api/v1/images/bulk/', {'album': album_id, 'files': list(files)}, format='multipart')
+
+    def test_requires_authentication(self):
+        response = self.post_files(1, SimpleUploadedFile('front.jpg', b'front'))
+        self.assertIn(response.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+
+    def test_creates_pending_images(self):
+        self.client.login(username='testUser123', password='testUser123pass')
+        with patch('flickrapp.uploads.stage_file', return_value='/staging/file'):
+            response = self.post_files(1, SimpleUploadedFile('front.jpg', b'front'),
+                                       SimpleUploadedFile('back.jpg', b'back'))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([result['status'] for result in response.data['results']], ['pending', 'pending'])
+        self.assertEqual(Image.objects.filter(album_id=1, status=Image.Status.PENDING).count(), 2)
+
+    def test_reports_failed_files(self):
+        self.client.login(username='testUser123', password='testUser123pass')
+        with patch('flickrapp.uploads.stage_file', return_value='/staging/file'):
+            response = self.post_files(1, SimpleUploadedFile('front.jpg', b'front'),
+                                       SimpleUploadedFile('empty.jpg', b''))
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([result['status'] for result in response.data['results']], ['pending', 'failed'])
+
+    def test_cannot_upload_to_another_users_album(self):
+        self.client.login(username='testUser123', password='testUser123pass')
+        response = self.post_files(2, SimpleUploadedFile('front.jpg', b'front'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Image.objects.exists())
+
+
+class DirectUploadTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user(username='testUser123', password='testUser123pass')
+        User.objects.create_user(username='testUser789', password='testUser789pass')
+        test_user = User.objects.get(id=1)
+        test_user2 = User.objects.get(id=2)
+        Album.objects.create(owner=test_user, name='Beach Vacation Summer 2021', is_public=True,
+                             date_created='2021-06-01')
+        Album.objects.create(owner=test_user2, name='Labrador', is_public=True, date_created='2022-01-01')
+
+    def presign(self, album_id, filename='front.jpg', **data):
+        with patch('flickrapp.utils.file_utils.MinioUploader.get_upload_url', return_value='http://minio/signed'):
+            return self.client.post('/api/v1/uploads/', {'album': album_id, 'filename': filename, **data})
+
+    def finalize(self, token, stat=object()):
+        with patch('flickrapp.utils.file_utils.MinioUploader.stat', return_value=stat), \
+                patch('flickrapp.derivatives.schedule_from_storage'):
+            return self.client.post('/api/v1/uploads/finalize/', {'token': token})
+
+    def test_requires_authentication(self):
+        response = self.presign(1)
+        self.assertIn(response.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+
+    def test_presign_returns_upload_url(self):
+        self.client.login(username='testUser123', password='testUser123pass')
+        response = self.presign(1)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['url'], 'http://minio/signed')
+        self.assertEqual(response.data['method'], 'PUT')
+        self.assertRegex(response.data['object_name'], r'^uploads/[0-9a-f]{2}/front-')
+        self.assertFalse(Image.objects.exists())
+
+    def test_long_names_fit_the_image_location(self):
+        self.client.login(username='testUser123', password='testUser123pass')
+        presigned = self.presign(1, filename='x' * 200, title='t' * 80).data
+        self.assertLessEqual(len(presigned['object_name']), Image._meta.get_field('location').max_length)
+        self.assertTrue(presigned['object_name'].endswith('.bin'))
+        response = self.finalize(presigned['token'])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_cannot_presign_for_another_users_album(self):
+        self.client.login(username='testUser123', password='testUser123pass')
+        response = self.presign(2)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_finalize_creates_image(self):
+        self.client.login(username='testUser123', password='testUser123pass')
+        presigned = self.presign(1).data
+        response = self.finalize(presigned['token'])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        image = Image.objects.get()
+        self.assertEqual(image.album_id, 1)
+        self.assertEqual(image.title, 'front')
+        self.assertEqual(image.status, Image.Status.READY)
+        self.assertEqual(image.location, presigned['object_name'])
+
+    def test_finalize_twice_keeps_one_image(self):
+        self.client.login(username='testUser123', password='testUser123pass')
+        token = self.presign(1).data['token']
+        self.finalize(token)
+        response = self.finalize(token)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Image.objects.count(), 1)
+
+    def test_finalize_before_upload(self):
+        self.client.login(username='testUser123', password='testUser123pass')
+        token = self.presign(1).data['token']
+        response = self.finalize(token, stat=None)
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertFalse(Image.objects.exists())
+
+    def test_finalize_rejects_tampered_token(self):
+        self.client.login(username='testUser123', password='testUser123pass')
+        token = self.presign(1).data['token']
+        response = self.finalize(token[:-1] + ('A' if token[-1] != 'A' else 'B'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_finalize_rejects_another_users_token(self):
+        self.client.login(username='testUser123', password='testUser123pass')
+        token = self.presign(1).data['token']
+        self.client.login(username='testUser789', password='testUser789pass')
+        response = self.finalize(token)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Image.objects.exists())
+
+
+class SearchTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        test_user = User.objects.create_user(username='testUser123')
+        public = Album.objects.create(owner=test_user, name='Beach Vacation Summer 2021', is_public=True,
+                                      date_created='2021-06-01')
+        Album.objects.create(owner=test_user, name='Beach Secrets', is_public=False, date_created='2021-07-01')
+        Image.objects.create(album=public, title='Beach house (front)', location='filename.ext',
+                             date_uploaded='2021-06-02')
+
+    def test_search_albums_and_images(self):
+        response = self.client.get('/api/v1/search/?q=beach')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([album['name'] for album in response.data['albums']], ['Beach Vacation Summer 2021'])
+        self.assertEqual([image['title'] for image in response.data['images']], ['Beach house (front)'])
+
+    def test_owner_finds_private_albums(self):
+        self.client.force_authenticate(User.objects.get(username='testUser123'))
+        response = self.client.get('/api/v1/search/?q=beach')
+        self.assertEqual(len(response.data['albums']), 2)
+
+    def test_limit(self):
+        self.client.force_authenticate(User.objects.get(username='testUser123'))
+        response = self.client.get('/api/v1/search/?q=beach&limit=1')
+        self.assertEqual(len(response.data['albums']), 1)
+
+    def test_query_is_required(self):
+        response = self.client.get('/api/v1/search/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ExportTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        test_user = User.objects.create_user(username='testUser123')
+        User.objects.create_user(username='admin', is_staff=True)
+        album = Album.objects.create(owner=test_user, name='Beach Vacation Summer 2021', is_public=False,
+                                     date_created='2021-06-01')
+        Image.objects.create(album=album, title='Beach house (front)', location='filename.ext',
+                             date_uploaded='2021-06-02')
+
+    def test_staff_only(self):
+        response = self.client.get('/api/v1/export/albums.ndjson')
+        self.assertIn(response.status_code, (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+        self.client.force_authenticate(User.objects.get(username='testUser123'))
+        response = self.client.get('/api/v1/export/albums.ndjson')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_streams_ndjson(self):
+        self.client.force_authenticate(User.objects.get(username='admin'))
+        response = self.client.get('/api/v1/export/albums.ndjson')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['name'] for row in rows], ['Beach Vacation Summer 2021'])
+
+    def test_streams_csv_with_filter(self):
+        self.client.force_authenticate(User.objects.get(username='admin'))
+        response = self.client.get('/api/v1/export/images.csv?album=2')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="images.csv"')
+        self.assertEqual(b''.join(response.streaming_content).decode().splitlines(),
+                         [','.join(('id', 'album', 'title', 'location', 'thumbnail', 'medium', 'date_uploaded',
+                                    'status'))])
+
+    def test_streams_over_asgi_without_querying_on_the_event_loop(self):
+        self.async_client.force_login(User.objects.get(username='admin'))
+        response = async_to_sync(self.async_client.get)('/api/v1/export/albums.ndjson')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        async def read():
+            # The ORM raises SynchronousOnlyOperation if it is used from here
+            if getattr(response, 'is_async', False):
+                return b''.join([part async for part in response.streaming_content])
+            return b''.join(response.streaming_content)
+
+        rows = [json.loads(line) for line in async_to_sync(read)().splitlines()]
+        self.assertEqual([row['name'] for row in rows], ['Beach Vacation Summer 2021'])
+
+    def test_unknown_export(self):
+        self.client.force_authenticate(User.objects.get(username='admin'))
+        self.assertEqual(self.client.get('/api/v1/export/users.csv').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get('/api/v1/export/albums.xml').status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ValuesSerializerTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        test_user = User.objects.create_user(username='testUser123')
+        album = Album.objects.create(owner=test_user, name='Beach Vacation Summer 2021', is_public=True,
+                                     date_created='2021-06-01')
+        Album.objects.create(owner=test_user, name='Ski mountain 2021', is_public=False, date_created='2021-01-01')
+        Image.objects.create(album=album, title='Beach house (front)', location='filename.ext',
+                             date_uploaded='2021-06-02')
+        Image.objects.create(album=album, title='Beach house (back)', location='back.ext',
+                             thumbnail_location='back-thumbnail.ext', medium_location='back-medium.ext',
+                             date_uploaded='2021-06-03')
+
+    def assertSameOutput(self, queryset, serializer_class, values_serializer_class):
+        expected = [dict(row) for row in serializer_class(queryset, many=True).data]
+        self.assertEqual(values_serializer_class.serialize(values_serializer_class.get_rows(queryset)), expected)
+
+    def test_albums_match_model_serializer(self):
+        self.assertSameOutput(Album.objects.order_by('id'), AlbumSerializer, AlbumValuesSerializer)
+
+    def test_images_match_model_serializer(self):
+        self.assertSameOutput(Image.objects.order_by('id'), ImageSerializer, ImageValuesSerializer)
+
+    def test_list_uses_one_query(self):
+        with self.assertNumQueries(1):
+            self.client.get('/api/v1/images/')
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_serializers', '--rows', '10', '--repeat', '1', stdout=out)
+        self.assertIn('images', out.getvalue())
+
+    def test_benchmark_command_needs_data(self):
+        Image.objects.all().delete()
+        with self.assertRaises(CommandError):
+            call_command('benchmark_serializers', '--repeat', '1', stdout=StringIO())
+
+
+class ImageMetadataFilterTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        test_user = User.objects.create_user(username='testUser123')
+        album = Album.objects.create(owner=test_user, name='Beach Vacation Summer 2021', is_public=True,
+                                     date_created='2021-06-01')
+        for i, (taken_at, orientation) in enumerate([('2021-06-03T10:00:00Z', 'landscape'),
+                                                     ('2021-06-01T10:00:00Z', 'portrait'),
+                                                     (None, 'landscape'),
+                                                     ('2021-06-02T10:00:00Z', 'landscape')]):
+            Image.objects.create(album=album, title=f'Beach {i}', location=f'{i}.jpg', date_uploaded='2021-06-04',
+                                 taken_at=taken_at, orientation=orientation, width=1600, height=1200,
+                                 camera_model='EOS 5D', exif={})
+
+    def titles(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [image['title'] for image in response.data['results']]
+
+    def test_metadata_is_serialized(self):
+        response = self.client.get('/api/v1/images/')
+        image = response.data['results'][0]
+        self.assertEqual((image['width'], image['taken_at'], image['camera_model']),
+                         (1600, '2021-06-03T10:00:00Z', 'EOS 5D'))
+
+    def test_taken_at_range(self):
+        self.assertEqual(self.titles('/api/v1/images/?taken_at_after=2021-06-02T00:00:00Z'), ['Beach 0', 'Beach 3'])
+        self.assertEqual(self.titles('/api/v1/images/?taken_at_before=2021-06-02T00:00:00Z'), ['Beach 1'])
+
+    def test_orientation(self):
+        self.assertEqual(self.titles('/api/v1/images/?orientation=portrait'), ['Beach 1'])
+
+    def test_order_by_taken_at(self):
+        self.assertEqual(self.titles('/api/v1/images/?ordering=taken_at'), ['Beach 1', 'Beach 3', 'Beach 0'])
+
+    def test_pages_by_taken_at(self):
+        response = self.client.get('/api/v1/images/?ordering=taken_at&page_size=2')
+        self.assertEqual([image['title'] for image in response.data['results']], ['Beach 1', 'Beach 3'])
+        self.assertEqual(self.titles(response.data['next']), ['Beach 0'])
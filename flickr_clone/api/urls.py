@@ -1,15 +1,18 @@
 from django.urls import include, path
 from rest_framework import routers
 
-from .views import AlbumViewSet, ImageViewSet
+from .views import AlbumViewSet, DirectUploadViewSet, ExportView, ImageViewSet, SearchViewSet
 
 
 router = routers.DefaultRouter()
 router.register(r'albums', AlbumViewSet, basename='Album')
 router.register(r'images', ImageViewSet, basename='Image')
+router.register(r'uploads', DirectUploadViewSet, basename='Upload')
+router.register(r'search', SearchViewSet, basename='Search')
 
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('export/<kind>.<export_format>', ExportView.as_view(), name='export'),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
 ]
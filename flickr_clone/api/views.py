@@ -1,16 +1,211 @@
-from rest_framework import viewsets
+from datetime import timedelta
 
-from .serializers import AlbumSerializer, ImageSerializer
+from django.conf import settings
+from django.core import signing
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .filters import ImageFilter
+from .serializers import (AlbumSerializer, AlbumValuesSerializer, BulkUploadSerializer, DirectUploadSerializer,
+                          FinalizeUploadSerializer, ImageSerializer, ImageValuesSerializer)
+from flickrapp import export, list_cache, search, uploads
+from flickrapp.utils import file_utils
 from flickrapp.models import Album, Image
 
 
-class AlbumViewSet(viewsets.ModelViewSet):
+class CachedListMixin:
+    """
+    Serves list responses from the cache. The API shows the same data to every client, so
+    responses only vary by the query (filters, cursor, page size) and the host the links
+    point to.
+    """
+    def get_cache_scopes(self):
+        raise NotImplementedError()
+
+    def list(self, request, *args, **kwargs):
+        key = list_cache.get_key(self.get_cache_scopes(), request.get_host(), request.get_full_path())
+        data = list_cache.lookup(key)
+        if data is not None:
+            return Response(data)
+        response = super().list(request, *args, **kwargs)
+        list_cache.store(key, response.data)
+        return response
+
+
+class ValuesListMixin:
+    """
+    Serves list responses through ``values_serializer_class``, a ValuesSerializer, instead
+    of the viewset's serializer. Leave it None to list with the regular serializer.
+    """
+    values_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        if self.values_serializer_class is None:
+            return super().list(request, *args, **kwargs)
+        rows = self.values_serializer_class.get_rows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(self.values_serializer_class.serialize(page))
+        return Response(self.values_serializer_class.serialize(rows))
+
+
+def _int_param(request, name):
+    try:
+        return int(request.query_params[name])
+    except (KeyError, ValueError):
+        return None
+
+
+class AlbumViewSet(CachedListMixin, ValuesListMixin, viewsets.ModelViewSet):
     queryset = Album.objects.all()
     serializer_class = AlbumSerializer
+    values_serializer_class = AlbumValuesSerializer
     filterset_fields = ['owner']
+    keyset_fields = ('date_created', 'id')
 
+    def get_cache_scopes(self):
+        owner_id = _int_param(self.request, 'owner')
+        if owner_id is not None:
+            return [list_cache.owner_albums_scope(owner_id)]
+        return [list_cache.all_albums_scope()]
 
-class ImageViewSet(viewsets.ModelViewSet):
+
+class ImageViewSet(CachedListMixin, ValuesListMixin, viewsets.ModelViewSet):
     queryset = Image.objects.all()
     serializer_class = ImageSerializer
-    filterset_fields = ['album']
+    values_serializer_class = ImageValuesSerializer
+    filterset_class = ImageFilter
+    # ?ordering= choices, each a unique keyset the paginator seeks on
+    orderings = {'date_uploaded': ('date_uploaded', 'id'), 'taken_at': ('taken_at', 'id')}
+
+    @property
+    def keyset_fields(self):
+        return self.orderings.get(self.request.query_params.get('ordering'), self.orderings['date_uploaded'])
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve'):
+            # Pending and failed images have nothing stored at their location yet
+            queryset = queryset.filter(status=Image.Status.READY)
+        if self.keyset_fields[0] == 'taken_at':
+            # The cursor can't seek past NULLs, and photos without a capture date have no place in this order
+            queryset = queryset.filter(taken_at__isnull=False)
+        return queryset
+
+    def get_cache_scopes(self):
+        album_id = _int_param(self.request, 'album')
+        if album_id is not None:
+            return [list_cache.album_images_scope(album_id)]
+        return [list_cache.all_images_scope()]
+
+    @action(detail=False, methods=['post'], parser_classes=[MultiPartParser], permission_classes=[IsAuthenticated])
+    def bulk(self, request):
+        """
+        Uploads many files to one album. The images are created pending and pushed to storage
+        concurrently in the background; the response reports for every file whether it was
+        accepted.
+        """
+        serializer = BulkUploadSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        results = uploads.queue_uploads(serializer.validated_data['files'], album=serializer.validated_data['album'])
+        failed = any(result['status'] == Image.Status.FAILED for result in results)
+        return Response({'results': results},
+                        status=status.HTTP_207_MULTI_STATUS if failed else status.HTTP_201_CREATED)
+
+
+class SearchViewSet(viewsets.ViewSet):
+    """
+    Searches album names and image titles, best matches first. Only albums and images the
+    user may see are returned. ?q= is the search, ?limit= the number of results per kind.
+    """
+    def list(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'q': ['This parameter is required.']}, status=status.HTTP_400_BAD_REQUEST)
+        limit = _int_param(request, 'limit') or settings.SEARCH_MAX_RESULTS
+        limit = min(max(limit, 1), settings.SEARCH_MAX_RESULTS)
+        return Response({
+            'albums': AlbumSerializer(search.search_albums(query, request.user)[:limit], many=True).data,
+            'images': ImageSerializer(search.search_images(query, request.user)[:limit], many=True).data,
+        })
+
+
+class ExportView(APIView):
+    """
+    Streams every album or image as NDJSON or CSV, e.g. /export/images.csv?album=1. Rows are
+    read in chunks and written as they are read, so memory stays flat however many there are;
+    served over ASGI by Django before 4.2, they are written to a temporary file first.
+    Exports include private albums, so they are for staff only.
+    """
+    permission_classes = [IsAdminUser]
+    filters = {'albums': 'owner', 'images': 'album'}
+
+    # Not 'format', which DRF would take as the renderer to use
+    def get(self, request, kind, export_format):
+        if kind not in self.filters or export_format not in export.CONTENT_TYPES:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        filters = {}
+        value = _int_param(request, self.filters[kind])
+        if value is not None:
+            filters[self.filters[kind]] = value
+        if not isinstance(request._request, ASGIRequest):
+            content = export.export(kind, export_format, settings.EXPORT_CHUNK_SIZE, **filters)
+        elif hasattr(StreamingHttpResponse, '__aiter__'):
+            # Django 4.2 and later read an async iterator on the event loop as it goes
+            content = export.aexport(kind, export_format, settings.EXPORT_CHUNK_SIZE, **filters)
+        else:
+            # Earlier versions iterate the response on the event loop, where the rows can't be read
+            content = export.spool(kind, export_format, settings.EXPORT_CHUNK_SIZE, **filters)
+        response = StreamingHttpResponse(content, content_type=export.CONTENT_TYPES[export_format])
+        response['Content-Disposition'] = f'attachment; filename="{kind}.{export_format}"'
+        return response
+
+
+class DirectUploadViewSet(viewsets.ViewSet):
+    """
+    Uploads that bypass the app servers: the client asks for a presigned URL, PUTs the file
+    straight into object storage, then finalizes the upload to create the image.
+    """
+    permission_classes = [IsAuthenticated]
+    token_salt = 'api.direct-upload'
+
+    def create(self, request):
+        serializer = DirectUploadSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        album = serializer.validated_data['album']
+        title = serializer.validated_data['title']
+        object_name = serializer.validated_data['object_name']
+        expires = timedelta(seconds=settings.PRESIGNED_UPLOAD_EXPIRY)
+        url = file_utils.get_uploader(object_name).get_upload_url(object_name, expires=expires)
+        # The token pins what the client may finalize, so it can't register other objects or albums
+        token = signing.dumps({'user': request.user.id, 'album': album.id, 'object': object_name, 'title': title},
+                              salt=self.token_salt)
+        return Response({'url': url, 'method': 'PUT', 'object_name': object_name, 'token': token,
+                         'expires_in': settings.PRESIGNED_UPLOAD_EXPIRY},
+                        status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'])
+    def finalize(self, request):
+        serializer = FinalizeUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            # Leave the client as long again as the URL was valid for to finish the upload
+            claims = signing.loads(serializer.validated_data['token'], salt=self.token_salt,
+                                   max_age=2 * settings.PRESIGNED_UPLOAD_EXPIRY)
+        except signing.BadSignature:
+            return Response({'token': ['Invalid or expired upload token.']}, status=status.HTTP_400_BAD_REQUEST)
+        album = Album.objects.filter(id=claims['album'], owner=request.user).first()
+        if claims['user'] != request.user.id or album is None:
+            return Response({'token': ['Invalid or expired upload token.']}, status=status.HTTP_400_BAD_REQUEST)
+
+        image = uploads.register_direct_upload(album, claims['object'], claims['title'])
+        if image is None:
+            return Response({'detail': 'Nothing has been uploaded with this token yet.'},
+                            status=status.HTTP_409_CONFLICT)
+        return Response(ImageSerializer(image).data, status=status.HTTP_201_CREATED)
@@ -10,7 +10,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+import json
 import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -24,7 +26,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = 'django-insecure-3^mm2q-xc^(2+gslc)#kjswh4-lqzg7@f72z4h=wy-@w7sp_o1'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.getenv('DJANGO_DEBUG', 'True') == 'True'
 
 ALLOWED_HOSTS = ['localhost']
 
@@ -38,6 +40,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'flickrapp',
     'api',
     'rest_framework',
@@ -45,6 +48,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'flickrapp.middleware.RequestMetricsMiddleware',
+    'flickrapp.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -86,15 +91,81 @@ DATABASES = {
         'NAME': 'flickr',
         'USER': 'postgres',
         'PASSWORD': 'pgpass',
-        'HOST': 'db',
-        'PORT': 5432
+        # Point these at pgbouncer to pool connections across processes, see docker-compose.yml
+        'HOST': os.getenv('DATABASE_HOST', 'db'),
+        'PORT': int(os.getenv('DATABASE_PORT', 5432)),
+        # Seconds a connection is kept open for later requests of the same thread; 0 opens a
+        # new one for every request (python manage.py benchmark_connections shows the cost)
+        'CONN_MAX_AGE': int(os.getenv('DATABASE_CONN_MAX_AGE', 60)),
+        # Checks a kept connection still works before a request uses it
+        'CONN_HEALTH_CHECKS': os.getenv('DATABASE_CONN_HEALTH_CHECKS', 'True') == 'True',
+        # Set when connecting through pgbouncer in transaction pooling mode, which may run every
+        # transaction on a different server connection; server-side cursors don't survive that
+        'DISABLE_SERVER_SIDE_CURSORS': os.getenv('DATABASE_TRANSACTION_POOLING', 'False') == 'True',
     }
 }
 
+# Read replicas streaming from the primary, as a comma separated list of hosts. Request reads
+# are spread over them, see flickrapp.db_router.
+DATABASE_REPLICAS = []
+for i, host in enumerate(filter(None, os.getenv('DATABASE_REPLICA_HOSTS', '').split(',')), start=1):
+    DATABASES[f'replica{i}'] = {**DATABASES['default'], 'HOST': host.strip(), 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(f'replica{i}')
+DATABASE_ROUTERS = ['flickrapp.db_router.ReplicaRouter']
+# Seconds a client's reads stay on the primary after it wrote, to cover the replication lag
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 10))
+REPLICA_PIN_COOKIE = 'read_primary'
+
 # For tests purposes, replace the postgres db with a sqlite
 import sys
 if 'test' in sys.argv or 'test_coverage' in sys.argv:
-    DATABASES['default']['ENGINE'] = 'django.db.backends.sqlite3'
+    DATABASES = {
+        'default': {**DATABASES['default'], 'ENGINE': 'django.db.backends.sqlite3'},
+        # A separate database the routing tests use as a replica, by setting DATABASE_REPLICAS
+        'replica': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': 'replica'},
+    }
+    DATABASE_REPLICAS = []
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'flickr'),
+    }
+}
+# Seconds a cached list page or API list response is kept; writes invalidate them earlier
+LIST_CACHE_TIMEOUT = int(os.getenv('LIST_CACHE_TIMEOUT', 300))
+
+# Tests run against fresh data, so don't let them see each other's cached pages
+if 'test' in sys.argv or 'test_coverage' in sys.argv:
+    CACHES['default']['BACKEND'] = 'django.core.cache.backends.dummy.DummyCache'
+
+
+# Logging
+# https://docs.djangoproject.com/en/3.2/topics/logging/
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        # One JSON line per request with its timings
+        'flickrapp.requests': {'handlers': ['console'], 'level': os.getenv('REQUEST_LOG_LEVEL', 'INFO'),
+                               'propagate': False},
+        # Sampled slow requests, with their queries
+        'flickrapp.slow_requests': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+    },
+}
+
+# Keep the test output readable
+if 'test' in sys.argv or 'test_coverage' in sys.argv:
+    LOGGING['loggers']['flickrapp.requests']['level'] = 'WARNING'
+    LOGGING['loggers']['flickrapp.slow_requests']['level'] = 'ERROR'
 
 
 # Password validation
@@ -134,6 +205,8 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.2/howto/static-files/
 
 STATIC_URL = '/static/'
+# collectstatic gathers the static files here, for the proxy in front of the app server to serve
+STATIC_ROOT = os.getenv('STATIC_ROOT', os.path.join(BASE_DIR, 'staticfiles'))
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
@@ -145,9 +218,99 @@ MINIO_PORT = os.getenv('MINIO_PORT', 9000)
 MINIO_SSL = os.getenv('MINIO_SSL', False)
 MINIO_USERNAME = os.getenv('MINIO_USERNAME', 'minio')
 MINIO_PASSWORD = os.getenv('MINIO_PASSWORD', 'minio123')
+# host:port clients reach Minio on, used for presigned URLs
+MINIO_PUBLIC_ENDPOINT = os.getenv('MINIO_PUBLIC_ENDPOINT', f'localhost:{MINIO_PORT}')
+MINIO_REGION = os.getenv('MINIO_REGION', 'us-east-1')
+# Size of each part streamed to Minio; Minio requires at least 5 MiB
+MINIO_PART_SIZE = int(os.getenv('MINIO_PART_SIZE', 10 * 1024 * 1024))
+# Number of keep-alive connections the shared Minio client holds per process
+MINIO_POOL_SIZE = int(os.getenv('MINIO_POOL_SIZE', 10))
+MINIO_CONNECT_TIMEOUT = float(os.getenv('MINIO_CONNECT_TIMEOUT', 10))
+MINIO_READ_TIMEOUT = float(os.getenv('MINIO_READ_TIMEOUT', 300))
+# Object storage nodes. Every node is a bucket on a Minio endpoint, and new objects are spread
+# over the nodes by consistent hashing of their names. Every key starts with the name of its
+# node, so endpoints can change without moving objects, and a node must keep its name as long
+# as it stores any. Adding a node puts about 1/n of new objects on it; the rebalance_storage
+# command moves existing ones. Objects stored before keys named their node are on the first
+# node. Names are at most 20 lowercase letters, digits, - or _. Set as a JSON list, e.g.
+# [{"name": "a", "bucket": "uploads-a", "endpoint": "minio1:9000", "public_endpoint": "localhost:9000"}, ...]
+STORAGE_NODES = json.loads(os.getenv('STORAGE_NODES', '[]')) or [
+    {'name': 'uploads', 'bucket': 'uploads', 'endpoint': f'{MINIO_ENDPOINT}:{MINIO_PORT}',
+     'public_endpoint': MINIO_PUBLIC_ENDPOINT},
+]
+# Points per node on the hash ring; more spread the keys more evenly
+STORAGE_RING_POINTS = int(os.getenv('STORAGE_RING_POINTS', 100))
+# Hex digits of its hash every new object key has after its node, to spread keys over prefixes
+STORAGE_KEY_PREFIX_LENGTH = int(os.getenv('STORAGE_KEY_PREFIX_LENGTH', 2))
+
+# Background upload pipeline
+# Uploaded files wait here until a worker has pushed them to Minio. Must be shared with the
+# process_uploads command if it runs in a separate container.
+UPLOAD_STAGING_DIR = os.getenv('UPLOAD_STAGING_DIR', os.path.join(tempfile.gettempdir(), 'flickr_staging'))
+# Uploads are hashed while they are received, to store identical files only once
+FILE_UPLOAD_HANDLERS = [
+    'flickrapp.upload_handlers.HashingMemoryFileUploadHandler',
+    'flickrapp.upload_handlers.HashingTemporaryFileUploadHandler',
+]
+# Upload threads per web process; 0 leaves all uploads to the process_uploads command
+UPLOAD_WORKER_THREADS = int(os.getenv('UPLOAD_WORKER_THREADS', 2))
+UPLOAD_MAX_ATTEMPTS = int(os.getenv('UPLOAD_MAX_ATTEMPTS', 3))
+# Seconds an upload may stay claimed by a worker before process_uploads requeues it; longer
+# than the slowest transfer, so only the uploads of crashed workers are requeued
+UPLOAD_CLAIM_TIMEOUT = int(os.getenv('UPLOAD_CLAIM_TIMEOUT', 900))
+# Seconds a presigned upload URL stays valid; its finalize token lasts twice as long
+PRESIGNED_UPLOAD_EXPIRY = int(os.getenv('PRESIGNED_UPLOAD_EXPIRY', 3600))
+# Renditions rendered for every upload; each name needs a <name>_location field on Image
+IMAGE_RENDITIONS = {
+    'thumbnail': {'size': (300, 200), 'crop': True},
+    'medium': {'size': (1024, 1024), 'crop': False},
+}
+# Processes rendering the renditions; 0 renders them in the upload worker thread
+DERIVATIVE_PROCESSES = int(os.getenv('DERIVATIVE_PROCESSES', 2))
+# Bytes of a stored image downloaded to read its EXIF metadata, which sits in the header
+METADATA_HEADER_BYTES = int(os.getenv('METADATA_HEADER_BYTES', 256 * 1024))
+
+# Seconds browsers may cache an image that isn't content-addressed before revalidating it
+IMAGE_CACHE_MAX_AGE = int(os.getenv('IMAGE_CACHE_MAX_AGE', 24 * 60 * 60))
+# Renditions of content-addressed images are fetched by browsers straight from storage, with
+# a URL signed at the start of every period of this many seconds; it stays the same within a
+# period, so browsers keep using their cached copy. The URLs are valid for two periods, which
+# must not exceed 7 days.
+IMAGE_URL_SIGNING_PERIOD = int(os.getenv('IMAGE_URL_SIGNING_PERIOD', 24 * 60 * 60))
+# Bytes read from storage at a time when streaming an image to a client
+IMAGE_STREAM_CHUNK_SIZE = int(os.getenv('IMAGE_STREAM_CHUNK_SIZE', 64 * 1024))
+
+# Request metrics
+# Addresses or networks (e.g. 172.16.0.0/12) allowed to scrape /metrics. Scrapers connect to
+# the app server directly; nginx doesn't pass /metrics on, every request through it would
+# come from nginx's address.
+METRICS_ALLOWED_IPS = os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
+# Directory the worker processes of a server share their metrics through, so /metrics of
+# any of them reports the totals of all; without it every process reports its own.
+# gunicorn.conf.py sets one up
+METRICS_DIR = os.getenv('METRICS_DIR') or None
+# Seconds at least between writes of a process's metrics to METRICS_DIR
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 1.0))
+# Requests slower than this many seconds are logged with their queries...
+SLOW_REQUEST_THRESHOLD = float(os.getenv('SLOW_REQUEST_THRESHOLD', 1.0))
+# ...with this probability
+SLOW_REQUEST_SAMPLE_RATE = float(os.getenv('SLOW_REQUEST_SAMPLE_RATE', 1.0))
+# Number of queries per request kept for the slow request log
+SLOW_REQUEST_MAX_QUERIES = int(os.getenv('SLOW_REQUEST_MAX_QUERIES', 100))
+
+# Most results a search returns per kind (albums, images)
+SEARCH_MAX_RESULTS = int(os.getenv('SEARCH_MAX_RESULTS', 50))
+
+# Rows an export reads from the database and writes to the client at a time
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 2000))
+
+# Number of rows per page on the HTML list views
+LIST_PAGE_SIZE = int(os.getenv('LIST_PAGE_SIZE', 25))
 
 # Django Rest Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.KeysetPagination',
+    'PAGE_SIZE': int(os.getenv('API_PAGE_SIZE', 100)),
     'TEST_REQUEST_DEFAULT_FORMAT': 'json',
 }
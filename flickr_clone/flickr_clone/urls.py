@@ -17,6 +17,8 @@ from django.contrib import admin
 from django.shortcuts import redirect
 from django.urls import include, path
 
+from flickrapp.views import MetricsView
+
 
 urlpatterns = [
     path('', lambda request: redirect('accounts/', permanent=True)),
@@ -24,4 +26,5 @@ urlpatterns = [
     path('accounts/', include('auth.urls')),
     path('flickr/', include('flickrapp.urls')),
     path('api/v1/', include('api.urls')),
+    path('metrics', MetricsView.as_view(), name='metrics'),
 ]
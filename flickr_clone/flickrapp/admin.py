@@ -3,11 +3,13 @@ from .models import Album, Image
 
 
 class AlbumAdmin(admin.ModelAdmin):
-    pass
+    # Maintained from the album's images, see recompute_album_stats to repair them
+    readonly_fields = ['image_count', 'last_uploaded', 'cover_image']
 
 
 class ImageAdmin(admin.ModelAdmin):
-    pass
+    # Blobs are reference counted, so they're only ever assigned by the upload pipeline
+    readonly_fields = ['blob']
 
 
 admin.site.register(Album, AlbumAdmin)
@@ -0,0 +1,71 @@
+from datetime import date
+from typing import Iterable, Optional
+
+from django.db.models import Case, Count, DateField, F, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import Album, Image
+
+
+# Album.image_count, last_uploaded and cover_image describe the album's ready images. They
+# are written in the transaction of the image write that changed them: Image.save() and
+# deletes are atomic with their signal receivers, and the bulk paths call these functions
+# inside their own transaction.
+
+def _ready_images():
+    return Image.objects.filter(album=OuterRef('pk'), status=Image.Status.READY)
+
+
+def _latest_ready_image():
+    return Subquery(_ready_images().order_by('-date_uploaded', '-id').values('id')[:1])
+
+
+def _last_upload():
+    # Walks image_album_ready_idx backwards from the album's latest image
+    return Subquery(_ready_images().order_by('-date_uploaded', '-id').values('date_uploaded')[:1])
+
+
+def image_added(album_id: int, image_id: int, date_uploaded: date):
+    """
+    Counts a newly ready image in its album and makes it the cover.
+
+    :param album_id: Integer id of the Album
+    :param image_id: Integer id of the Image
+    :param date_uploaded: Date the image was uploaded
+    """
+    Album.objects.filter(id=album_id).update(
+        image_count=F('image_count') + 1,
+        last_uploaded=Case(When(last_uploaded__gte=date_uploaded, then=F('last_uploaded')),
+                           default=Value(date_uploaded, output_field=DateField())),
+        cover_image_id=image_id,
+    )
+
+
+def image_removed(album_id: int, date_uploaded: date):
+    """
+    Stops counting a deleted ready image. Deleting the cover already cleared it, so the next
+    latest image takes its place; deleting an image of the last upload date looks the date
+    up again.
+
+    :param album_id: Integer id of the Album
+    :param date_uploaded: Date the deleted image was uploaded
+    """
+    Album.objects.filter(id=album_id, image_count__gt=0).update(image_count=F('image_count') - 1)
+    Album.objects.filter(id=album_id, last_uploaded__lte=date_uploaded).update(last_uploaded=_last_upload())
+    Album.objects.filter(id=album_id, cover_image__isnull=True).update(cover_image=_latest_ready_image())
+
+
+def recompute(album_ids: Optional[Iterable[int]] = None) -> int:
+    """
+    Recomputes the stats of albums from their images, e.g. after bulk inserts or to repair drift.
+
+    :param album_ids: Optional ids of the Albums, all albums if None
+    :return: Integer number of albums updated
+    """
+    albums = Album.objects.all() if album_ids is None else Album.objects.filter(id__in=list(album_ids))
+    count = _ready_images().order_by().values('album').annotate(count=Count('id')).values('count')
+    return albums.update(
+        image_count=Coalesce(Subquery(count), 0),
+        last_uploaded=_last_upload(),
+        cover_image=_latest_ready_image(),
+    )
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class FlickrappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'flickrapp'
+
+    def ready(self):
+        # Registers the cache invalidation and query metrics receivers
+        from . import signals  # noqa: F401
@@ -0,0 +1,90 @@
+"""
+Async versions of the list pages and the upload page, served next to the sync ones under
+async/ so a deployment can be load tested with both (see the loadtest and benchmark_servers
+commands). Over ASGI they run on the event loop, with all middleware, which is async capable.
+Django 3.2 has no async ORM or cache, so every step that blocks, e.g. a cache lookup, a query
+or staging a file, is handed to a thread with sync_to_async, and a request only holds a
+thread for those steps rather than from start to end. The pages are built by the sync views'
+own methods, so both versions show the same.
+"""
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.http import HttpResponse, HttpResponseNotAllowed, HttpResponseRedirect
+from django.template.loader import render_to_string
+
+from . import list_cache
+from .forms import UploadImageForm
+from .views import AlbumListForUserView, AlbumListView, ImageListForAlbumView, UploadImageView
+
+
+async def _get_user(request):
+    # AuthenticationMiddleware leaves the user to be read from the session on first use
+    await sync_to_async(lambda: request.user.is_authenticated)()
+    return request.user
+
+
+def _lookup(scopes, path, visibility):
+    key = list_cache.get_key(scopes, path, visibility)
+    return key, list_cache.lookup(key)
+
+
+def _render_list(view, key) -> bytes:
+    view.object_list = view.get_queryset()
+    content = view.render_to_response(view.get_context_data()).render().content
+    list_cache.store(key, content)
+    return content
+
+
+async def _cached_list(view_class, request, **kwargs) -> HttpResponse:
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    view = view_class()
+    view.setup(request, **kwargs)
+    await _get_user(request)
+    key, content = await sync_to_async(_lookup)(view.get_cache_scopes(), request.get_full_path(),
+                                                view.get_visibility())
+    if content is None:
+        content = await sync_to_async(_render_list)(view, key)
+    return HttpResponse(content)
+
+
+async def album_list(request):
+    return await _cached_list(AlbumListView, request)
+
+
+async def user_albums(request, username):
+    return await _cached_list(AlbumListForUserView, request, username=username)
+
+
+async def image_list(request, pk):
+    return await _cached_list(ImageListForAlbumView, request, pk=pk)
+
+
+def _read_form(request):
+    # Parsing a multipart body writes the files Django spools to disk
+    return request.POST, request.FILES
+
+
+async def upload_image(request):
+    """
+    The upload page, see UploadImageView. Reading the form, which may write the file to disk,
+    and staging the file are done on threads; the transfer to storage happens in the
+    background as it does for the sync view.
+    """
+    if request.method not in ('GET', 'HEAD', 'POST'):
+        return HttpResponseNotAllowed(['GET', 'HEAD', 'POST'])
+    user = await _get_user(request)
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+    if request.method == 'POST':
+        data, files = await sync_to_async(_read_form, thread_sensitive=False)(request)
+        form = UploadImageForm(data, files, user=user)
+        # Validating the album queries the database
+        if await sync_to_async(form.is_valid)():
+            await sync_to_async(form.queue_upload)(files['file'])
+            return HttpResponseRedirect(UploadImageView.success_url)
+    else:
+        form = UploadImageForm(user=user)
+    content = await sync_to_async(render_to_string)(UploadImageView.template_name, {'form': form}, request)
+    return HttpResponse(content)
@@ -0,0 +1,276 @@
+import time
+from contextlib import ExitStack
+from datetime import date, timedelta
+from io import BytesIO
+from typing import Dict, List, Optional
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.signals import request_finished, request_started
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from . import album_stats, uploads
+from .models import Album, Image
+from .utils import file_utils, load_utils
+from .utils.fake_storage import FakeMinio
+
+
+# Synthetic users are recognised by their name, so they can be cleared again
+USERNAME_PREFIX = 'bench-user-'
+PASSWORD = 'bench-pass'
+FIRST_DATE = date(2020, 1, 1)
+
+
+def seed(users: int, albums: int, images: int, batch_size: int = 10000, private_every: int = 5, log=None):
+    """
+    Creates synthetic users, albums and images with bulk inserts. Albums are spread evenly
+    over the users and images over the albums; every private_every-th album is private.
+
+    :param users: Integer number of users
+    :param albums: Integer number of albums
+    :param images: Integer number of images
+    :param batch_size: Integer number of rows per insert
+    :param private_every: Integer, every n-th album is private
+    :param log: Optional callable taking a progress message
+    """
+    log = log or (lambda message: None)
+    first_user = User.objects.filter(username__startswith=USERNAME_PREFIX).count()
+    password = make_password(PASSWORD)
+    User.objects.bulk_create([User(username=f'{USERNAME_PREFIX}{first_user + i}', password=password)
+                              for i in range(users)], batch_size=batch_size)
+    user_ids = list(User.objects.filter(username__startswith=USERNAME_PREFIX)
+                    .order_by('id').values_list('id', flat=True))
+    log(f'{len(user_ids)} users')
+
+    for start in range(0, albums, batch_size):
+        Album.objects.bulk_create([
+            Album(owner_id=user_ids[i % len(user_ids)], name=f'Album {i}', is_public=bool(i % private_every),
+                  date_created=FIRST_DATE + timedelta(days=i % 1000))
+            for i in range(start, min(start + batch_size, albums))
+        ])
+    album_ids = list(Album.objects.filter(owner_id__in=user_ids).order_by('id').values_list('id', flat=True))
+    log(f'{len(album_ids)} albums')
+
+    first_image = Image.objects.count()
+    for start in range(0, images, batch_size):
+        Image.objects.bulk_create([
+            Image(album_id=album_ids[i % len(album_ids)], title=f'Image {i}',
+                  location=file_utils.get_location(f'bench-{first_image + i}.jpg'),
+                  date_uploaded=FIRST_DATE + timedelta(days=i % 1000), status=Image.Status.READY)
+            for i in range(start, min(start + batch_size, images))
+        ])
+        log(f'{min(start + batch_size, images)} images')
+    # bulk_create() doesn't send signals, so the album stats are computed afterwards
+    for start in range(0, len(album_ids), batch_size):
+        album_stats.recompute(album_ids[start:start + batch_size])
+
+
+def clear(batch_size: int = 10000):
+    """
+    Deletes the synthetic users and everything they own, in batches so memory stays flat.
+
+    :param batch_size: Integer number of rows deleted at a time
+    """
+    images = Image.objects.filter(album__owner__username__startswith=USERNAME_PREFIX)
+    while True:
+        image_ids = list(images.values_list('id', flat=True)[:batch_size])
+        if not image_ids:
+            break
+        Image.objects.filter(id__in=image_ids).delete()
+    User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+
+
+def get_endpoints() -> Dict[str, str]:
+    """
+    The read endpoints benchmarked, with paths pointing at the seeded data.
+
+    :return: Dict of endpoint name to path
+    """
+    album = (Album.objects.filter(owner__username__startswith=USERNAME_PREFIX, is_public=True)
+             .select_related('owner').order_by('id').first())
+    if album is None:
+        raise ValueError('There is no benchmark data, run seed_benchmark first')
+    return {
+        'albums': '/flickr/albums/',
+        'albums last page': '/flickr/albums/?page=last',
+        'user albums': f'/flickr/{album.owner.username}/albums',
+        'album images': f'/flickr/albums/{album.id}/images',
+        'api albums': '/api/v1/albums/',
+        'api user albums': f'/api/v1/albums/?owner={album.owner_id}',
+        'api images': '/api/v1/images/',
+        'api album images': f'/api/v1/images/?album={album.id}',
+        'search': '/flickr/search/?q=image',
+        'api search': '/api/v1/search/?q=album',
+    }
+
+
+def measure(request, iterations: int, cold: bool = False) -> dict:
+    """
+    Times a request in-process, through the whole middleware stack but without a network.
+
+    :param request: Callable taking the iteration number and returning a response, or False if it failed
+    :param iterations: Integer number of requests
+    :param cold: True to clear the cache before every request
+    :return: Dict summary, see load_utils.summarize(), plus the mean and max query count
+    """
+    latencies = []
+    queries = []
+    errors = 0
+    started = time.perf_counter()
+    for i in range(iterations):
+        if cold:
+            cache.clear()
+        # Reads may go to a replica, so queries are counted on every database
+        with ExitStack() as stack:
+            captured = [stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in connections]
+            start = time.perf_counter()
+            response = request(i)
+            latencies.append(time.perf_counter() - start)
+        queries.append(sum(len(context) for context in captured))
+        if response is False or getattr(response, 'status_code', 200) >= 400:
+            errors += 1
+    summary = load_utils.summarize(latencies, errors, time.perf_counter() - started)
+    summary['queries'] = sum(queries) / len(queries) if queries else 0
+    summary['max_queries'] = max(queries, default=0)
+    return summary
+
+
+def _jpeg(i: int) -> bytes:
+    # Imported here, Pillow is only needed to benchmark uploads
+    from PIL import Image as PILImage
+
+    # A different colour every time, or the uploads would be deduplicated
+    data = BytesIO()
+    PILImage.new('RGB', (1024, 768), (i % 256, (i // 256) % 256, (i // 65536) % 256)).save(data, 'JPEG')
+    return data.getvalue()
+
+
+def run(iterations: int, cold: bool = False, include_uploads: bool = True, log=None) -> Dict[str, dict]:
+    """
+    Benchmarks the read endpoints and, against an in-memory fake of object storage, the
+    upload path: the upload request and the background worker that stores the file.
+
+    :param iterations: Integer number of requests per endpoint
+    :param cold: True to clear the cache before every request
+    :param include_uploads: False to only benchmark the read endpoints
+    :param log: Optional callable taking a progress message
+    :return: Dict of endpoint name to summary
+    """
+    log = log or (lambda message: None)
+    client = Client(SERVER_NAME='localhost')
+    results = {}
+    for name, path in get_endpoints().items():
+        results[name] = measure(lambda i: client.get(path), iterations, cold)
+        log(name)
+
+    if include_uploads:
+        album = Album.objects.filter(owner__username__startswith=USERNAME_PREFIX).order_by('id').first()
+        client.login(username=album.owner.username, password=PASSWORD)
+        file_utils.set_client(FakeMinio())
+        # Keep the workers out of the request timings; the worker is timed on its own below
+        try:
+            with override_settings(UPLOAD_WORKER_THREADS=0, DERIVATIVE_PROCESSES=0):
+                def upload(i):
+                    file = SimpleUploadedFile(f'bench-{i}.jpg', _jpeg(i), content_type='image/jpeg')
+                    return client.post('/flickr/upload-image/',
+                                       {'album': album.id, 'title': f'Upload {i}', 'file': file})
+
+                results['upload'] = measure(upload, iterations)
+                log('upload')
+                pending_ids = list(Image.objects.filter(album=album, status=Image.Status.PENDING)
+                                   .order_by('id').values_list('id', flat=True)[:iterations])
+                results['upload worker'] = measure(lambda i: uploads.process_upload(pending_ids[i]),
+                                                   len(pending_ids))
+                log('upload worker')
+        finally:
+            file_utils.reset_client()
+    return results
+
+
+def measure_connections(iterations: int, max_age: Optional[int], health_checks: bool = False,
+                        using: str = DEFAULT_DB_ALIAS) -> dict:
+    """
+    Times the database work of the cheapest request: the request_started receivers, one
+    query and the request_finished receivers, which close the connection once it is older
+    than max_age. Only the connection handling differs between runs, so comparing max ages
+    shows what opening a connection for every request costs.
+
+    :param iterations: Integer number of simulated requests
+    :param max_age: Integer CONN_MAX_AGE for the run, 0 to connect for every request, None to never close
+    :param health_checks: True to check a kept connection works before every request
+    :param using: String alias of the database
+    :return: Dict summary, see load_utils.summarize(), plus the number of connections opened
+    """
+    db = connections[using]
+    opened = []
+
+    def count(sender, connection, **kwargs):
+        if connection.alias == using:
+            opened.append(connection.alias)
+
+    original = {key: db.settings_dict.get(key) for key in ('CONN_MAX_AGE', 'CONN_HEALTH_CHECKS')}
+    db.settings_dict.update(CONN_MAX_AGE=max_age, CONN_HEALTH_CHECKS=health_checks)
+    # The settings apply from the next connection on
+    db.close()
+    connection_created.connect(count)
+    latencies = []
+    started = time.perf_counter()
+    try:
+        for _ in range(iterations):
+            start = time.perf_counter()
+            request_started.send(sender=__name__)
+            with db.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            request_finished.send(sender=__name__)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        connection_created.disconnect(count)
+        db.settings_dict.update(original)
+        db.close()
+    summary = load_utils.summarize(latencies, 0, time.perf_counter() - started)
+    summary['connections'] = len(opened)
+    return summary
+
+
+def compare_connections(iterations: int, max_age: int = 600, using: str = DEFAULT_DB_ALIAS) -> Dict[str, dict]:
+    """
+    Measures the per-request connection cost with a new connection for every request,
+    with persistent connections, and with persistent connections that are health checked.
+
+    :param iterations: Integer number of simulated requests per run
+    :param max_age: Integer CONN_MAX_AGE of the persistent runs
+    :param using: String alias of the database
+    :return: Dict of run name to summary, see measure_connections()
+    """
+    return {
+        'CONN_MAX_AGE=0': measure_connections(iterations, 0, using=using),
+        f'CONN_MAX_AGE={max_age}': measure_connections(iterations, max_age, using=using),
+        f'CONN_MAX_AGE={max_age}, health checks': measure_connections(iterations, max_age, health_checks=True,
+                                                                      using=using),
+    }
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """
+    Finds the endpoints that got slower or make more queries than in a baseline run.
+
+    :param results: Dict of endpoint name to summary from run()
+    :param baseline: Dict of endpoint name to summary from an earlier run()
+    :param tolerance: Float fraction the p95 latency may grow by, e.g. 0.2
+    :return: List of strings describing the regressions
+    """
+    regressions = []
+    for name, summary in results.items():
+        before: Optional[dict] = baseline.get(name)
+        if before is None:
+            continue
+        if summary['p95'] > before['p95'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95']:.1f}ms -> {summary['p95']:.1f}ms")
+        if summary['max_queries'] > before['max_queries']:
+            regressions.append(f"{name}: queries {before['max_queries']} -> {summary['max_queries']}")
+    return regressions
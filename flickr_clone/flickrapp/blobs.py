@@ -0,0 +1,122 @@
+import logging
+from collections import Counter, defaultdict
+from typing import Iterable
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .models import Blob, Image
+from .utils import file_utils
+
+
+logger = logging.getLogger(__name__)
+
+
+def add_reference(sha256: str, count: int = 1) -> bool:
+    """
+    Takes a reference on the stored blob with the given content, if there is one. While the
+    reference is held the blob can't be removed. A released blob whose content is still
+    stored is referenced again; one that is being removed right now is waited for, and then
+    there is none.
+
+    :param sha256: String hex SHA-256 of the content
+    :param count: Integer number of references to take, one per Image
+    :return: True if the blob exists and was referenced, i.e. the content needs no upload
+    """
+    return bool(Blob.objects.filter(sha256=sha256).update(ref_count=F('ref_count') + count))
+
+
+def store_reference(sha256: str, object_name: str, size: int, count: int = 1) -> Blob:
+    """
+    Records a reference on content that was just uploaded, creating its blob if this is the
+    first copy. Two identical files uploaded at the same time end up sharing one blob; they
+    were written to the same content-addressed object, so nothing is lost.
+
+    :param sha256: String hex SHA-256 of the content
+    :param object_name: String name the content is stored under
+    :param size: Integer size of the content in bytes
+    :param count: Integer number of references to record, one per Image
+    :return: The Blob
+    """
+    with transaction.atomic():
+        blob, created = Blob.objects.select_for_update().get_or_create(
+            sha256=sha256, defaults={'object_name': object_name, 'size': size, 'ref_count': count})
+        if not created:
+            Blob.objects.filter(id=blob.id).update(ref_count=F('ref_count') + count)
+    return blob
+
+
+def release(blob_id: int):
+    """
+    Drops a reference on a blob. Once the last reference is dropped and committed, the blob
+    and its object and renditions in storage are removed, unless it was referenced again.
+
+    :param blob_id: Integer id of the Blob
+    """
+    release_many([blob_id])
+
+
+def release_many(blob_ids: Iterable[int]):
+    """
+    Drops references on blobs with a few queries, however many there are, e.g. for all the
+    images of an album that is deleted. See release().
+
+    :param blob_ids: Integer ids of Blobs, one per reference; an id may repeat
+    """
+    counts = Counter(blob_ids)
+    if not counts:
+        return
+    with transaction.atomic():
+        ref_counts = dict(Blob.objects.select_for_update().filter(id__in=counts, ref_count__gt=0)
+                          .values_list('id', 'ref_count'))
+        # One update per distinct number of dropped references, usually just one
+        by_count = defaultdict(list)
+        for blob_id, ref_count in ref_counts.items():
+            by_count[min(counts[blob_id], ref_count)].append(blob_id)
+        for count, ids in by_count.items():
+            Blob.objects.filter(id__in=ids).update(ref_count=F('ref_count') - count)
+        released = [blob_id for blob_id, ref_count in ref_counts.items() if ref_count <= counts[blob_id]]
+
+        def remove():
+            for blob_id in released:
+                remove_objects(blob_id)
+        transaction.on_commit(remove)
+
+
+def get_renditions(blob: Blob) -> dict:
+    """
+    Looks up renditions already rendered for a blob by another of its Images.
+
+    :param blob: Blob
+    :return: Dict of {rendition}_location fields, empty if none were rendered yet
+    """
+    fields = [f'{name}_location' for name in settings.IMAGE_RENDITIONS]
+    rendered = Image.objects.filter(blob=blob).exclude(**{fields[0]: ''}).values(*fields).first()
+    return rendered or {}
+
+
+def remove_objects(blob_id: int):
+    """
+    Removes a released blob with its object and renditions from storage, unless it was
+    referenced again in the meantime. The storage is cleared while the blob row is locked, so
+    an upload of the same content waits in add_reference() until it is gone and then stores
+    the content anew, instead of pointing an image at a removed object.
+
+    :param blob_id: Integer id of a Blob without references
+    """
+    # Imported here, derivatives imports signals, which imports this module
+    from .derivatives import get_derivative_object_name
+
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(id=blob_id, ref_count=0).first()
+        if blob is None:
+            return
+        object_names = [blob.object_name] + [get_derivative_object_name(blob.object_name, name)
+                                             for name in settings.IMAGE_RENDITIONS]
+        for object_name in object_names:
+            try:
+                file_utils.get_uploader(object_name).remove(object_name)
+            except Exception:
+                logger.exception('Removing %s from storage failed', object_name)
+        blob.delete()
@@ -0,0 +1,89 @@
+import random
+from contextvars import ContextVar
+from typing import Optional
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+# Reads are sent to the replicas in settings.DATABASE_REPLICAS only while a request is being
+# served, and only until it writes. Everything else (the upload workers, management commands,
+# streamed response bodies) reads from the primary, as it usually works on rows that were
+# just written and a lagging replica wouldn't have yet.
+
+class RoutingState:
+    """
+    Where the reads of one request go.
+    """
+    def __init__(self, pinned: bool):
+        # True once the reads have to see the primary's latest writes
+        self.pinned = pinned
+        # True once the request wrote to the primary
+        self.wrote = False
+        # Alias of the replica the request reads from, picked on its first read
+        self.replica = None
+
+
+_current: ContextVar[Optional[RoutingState]] = ContextVar('db_routing', default=None)
+
+
+def start_request(pinned: bool = False) -> RoutingState:
+    """
+    Starts routing the reads of the current request to a replica.
+
+    :param pinned: True to read from the primary all along, e.g. for a client that just wrote
+    :return: RoutingState of the request
+    """
+    state = RoutingState(pinned)
+    _current.set(state)
+    return state
+
+
+def finish_request():
+    """
+    Stops routing reads to a replica; later reads go to the primary again.
+    """
+    _current.set(None)
+
+
+def pin():
+    """
+    Sends the remaining reads of the current request to the primary.
+    """
+    state = _current.get()
+    if state is not None:
+        state.pinned = True
+
+
+def is_pinned() -> bool:
+    state = _current.get()
+    return state is None or state.pinned
+
+
+class ReplicaRouter:
+    """
+    Sends reads to one of the replicas and writes to the primary. A request sticks to one
+    replica, so its queries see the same snapshot of the data, and to the primary once it
+    wrote, so it sees its own writes.
+    """
+    def db_for_read(self, model, **hints):
+        state = _current.get()
+        if state is None or state.pinned or not settings.DATABASE_REPLICAS:
+            return DEFAULT_DB_ALIAS
+        if state.replica not in settings.DATABASE_REPLICAS:
+            state.replica = random.choice(settings.DATABASE_REPLICAS)
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _current.get()
+        if state is not None:
+            state.pinned = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas follow the schema of the primary
+        return db not in settings.DATABASE_REPLICAS
@@ -0,0 +1,128 @@
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.core.files import File
+
+from . import signals, workers
+from .models import Image
+from .utils import file_utils, image_utils
+
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_process_pool() -> Optional[ProcessPoolExecutor]:
+    """
+    Returns the process pool that renders image derivatives, or None when they are rendered
+    in the calling thread (settings.DERIVATIVE_PROCESSES = 0).
+    """
+    global _pool
+    if settings.DERIVATIVE_PROCESSES <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # Forking a process that runs upload threads is not safe, so start fresh interpreters
+                _pool = ProcessPoolExecutor(max_workers=settings.DERIVATIVE_PROCESSES,
+                                            mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def get_derivative_object_name(object_name: str, rendition: str) -> str:
+    """
+    Builds the name of a rendition stored next to the original object.
+
+    :param object_name: String name of the original object in Minio
+    :param rendition: String rendition name, e.g. thumbnail
+    :return: String object name of the rendition
+    """
+    return f'{object_name.rsplit(".", 1)[0]}.{rendition}.jpg'
+
+
+def render(source_path: str) -> Dict[str, str]:
+    """
+    Renders all renditions in settings.IMAGE_RENDITIONS for a local image file.
+
+    :param source_path: String path of the original image
+    :return: Dict of rendition name to the String path of the rendered file
+    """
+    pool = get_process_pool()
+    if pool is None:
+        return image_utils.render_derivatives(source_path, settings.IMAGE_RENDITIONS)
+    return pool.submit(image_utils.render_derivatives, source_path, settings.IMAGE_RENDITIONS).result()
+
+
+def create_derivatives(image_id: int, source_path: str, object_name: str) -> bool:
+    """
+    Renders the thumbnail and medium renditions of an image, stores them as sibling objects
+    of the original and records their locations on the Image. Files that can't be decoded
+    are skipped, so those images keep being shown from their original location.
+
+    :param image_id: Integer id of the Image
+    :param source_path: String path of a local copy of the original image
+    :param object_name: String name of the original object in Minio
+    :return: True if the renditions were stored
+    """
+    try:
+        rendered = render(source_path)
+    except Exception:
+        logger.warning('Could not render derivatives of image %s', image_id, exc_info=True)
+        return False
+
+    locations = {}
+    try:
+        for rendition, path in rendered.items():
+            derivative_name = get_derivative_object_name(object_name, rendition)
+            with open(path, 'rb') as derivative:
+                file_utils.get_uploader(derivative_name).upload(source=File(derivative), object_name=derivative_name,
+                                                                 content_type='image/jpeg')
+            locations[f'{rendition}_location'] = file_utils.get_location(derivative_name)
+    finally:
+        for path in rendered.values():
+            os.remove(path)
+
+    Image.objects.filter(id=image_id).update(**locations)
+    # update() doesn't send post_save; cached lists may show the image from its original location
+    album_id = Image.objects.filter(id=image_id).values_list('album_id', flat=True).first()
+    if album_id is not None:
+        signals.invalidate_on_commit(signals.image_scopes(Image(id=image_id, album_id=album_id)))
+    return True
+
+
+def create_derivatives_from_storage(image_id: int) -> bool:
+    """
+    Renders the renditions of an image that never passed through the staging area, e.g. one
+    uploaded straight to Minio, from a temporary download of the original.
+
+    :param image_id: Integer id of the Image
+    :return: True if the renditions were stored
+    """
+    image = Image.objects.get(id=image_id)
+    object_name = file_utils.get_object_name_from_location(image.location)
+    os.makedirs(settings.UPLOAD_STAGING_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=settings.UPLOAD_STAGING_DIR)
+    os.close(fd)
+    try:
+        file_utils.get_uploader(object_name).download(object_name, path)
+        return create_derivatives(image_id, path, object_name)
+    finally:
+        os.remove(path)
+
+
+def schedule_from_storage(image_id: int):
+    """
+    Renders an image's renditions on the background workers, if there are any. Otherwise
+    the generate_derivatives command picks the image up.
+
+    :param image_id: Integer id of the Image
+    """
+    workers.submit(create_derivatives_from_storage, image_id)
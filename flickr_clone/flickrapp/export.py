@@ -0,0 +1,158 @@
+import csv
+import json
+import tempfile
+from typing import AsyncIterator, Iterable, Iterator
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Album, Image
+from .utils import file_utils
+
+
+# Columns of every export: those of the API serializers, plus the image status. Images fall
+# back to their original where a rendition is missing, and show URLs, like ImageSerializer does.
+FIELDS = {
+    'albums': ('id', 'owner', 'name', 'is_public', 'date_created', 'image_count', 'last_uploaded', 'cover_image'),
+    'images': ('id', 'album', 'title', 'location', 'thumbnail', 'medium', 'date_uploaded', 'status'),
+}
+CONTENT_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+# Bytes read back at a time from a spooled export
+SPOOL_READ_SIZE = 64 * 1024
+
+
+def _image_rows(rows: Iterable[tuple]) -> Iterator[tuple]:
+    url = file_utils.get_public_url
+    for id, album, title, location, thumbnail, medium, date_uploaded, status in rows:
+        yield (id, album, title, url(location), url(thumbnail or location), url(medium or location), date_uploaded,
+               status)
+
+
+def _pages(rows, chunk_size: int) -> Iterator[tuple]:
+    # Every page is a query of its own, for the rows after the last id of the page before.
+    # A cursor would need a transaction open for the whole export, which a transaction
+    # pooler doesn't allow (DISABLE_SERVER_SIDE_CURSORS), and without one the driver
+    # fetches all rows at once.
+    last_id = None
+    while True:
+        page = list((rows if last_id is None else rows.filter(id__gt=last_id))[:chunk_size])
+        yield from page
+        if len(page) < chunk_size:
+            return
+        last_id = page[-1][0]
+
+
+def get_rows(kind: str, chunk_size: int, **filters) -> Iterator[tuple]:
+    """
+    Reads the rows of an export as plain tuples in FIELDS order, without building model
+    instances. They are fetched chunk_size at a time, a page per query ordered by id, so
+    memory stays flat however many rows there are, also through a transaction pooler.
+
+    :param kind: String 'albums' or 'images'
+    :param chunk_size: Integer number of rows fetched at a time
+    :param filters: Filters of the exported rows, e.g. owner=1
+    :return: Iterator of tuples
+    :raises ValueError: if there is no such export
+    """
+    if kind == 'albums':
+        rows = (Album.objects.filter(**filters).order_by('id')
+                .values_list('id', 'owner_id', 'name', 'is_public', 'date_created', 'image_count', 'last_uploaded',
+                             'cover_image_id'))
+        return _pages(rows, chunk_size)
+    if kind == 'images':
+        rows = (Image.objects.filter(**filters).order_by('id')
+                .values_list('id', 'album_id', 'title', 'location', 'thumbnail_location', 'medium_location',
+                             'date_uploaded', 'status'))
+        return _image_rows(_pages(rows, chunk_size))
+    raise ValueError(f'There is no export of {kind}')
+
+
+def _ndjson_lines(kind: str, rows: Iterable[tuple]) -> Iterator[str]:
+    fields = FIELDS[kind]
+    for row in rows:
+        yield json.dumps(dict(zip(fields, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+class _Echo:
+    # csv.writer writes to a file; this one hands every line back instead
+    def write(self, value):
+        return value
+
+
+def _csv_lines(kind: str, rows: Iterable[tuple]) -> Iterator[str]:
+    writer = csv.writer(_Echo())
+    yield writer.writerow(FIELDS[kind])
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def export(kind: str, format: str, chunk_size: int = 2000, **filters) -> Iterator[str]:
+    """
+    Streams all albums or images as NDJSON (one JSON object per line) or CSV with a header.
+    Lines are joined into blocks of chunk_size, so a response isn't written row by row.
+
+    :param kind: String 'albums' or 'images'
+    :param format: String 'ndjson' or 'csv'
+    :param chunk_size: Integer number of rows fetched and written at a time
+    :param filters: Filters of the exported rows, e.g. owner=1
+    :return: Iterator of strings
+    :raises ValueError: if there is no such export or format
+    """
+    if format not in CONTENT_TYPES:
+        raise ValueError(f'Unknown export format {format}')
+    rows = get_rows(kind, chunk_size, **filters)
+    lines = _ndjson_lines(kind, rows) if format == 'ndjson' else _csv_lines(kind, rows)
+    return _join(lines, chunk_size)
+
+
+def _join(lines: Iterator[str], size: int) -> Iterator[str]:
+    block = []
+    for line in lines:
+        block.append(line)
+        if len(block) == size:
+            yield ''.join(block)
+            block = []
+    if block:
+        yield ''.join(block)
+
+
+async def aexport(kind: str, format: str, chunk_size: int = 2000, **filters) -> AsyncIterator[str]:
+    """
+    export() for responses served asynchronously (ASGI, Django 4.2 and later, which consume
+    a sync iterator into memory first). Every block is read on a thread, so the database is
+    never queried on the event loop.
+
+    :raises ValueError: if there is no such export or format
+    """
+    blocks = export(kind, format, chunk_size, **filters)
+    read = sync_to_async(next)
+    while True:
+        block = await read(blocks, None)
+        if block is None:
+            return
+        yield block
+
+
+def spool(kind: str, format: str, chunk_size: int = 2000, **filters) -> Iterator[bytes]:
+    """
+    export() written to a temporary file before anything is returned, then read back from
+    it. For responses served over ASGI before Django 4.2, which iterates them on the event
+    loop where the database can't be queried. Call it where it can, e.g. in a sync view.
+
+    :return: Iterator of UTF-8 encoded blocks, closing the file when it is closed
+    :raises ValueError: if there is no such export or format
+    """
+    file = tempfile.TemporaryFile()
+    try:
+        for block in export(kind, format, chunk_size, **filters):
+            file.write(block.encode('utf-8'))
+        file.seek(0)
+    except BaseException:
+        file.close()
+        raise
+    return _read_file(file)
+
+
+def _read_file(file) -> Iterator[bytes]:
+    with file:
+        yield from iter(lambda: file.read(SPOOL_READ_SIZE), b'')
@@ -1,10 +1,11 @@
-from typing import Union
+from typing import List, Union
 
+from django.core.exceptions import ValidationError
 from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
-from django.forms import FileField, ModelChoiceField, ModelForm
+from django.forms import ClearableFileInput, FileField, Form, ModelChoiceField, ModelForm
 
+from . import uploads
 from .models import Album, Image
-from .utils import file_utils
 
 
 class CreateAlbumForm(ModelForm):
@@ -24,13 +25,45 @@ class UploadImageForm(ModelForm):
         self.fields['album'] = ModelChoiceField(queryset=Album.objects.filter(owner=user))
         self.fields['file'] = FileField()
 
-    def upload_image(self, file: Union[InMemoryUploadedFile, TemporaryUploadedFile], title: str) -> str:
+    def queue_upload(self, file: Union[InMemoryUploadedFile, TemporaryUploadedFile]) -> Image:
         """
-        Uploads an image file and returns the final location.
+        Stages an image file for upload and returns its pending Image.
 
         :param file: Django UploadedFile
-        :param title: String title of the file provided by the User
-        :return: String location of the uploaded file
+        :return: Image that will be uploaded in the background
         """
-        upload_location = file_utils.upload_file(file, title)
-        return upload_location
+        return uploads.queue_upload(file, album=self.cleaned_data['album'], title=self.cleaned_data['title'])
+
+
+class MultipleFileInput(ClearableFileInput):
+    allow_multiple_selected = True
+
+    def value_from_datadict(self, data, files, name):
+        return files.getlist(name)
+
+
+class MultipleFileField(FileField):
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('widget', MultipleFileInput(attrs={'multiple': True}))
+        super().__init__(*args, **kwargs)
+
+    def clean(self, data, initial=None):
+        if not data and self.required:
+            raise ValidationError(self.error_messages['required'], code='required')
+        return [super(MultipleFileField, self).clean(file, initial) for file in data]
+
+
+class BulkUploadImageForm(Form):
+    def __init__(self, *args, **kwargs):
+        user = kwargs.pop('user')
+        super(BulkUploadImageForm, self).__init__(*args, **kwargs)
+        self.fields['album'] = ModelChoiceField(queryset=Album.objects.filter(owner=user))
+        self.fields['files'] = MultipleFileField()
+
+    def queue_uploads(self) -> List[dict]:
+        """
+        Stages all selected image files for upload to the selected album.
+
+        :return: List of per-file results
+        """
+        return uploads.queue_uploads(self.cleaned_data['files'], album=self.cleaned_data['album'])
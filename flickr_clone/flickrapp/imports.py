@@ -0,0 +1,237 @@
+import logging
+import mimetypes
+import os
+import posixpath
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+
+from . import album_stats, blobs, list_cache, metadata, signals
+from .models import Album, Blob, Image, PhotoImport
+from .uploads import get_title
+from .utils import file_utils
+
+
+logger = logging.getLogger(__name__)
+
+# Files with other extensions are passed over
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tif', '.tiff', '.heic'}
+
+
+def _parts(path: str) -> Tuple[str, ...]:
+    return tuple(path.split('/')) if path else ()
+
+
+def walk(root: str, after: str = '') -> Iterator[str]:
+    """
+    Lazily lists the image files below a directory, depth first with the entries of every
+    directory sorted by name, so the order is the same on every run. Only one directory
+    listing is held at a time. Hidden files and symlinked directories are skipped.
+
+    :param root: String path of the directory
+    :param after: String path of a file relative to root; only files after it are listed
+    :return: Iterator of string paths relative to root, with '/' separators
+    """
+    return _walk(root, (), _parts(after))
+
+
+def _walk(root: str, prefix: Tuple[str, ...], after: Tuple[str, ...]) -> Iterator[str]:
+    with os.scandir(os.path.join(root, *prefix)) as entries:
+        entries = sorted(entries, key=lambda entry: entry.name)
+    for entry in entries:
+        if entry.name.startswith('.'):
+            continue
+        parts = prefix + (entry.name,)
+        if entry.is_dir(follow_symlinks=False):
+            # Directories before the one holding the checkpoint were handled completely
+            if after and parts < after[:len(parts)]:
+                continue
+            yield from _walk(root, parts, after)
+        elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS:
+            # Walk order is the order of the path parts, so earlier files compare lower
+            if after and parts <= after:
+                continue
+            yield '/'.join(parts)
+
+
+def _read_file(root: str, path: str) -> dict:
+    full_path = os.path.join(root, *path.split('/'))
+    try:
+        with open(full_path, 'rb') as source:
+            sha256 = file_utils.get_content_hash(File(source))
+        size = os.path.getsize(full_path)
+    except OSError as e:
+        return {'path': path, 'error': str(e)}
+    return {'path': path, 'full_path': full_path, 'sha256': sha256, 'size': size,
+            'object_name': file_utils.get_blob_object_name(sha256, path),
+            'content_type': mimetypes.guess_type(path)[0],
+            'metadata': metadata.read(full_path, path)}
+
+
+def _upload_file(file: dict, max_attempts: int, retry_delay: float) -> Optional[str]:
+    """
+    Uploads a file, retrying with exponential backoff.
+
+    :return: String error of the last attempt, or None if the file was uploaded
+    """
+    for attempt in range(1, max_attempts + 1):
+        try:
+            with open(file['full_path'], 'rb') as source:
+                file_utils.get_uploader(file['object_name']).upload(source=File(source),
+                                                                    object_name=file['object_name'],
+                                                                    content_type=file['content_type'])
+            return None
+        except Exception as e:
+            if attempt == max_attempts:
+                return str(e)
+            logger.warning('Uploading %s failed (attempt %s of %s): %s', file['path'], attempt, max_attempts, e)
+            time.sleep(retry_delay * 2 ** (attempt - 1))
+
+
+class Importer:
+    """
+    Imports a directory tree of photos for a user. Files are handled in batches: the batch
+    is hashed and its new content uploaded concurrently, then its Images are inserted with a
+    single bulk_create in the transaction that also moves the checkpoint past the batch. A
+    crash therefore loses at most the uploads of one batch, which are content addressed and
+    simply written again on the next run.
+    """
+    def __init__(self, root: str, user, album_name: Optional[str] = None, album_per_folder: bool = False,
+                 is_public: bool = False, workers: int = 8, batch_size: int = 500,
+                 max_attempts: Optional[int] = None, retry_delay: float = 1.0, log=None):
+        """
+        :param root: String path of the directory to import
+        :param user: User the albums are created for
+        :param album_name: String name of the album to import into, the directory name by default
+        :param album_per_folder: True to import every folder into an album named after its path
+        :param is_public: True to make new albums public
+        :param workers: Integer number of files hashed and uploaded concurrently
+        :param batch_size: Integer number of files per batch
+        :param max_attempts: Integer number of attempts per upload, settings.UPLOAD_MAX_ATTEMPTS by default
+        :param retry_delay: Float seconds to wait before the first retry, doubled for every further one
+        :param log: Optional callable taking a progress message
+        """
+        self.root = os.path.abspath(root)
+        if not os.path.isdir(self.root):
+            raise ValueError(f'{root} is not a directory')
+        self.user = user
+        self.album_name = album_name or os.path.basename(self.root) or 'Imported photos'
+        self.album_per_folder = album_per_folder
+        self.is_public = is_public
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts or settings.UPLOAD_MAX_ATTEMPTS
+        self.retry_delay = retry_delay
+        self.log = log or (lambda message: None)
+        self.albums: Dict[str, int] = {}
+
+    def run(self, restart: bool = False) -> PhotoImport:
+        """
+        Imports the files not imported by an earlier run of the same directory.
+
+        :param restart: True to start over from the first file
+        :return: PhotoImport with the totals
+        """
+        job, _ = PhotoImport.objects.get_or_create(owner=self.user, root=self.root)
+        if restart:
+            job.last_path = ''
+            job.imported = job.failed = 0
+            job.save()
+        elif job.last_path:
+            self.log(f'Resuming after {job.last_path}')
+
+        paths = walk(self.root, after=job.last_path)
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='import') as executor:
+            while True:
+                batch = list(islice(paths, self.batch_size))
+                if not batch:
+                    break
+                self.import_batch(job, batch, executor)
+                self.log(f'{job.imported} imported, {job.failed} failed, at {job.last_path}')
+        return job
+
+    def get_album_name(self, path: str) -> str:
+        name = (posixpath.dirname(path) or self.album_name) if self.album_per_folder else self.album_name
+        return name[:Album._meta.get_field('name').max_length]
+
+    def get_album_id(self, name: str) -> int:
+        if name not in self.albums:
+            album = Album.objects.filter(owner=self.user, name=name).order_by('id').first()
+            if album is None:
+                album = Album.objects.create(owner=self.user, name=name, is_public=self.is_public,
+                                             date_created=date.today())
+            self.albums[name] = album.id
+        return self.albums[name]
+
+    def import_batch(self, job: PhotoImport, batch: List[str], executor: ThreadPoolExecutor):
+        files = list(executor.map(lambda path: _read_file(self.root, path), batch))
+        hashed = [file for file in files if 'error' not in file]
+        stored = set(Blob.objects.filter(sha256__in={file['sha256'] for file in hashed})
+                     .values_list('sha256', flat=True))
+        # New content is uploaded once, however often it occurs in the batch
+        new = {}
+        for file in hashed:
+            if file['sha256'] not in stored:
+                new.setdefault(file['sha256'], file)
+        upload_errors = dict(zip(new, executor.map(
+            lambda file: _upload_file(file, self.max_attempts, self.retry_delay), new.values())))
+
+        imported = [file for file in hashed if upload_errors.get(file['sha256']) is None]
+        for file in files:
+            error = file.get('error') or upload_errors.get(file.get('sha256'))
+            if error is not None:
+                logger.warning('Importing %s failed: %s', file['path'], error)
+
+        with transaction.atomic():
+            images = self.create_images(imported, new)
+            album_ids = sorted({image.album_id for image in images})
+            # bulk_create() doesn't send signals
+            album_stats.recompute(album_ids)
+            for album_id in album_ids:
+                signals.invalidate_album_on_commit(album_id)
+            signals.invalidate_on_commit([list_cache.all_images_scope()] +
+                                         [list_cache.album_images_scope(album_id) for album_id in album_ids])
+            job.last_path = batch[-1]
+            job.imported += len(images)
+            job.failed += len(files) - len(imported)
+            job.save()
+
+    def create_images(self, files: List[dict], uploaded: Dict[str, dict]) -> List[Image]:
+        counts = Counter(file['sha256'] for file in files)
+        renditions = {}
+        for sha256, count in counts.items():
+            if sha256 in uploaded:
+                blobs.store_reference(sha256, uploaded[sha256]['object_name'], uploaded[sha256]['size'], count)
+            elif blobs.add_reference(sha256, count):
+                # Content stored before shares its renditions, if they were rendered
+                renditions[sha256] = blobs.get_renditions(Blob.objects.get(sha256=sha256))
+            else:
+                # The blob was released since the batch was hashed, so its content is gone
+                file = next(file for file in files if file['sha256'] == sha256)
+                error = _upload_file(file, self.max_attempts, self.retry_delay)
+                if error is not None:
+                    raise IOError(f'Uploading {file["path"]} failed: {error}')
+                blobs.store_reference(sha256, file['object_name'], file['size'], count)
+        stored = {blob.sha256: blob for blob in Blob.objects.filter(sha256__in=counts)}
+
+        today = date.today()
+        images = []
+        for file in files:
+            blob = stored[file['sha256']]
+            images.append(Image(album_id=self.get_album_id(self.get_album_name(file['path'])),
+                                title=get_title(file['path']),
+                                location=file_utils.get_location(blob.object_name),
+                                date_uploaded=today,
+                                status=Image.Status.READY,
+                                blob=blob,
+                                **file['metadata'],
+                                **renditions.get(file['sha256'], {})))
+        Image.objects.bulk_create(images)
+        return images
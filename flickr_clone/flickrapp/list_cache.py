@@ -0,0 +1,95 @@
+import hashlib
+import time
+import uuid
+from typing import Iterable, List
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import db_router
+from .utils import metrics
+
+
+# Cached list responses are keyed by the current version of every scope they were built from.
+# Writes replace the versions of the scopes they affect, which orphans exactly those entries;
+# the orphans simply expire. Versions are random tokens rather than counters, so a version
+# that got evicted can never come back with a value some stale entry was stored under.
+# They start with the time they were made: for a while after a write the read replicas may
+# not have it yet, so responses cached under a new version are built from the primary.
+
+def public_albums_scope() -> str:
+    return 'albums:public'
+
+
+def all_albums_scope() -> str:
+    return 'albums:all'
+
+
+def owner_albums_scope(owner_id) -> str:
+    return f'albums:owner:{owner_id}'
+
+
+def user_albums_scope(username: str) -> str:
+    return f'albums:user:{username}'
+
+
+def album_images_scope(album_id) -> str:
+    return f'images:album:{album_id}'
+
+
+def all_images_scope() -> str:
+    return 'images:all'
+
+
+def _version_key(scope: str) -> str:
+    return f'listcache:version:{scope}'
+
+
+def _new_version() -> str:
+    return f'{int(time.time()):x}-{uuid.uuid4().hex[:12]}'
+
+
+def _is_recent(version: str) -> bool:
+    created, _, _ = version.rpartition('-')
+    try:
+        return time.time() - int(created, 16) < settings.REPLICA_PIN_SECONDS
+    except ValueError:
+        return False
+
+
+def get_key(scopes: Iterable[str], *parts) -> str:
+    """
+    Builds the cache key of a list response.
+
+    :param scopes: Strings naming the data the response was built from
+    :param parts: Anything else the response varies by, e.g. the path and the viewer
+    :return: String cache key
+    """
+    scopes = list(scopes)
+    versions = cache.get_many([_version_key(scope) for scope in scopes])
+    versions = [versions.get(_version_key(scope)) or cache.get_or_set(_version_key(scope), _new_version(), None)
+                for scope in scopes]
+    if any(_is_recent(version) for version in versions):
+        db_router.pin()
+    stamp = ':'.join(versions)
+    digest = hashlib.md5(':'.join(map(str, parts)).encode('utf-8')).hexdigest()
+    return f'listcache:{":".join(scopes)}:{stamp}:{digest}'
+
+
+def invalidate(scopes: List[str]):
+    """
+    Invalidates every cached list response built from any of the given scopes.
+
+    :param scopes: Strings naming the data that changed
+    """
+    cache.set_many({_version_key(scope): _new_version() for scope in scopes}, timeout=None)
+
+
+def lookup(key: str):
+    value = cache.get(key)
+    metrics.record_cache(value is not None)
+    return value
+
+
+def store(key: str, value):
+    cache.set(key, value, timeout=settings.LIST_CACHE_TIMEOUT)
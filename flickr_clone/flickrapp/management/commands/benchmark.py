@@ -0,0 +1,44 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from flickrapp import benchmarks
+
+
+class Command(BaseCommand):
+    help = ('Benchmarks the album and image lists of the web app and the API, and the upload path against '
+            'in-memory fake storage, on the data created by seed_benchmark. Reports latency percentiles, '
+            'throughput and query counts per endpoint. With --baseline it fails when an endpoint got slower '
+            'or makes more queries than in an earlier run saved with --output.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=100, help='Number of requests per endpoint')
+        parser.add_argument('--cold', action='store_true', help='Clear the cache before every request')
+        parser.add_argument('--skip-uploads', action='store_true', help='Only benchmark the read endpoints')
+        parser.add_argument('--output', default=None, help='Write the results to this JSON file')
+        parser.add_argument('--baseline', default=None, help='JSON file of an earlier run to compare with')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Fraction the p95 latency may grow by before it counts as a regression')
+
+    def handle(self, *args, **options):
+        try:
+            results = benchmarks.run(iterations=options['iterations'], cold=options['cold'],
+                                     include_uploads=not options['skip_uploads'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f"{'endpoint':<20}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+                          f"{'queries':>9}{'errors':>8}")
+        for name, summary in results.items():
+            self.stdout.write(f"{name:<20}{summary['rps']:>9.1f}{summary['p50']:>9.1f}{summary['p95']:>9.1f}"
+                              f"{summary['p99']:>9.1f}{summary['queries']:>9.1f}{summary['errors']:>8}")
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+        if options['baseline']:
+            with open(options['baseline']) as baseline:
+                regressions = benchmarks.compare(results, json.load(baseline), options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions'))
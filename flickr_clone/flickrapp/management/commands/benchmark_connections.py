@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from flickrapp import benchmarks
+
+
+class Command(BaseCommand):
+    help = ('Measures what database connections cost per request: a cheap request (one query) is run with a '
+            'new connection every time (CONN_MAX_AGE=0), with a persistent connection, and with a persistent '
+            'connection that is health checked before every request. Point DATABASE_HOST at pgbouncer to '
+            'measure connecting through it.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=500, help='Number of requests per run')
+        parser.add_argument('--max-age', type=int, default=600, help='CONN_MAX_AGE of the persistent runs')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Alias of the database to measure')
+
+    def handle(self, *args, **options):
+        results = benchmarks.compare_connections(iterations=options['iterations'], max_age=options['max_age'],
+                                                 using=options['database'])
+        self.stdout.write(f"{'run':<36}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'connections':>13}")
+        for name, summary in results.items():
+            self.stdout.write(f"{name:<36}{summary['rps']:>9.1f}{summary['p50']:>9.2f}{summary['p95']:>9.2f}"
+                              f"{summary['connections']:>13}")
@@ -0,0 +1,38 @@
+import asyncio
+
+from django.core.management.base import BaseCommand, CommandError
+
+from flickrapp.utils import load_utils
+
+
+class Command(BaseCommand):
+    help = ('Compares the throughput of running deployments on the album list endpoints, e.g. runserver against '
+            'gunicorn: benchmark_servers --server runserver=http://localhost:8000 '
+            '--server gunicorn=http://localhost:8080. The album list of the web app is requested from both '
+            'its sync and its async view. Seed the data with seed_benchmark first.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', action='append', required=True, metavar='NAME=URL',
+                            help='Deployment to measure, by name and base URL; repeat for every deployment')
+        parser.add_argument('--path', action='append', default=None,
+                            help='Path to request, repeatable; the album lists of the web app, sync and async, '
+                                 'and the API by default')
+        parser.add_argument('--requests', type=int, default=1000, help='Number of requests per deployment and path')
+        parser.add_argument('--concurrency', type=int, default=50, help='Number of concurrent clients')
+
+    def handle(self, *args, **options):
+        servers = {}
+        for server in options['server']:
+            name, _, url = server.partition('=')
+            if not url:
+                raise CommandError(f'--server must be NAME=URL, not {server}')
+            servers[name] = url
+        paths = options['path'] or ['/flickr/albums/', '/flickr/async/albums/', '/api/v1/albums/']
+        results = asyncio.run(load_utils.compare_servers(servers, paths, requests=options['requests'],
+                                                         concurrency=options['concurrency']))
+
+        self.stdout.write(f"{'server':<16}{'path':<24}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+        for name, summaries in results.items():
+            for path, summary in summaries.items():
+                self.stdout.write(f"{name:<16}{path:<24}{summary['rps']:>9.1f}{summary['p50']:>9.1f}"
+                                  f"{summary['p95']:>9.1f}{summary['p99']:>9.1f}{summary['errors']:>8}")
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from flickrapp import export
+
+
+class Command(BaseCommand):
+    help = ('Exports all albums or images as NDJSON or CSV to a file or stdout, reading and writing them in '
+            'chunks so memory stays flat.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(export.FIELDS), help='What to export')
+        parser.add_argument('--format', choices=sorted(export.CONTENT_TYPES), default='ndjson')
+        parser.add_argument('--output', default=None, help='File to write to; stdout if omitted')
+        parser.add_argument('--chunk-size', type=int, default=settings.EXPORT_CHUNK_SIZE,
+                            help='Number of rows read and written at a time')
+
+    def handle(self, *args, **options):
+        blocks = export.export(options['kind'], options['format'], options['chunk_size'])
+        if options['output'] is None:
+            for block in blocks:
+                self.stdout.write(block, ending='')
+            return
+        # newline='' leaves the CSV line endings alone
+        with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+            for block in blocks:
+                output.write(block)
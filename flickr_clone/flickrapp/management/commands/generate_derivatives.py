@@ -0,0 +1,43 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from flickrapp import derivatives, workers
+from flickrapp.models import Image
+
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = ('Renders the thumbnail and medium renditions of stored images that don\'t have them yet, '
+            'e.g. images uploaded straight to storage or uploaded before renditions existed.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=max(settings.UPLOAD_WORKER_THREADS, 1),
+                            help='Number of images processed concurrently')
+        parser.add_argument('--limit', type=int, default=None, help='Stop after this many images')
+
+    def handle(self, *args, **options):
+        image_ids = (Image.objects.filter(status=Image.Status.READY, thumbnail_location='')
+                     .order_by('id').values_list('id', flat=True))
+        if options['limit'] is not None:
+            image_ids = image_ids[:options['limit']]
+
+        count = 0
+        with ThreadPoolExecutor(max_workers=options['workers'], thread_name_prefix='derivatives') as executor:
+            batch = []
+            for image_id in image_ids.iterator(chunk_size=BATCH_SIZE):
+                batch.append(image_id)
+                if len(batch) == BATCH_SIZE:
+                    count += self.process(executor, batch)
+                    batch = []
+            count += self.process(executor, batch)
+        self.stdout.write(self.style.SUCCESS(f'Processed {count} image(s)'))
+
+    @staticmethod
+    def process(executor, image_ids):
+        list(executor.map(lambda image_id: workers.run_task(derivatives.create_derivatives_from_storage, image_id),
+                          image_ids))
+        return len(image_ids)
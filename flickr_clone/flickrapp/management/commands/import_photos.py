@@ -0,0 +1,35 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from flickrapp.imports import Importer
+
+
+class Command(BaseCommand):
+    help = ('Imports a directory tree of photos for a user, uploading them concurrently and inserting them in '
+            'batches. An interrupted import resumes after the last finished batch when run again. Renditions of '
+            'new content are rendered afterwards by generate_derivatives.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Directory to import')
+        parser.add_argument('--user', required=True, help='Username of the owner of the imported photos')
+        parser.add_argument('--album', default=None, help='Album to import into, the directory name by default')
+        parser.add_argument('--album-per-folder', action='store_true',
+                            help='Import every folder into an album named after its path')
+        parser.add_argument('--public', action='store_true', help='Make new albums public')
+        parser.add_argument('--workers', type=int, default=8, help='Number of files uploaded concurrently')
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of files inserted at a time')
+        parser.add_argument('--restart', action='store_true', help='Start over instead of resuming')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['user']).first()
+        if user is None:
+            raise CommandError(f'There is no user {options["user"]}')
+        try:
+            importer = Importer(options['directory'], user, album_name=options['album'],
+                                album_per_folder=options['album_per_folder'], is_public=options['public'],
+                                workers=options['workers'], batch_size=options['batch_size'],
+                                log=self.stdout.write)
+        except ValueError as e:
+            raise CommandError(str(e))
+        job = importer.run(restart=options['restart'])
+        self.stdout.write(self.style.SUCCESS(f'Imported {job.imported} photo(s), {job.failed} failed'))
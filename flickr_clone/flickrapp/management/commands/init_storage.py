@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from flickrapp.utils.file_utils import MinioUploader, get_nodes
+
+
+class Command(BaseCommand):
+    help = 'Creates the object storage buckets of every storage node if they do not exist yet'
+
+    def handle(self, *args, **options):
+        for node in get_nodes():
+            uploader = MinioUploader(node)
+            uploader.ensure_bucket()
+            self.stdout.write(self.style.SUCCESS(f'Bucket "{uploader.bucket_name}" on {node.endpoint} is ready'))
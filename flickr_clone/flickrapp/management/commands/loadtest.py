@@ -0,0 +1,52 @@
+import asyncio
+
+from django.core.management.base import BaseCommand, CommandError
+
+from flickrapp.utils import load_utils
+
+
+class Command(BaseCommand):
+    help = ('Load tests a running server: measures the latency of GET requests to every URL in turn, optionally '
+            'while slow uploads hold connections open. Compare the sync and the async views (flickrapp.async_views) '
+            'on the ASGI deployment, and both against the WSGI deployment, with the same arguments, e.g. '
+            'loadtest http://localhost:8001/flickr/albums/ http://localhost:8001/flickr/async/albums/ '
+            '--slow-upload-url http://localhost:8001/flickr/async/upload-image/ '
+            '--slow-uploads 50 --album 1 --cookie "sessionid=..." '
+            'The slow uploads are real uploads to the album, by the user whose session cookie is given; '
+            'send them to /flickr/upload-image/ to load the sync upload view instead.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', nargs='+',
+                            help='URL requested by the measured clients; several are measured one after the other')
+        parser.add_argument('--requests', type=int, default=500, help='Total number of measured requests')
+        parser.add_argument('--concurrency', type=int, default=20, help='Number of concurrent measured clients')
+        parser.add_argument('--slow-upload-url', default=None, help='URL the slow uploads are POSTed to')
+        parser.add_argument('--slow-uploads', type=int, default=0, help='Number of concurrent slow uploads')
+        parser.add_argument('--upload-size', type=int, default=5 * 1024 * 1024, help='Bytes per slow upload')
+        parser.add_argument('--upload-duration', type=float, default=30.0,
+                            help='Seconds each slow upload takes to send its body')
+        parser.add_argument('--album', type=int, default=None, help='Id of the album the slow uploads go to')
+        parser.add_argument('--cookie', default=None, help='Cookie header sent with every request, e.g. a session')
+
+    def handle(self, *args, **options):
+        upload_fields = None
+        if options['slow_upload_url'] and options['slow_uploads']:
+            if options['album'] is None or not options['cookie']:
+                raise CommandError('Slow uploads need --album and the --cookie of a session of its owner')
+            upload_fields = {'album': str(options['album']), 'title': 'Load test upload'}
+        headers = {'Cookie': options['cookie']} if options['cookie'] else None
+        for url in options['url']:
+            summary = asyncio.run(load_utils.run_load(url=url,
+                                                      requests=options['requests'],
+                                                      concurrency=options['concurrency'],
+                                                      slow_upload_url=options['slow_upload_url'],
+                                                      slow_uploads=options['slow_uploads'],
+                                                      upload_size=options['upload_size'],
+                                                      upload_duration=options['upload_duration'],
+                                                      upload_fields=upload_fields,
+                                                      headers=headers))
+            self.stdout.write(url)
+            self.stdout.write(f"  {summary['requests']} requests, {summary['errors']} errors, "
+                              f"{summary['rps']:.1f} req/s")
+            self.stdout.write(f"  latency ms: p50 {summary['p50']:.1f}  p95 {summary['p95']:.1f}  "
+                              f"p99 {summary['p99']:.1f}  max {summary['max']:.1f}")
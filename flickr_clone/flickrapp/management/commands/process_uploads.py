@@ -0,0 +1,39 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from flickrapp import uploads
+from flickrapp.models import Image
+
+
+class Command(BaseCommand):
+    help = ('Pushes staged uploads to object storage. Use this as the upload worker when '
+            'UPLOAD_WORKER_THREADS is 0, or to retry uploads that failed on the in-process workers '
+            'and uploads left claimed by workers that died.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=max(settings.UPLOAD_WORKER_THREADS, 1),
+                            help='Number of concurrent uploads')
+        parser.add_argument('--once', action='store_true',
+                            help='Process the uploads pending right now and exit instead of polling')
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help='Seconds to wait between polls when there is nothing to upload')
+
+    def handle(self, *args, **options):
+        with ThreadPoolExecutor(max_workers=options['workers'], thread_name_prefix='upload') as executor:
+            while True:
+                requeued = uploads.requeue_stale_claims()
+                if requeued:
+                    self.stdout.write(f'Requeued {requeued} stale upload(s)')
+                pending_ids = list(Image.objects.filter(status=Image.Status.PENDING)
+                                   .order_by('id').values_list('id', flat=True)[:options['workers'] * 10])
+                if pending_ids:
+                    # Failures are logged by the worker and retried on a later poll
+                    list(executor.map(uploads.run_upload, pending_ids))
+                    self.stdout.write(f'Processed {len(pending_ids)} upload(s)')
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(options['interval'])
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from flickrapp import rebalance
+
+
+class Command(BaseCommand):
+    help = ('Moves stored images and their renditions to the storage node the hash ring puts them on, '
+            'e.g. after a node was added to settings.STORAGE_NODES. Objects stored before keys named '
+            'their node are moved too. Safe to interrupt and run again.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only list the objects that would be moved')
+        parser.add_argument('--limit', type=int, default=None, help='Stop after this many objects')
+
+    def handle(self, *args, **options):
+        log = self.stdout.write if options['verbosity'] > 1 or options['dry_run'] else None
+        count = rebalance.rebalance(dry_run=options['dry_run'], limit=options['limit'], log=log)
+        verb = 'Would move' if options['dry_run'] else 'Moved'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {count} object(s)'))
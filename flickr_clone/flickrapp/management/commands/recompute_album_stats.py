@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from flickrapp import album_stats, list_cache, signals
+from flickrapp.models import Album
+
+
+class Command(BaseCommand):
+    help = ('Recomputes the image count, last upload date and cover image of albums from their images, '
+            'e.g. after bulk imports or to repair drift.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--album', type=int, action='append', dest='albums',
+                            help='Id of an album to recompute, may be repeated; all albums if omitted')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of albums updated at a time')
+
+    def handle(self, *args, **options):
+        albums = Album.objects.select_related('owner').order_by('id')
+        if options['albums']:
+            albums = albums.filter(id__in=options['albums'])
+
+        count = 0
+        batch = []
+        for album in albums.iterator(chunk_size=options['batch_size']):
+            batch.append(album)
+            if len(batch) == options['batch_size']:
+                count += self.recompute(batch)
+                batch = []
+        count += self.recompute(batch)
+        self.stdout.write(self.style.SUCCESS(f'Recomputed {count} album(s)'))
+
+    @staticmethod
+    def recompute(albums):
+        if not albums:
+            return 0
+        count = album_stats.recompute([album.id for album in albums])
+        list_cache.invalidate(sorted({scope for album in albums for scope in signals.album_scopes(album)}))
+        return count
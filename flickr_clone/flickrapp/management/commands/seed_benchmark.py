@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from flickrapp import benchmarks
+
+
+class Command(BaseCommand):
+    help = (f'Seeds synthetic users ({benchmarks.USERNAME_PREFIX}*), albums and images into the configured database '
+            'for the benchmark command. Run it against a benchmark database, not production.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help='Number of users to create')
+        parser.add_argument('--albums', type=int, default=1000, help='Number of albums to create')
+        parser.add_argument('--images', type=int, default=100000, help='Number of images to create, e.g. 1000000')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Number of rows per insert')
+        parser.add_argument('--clear', action='store_true', help='Delete the synthetic data instead')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            benchmarks.clear(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS('Cleared the benchmark data'))
+            return
+        benchmarks.seed(users=options['users'], albums=options['albums'], images=options['images'],
+                        batch_size=options['batch_size'], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS('Seeded the benchmark data'))
@@ -0,0 +1,71 @@
+import logging
+from datetime import timezone
+from io import BytesIO
+from typing import BinaryIO, Union
+
+from django.conf import settings
+from django.utils.timezone import make_aware
+
+from . import signals, workers
+from .models import Image
+from .utils import file_utils, image_utils
+
+
+logger = logging.getLogger(__name__)
+
+
+def read(source: Union[str, BinaryIO], image_id=None) -> dict:
+    """
+    Reads the metadata of an image file as Image fields. Files that aren't images Pillow can
+    read get an empty exif, so they aren't tried again.
+
+    :param source: String path or binary file object of the image
+    :param image_id: Optional integer id of the Image, for the log
+    :return: Dict of Image field values
+    """
+    try:
+        metadata = image_utils.read_metadata(source)
+    except Exception as e:
+        # Not worth a warning, derivatives already warns about files it can't decode
+        logger.info('Could not read the metadata of image %s: %s', image_id, e)
+        return {'exif': {}}
+    if metadata['taken_at'] is not None:
+        # Cameras record local time without a zone; it is stored as if it were UTC
+        metadata['taken_at'] = make_aware(metadata['taken_at'], timezone.utc)
+    return metadata
+
+
+def store_from_storage(image_id: int) -> bool:
+    """
+    Reads and records the metadata of a stored image that doesn't have it, e.g. one uploaded
+    straight to Minio or before metadata was read. Only the first
+    settings.METADATA_HEADER_BYTES of the object are downloaded.
+
+    :param image_id: Integer id of the Image
+    :return: True if the image had metadata to read
+    """
+    image = Image.objects.filter(id=image_id, exif__isnull=True).values('album_id', 'location').first()
+    if image is None:
+        return False
+    object_name = file_utils.get_object_name_from_location(image['location'])
+    stored = file_utils.get_uploader(object_name).open(object_name, length=settings.METADATA_HEADER_BYTES)
+    try:
+        header = stored.read()
+    finally:
+        stored.close()
+        stored.release_conn()
+
+    Image.objects.filter(id=image_id).update(**read(BytesIO(header), image_id))
+    # update() doesn't send post_save; the API lists show the metadata
+    signals.invalidate_on_commit(signals.image_scopes(Image(id=image_id, album_id=image['album_id'])))
+    return True
+
+
+def schedule_from_storage(image_id: int):
+    """
+    Reads an image's metadata on the background workers, if there are any. Otherwise the
+    extract_metadata command picks the image up.
+
+    :param image_id: Integer id of the Image
+    """
+    workers.submit(store_from_storage, image_id)
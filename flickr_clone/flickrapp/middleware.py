@@ -0,0 +1,80 @@
+import json
+import logging
+import random
+
+from django.conf import settings
+from django.utils.deprecation import MiddlewareMixin
+
+from . import db_router
+from .utils import metrics
+
+
+logger = logging.getLogger('flickrapp.requests')
+slow_logger = logging.getLogger('flickrapp.slow_requests')
+
+
+class RequestMetricsMiddleware(MiddlewareMixin):
+    """
+    Records where every request spends its time: in the database, the list cache, object
+    storage, or the rest (Python). The numbers are exported as Prometheus metrics, logged as
+    one JSON line per request, and a sample of slow requests is logged with their queries.
+
+    Goes first in MIDDLEWARE, so the time of all other middleware is included.
+    """
+    def process_request(self, request):
+        request._metrics = metrics.start_request(max_queries=settings.SLOW_REQUEST_MAX_QUERIES)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics.view = request.resolver_match.view_name
+
+    def process_response(self, request, response):
+        stats = getattr(request, '_metrics', None)
+        if stats is None:
+            return response
+        duration = metrics.finish_request(stats, request.method, response.status_code)
+        record = {
+            'view': stats.view or 'unresolved',
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 2),
+            'db_queries': stats.queries,
+            'db_ms': round(stats.query_time * 1000, 2),
+            'cache_hits': stats.cache_hits,
+            'cache_misses': stats.cache_misses,
+            'storage_calls': stats.storage_calls,
+            'storage_bytes': stats.storage_bytes,
+            'storage_ms': round(stats.storage_time * 1000, 2),
+            'python_ms': round((duration - stats.query_time - stats.storage_time) * 1000, 2),
+        }
+        logger.info(json.dumps(record))
+        if duration >= settings.SLOW_REQUEST_THRESHOLD and random.random() < settings.SLOW_REQUEST_SAMPLE_RATE:
+            record['queries'] = [{'sql': sql, 'ms': round(seconds * 1000, 2)} for sql, seconds in stats.query_log]
+            slow_logger.warning(json.dumps(record))
+        return response
+
+
+class ReplicaRoutingMiddleware(MiddlewareMixin):
+    """
+    Lets the reads of a request go to a read replica, see flickrapp.db_router. Requests that
+    may write read from the primary, and so do all requests of a client for
+    settings.REPLICA_PIN_SECONDS after it wrote, so it sees its own changes at once rather
+    than after the replicas caught up. The client is recognised by a cookie.
+
+    Goes before SessionMiddleware, so session reads are routed and session writes count.
+    """
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+    def process_request(self, request):
+        pinned = request.method not in self.SAFE_METHODS or settings.REPLICA_PIN_COOKIE in request.COOKIES
+        request._db_routing = db_router.start_request(pinned=pinned)
+
+    def process_response(self, request, response):
+        state = getattr(request, '_db_routing', None)
+        if state is None:
+            return response
+        db_router.finish_request()
+        if state.wrote:
+            response.set_cookie(settings.REPLICA_PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS,
+                                httponly=True, samesite='Lax')
+        return response
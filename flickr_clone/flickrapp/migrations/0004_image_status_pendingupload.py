@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flickrapp', '0003_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('uploading', 'Uploading'), ('ready', 'Ready'), ('failed', 'Failed')], default='ready', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='PendingUpload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('staging_path', models.CharField(max_length=255)),
+                ('object_name', models.CharField(max_length=120)),
+                ('content_type', models.CharField(blank=True, max_length=100)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('image', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='pending_upload', to='flickrapp.image')),
+            ],
+            options={
+                'ordering': ['date_created'],
+            },
+        ),
+    ]
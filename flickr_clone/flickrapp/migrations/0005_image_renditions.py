@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flickrapp', '0004_image_status_pendingupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='medium_location',
+            field=models.CharField(blank=True, max_length=120),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='thumbnail_location',
+            field=models.CharField(blank=True, max_length=120),
+        ),
+    ]
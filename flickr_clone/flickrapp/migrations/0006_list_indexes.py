@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:17
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flickrapp', '0005_image_renditions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['owner', 'date_created', 'id'], name='album_owner_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(condition=models.Q(('is_public', True)), fields=['owner', 'date_created', 'id'], name='album_owner_public_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(condition=models.Q(('is_public', True)), fields=['date_created', 'id'], name='album_public_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['date_created', 'id'], name='album_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['album', 'date_uploaded', 'id'], name='image_album_uploaded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(condition=models.Q(('status', 'ready')), fields=['album', 'date_uploaded', 'id'], name='image_album_ready_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['date_uploaded', 'id'], name='image_uploaded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['id'], name='image_pending_idx'),
+        ),
+        # The composite indexes lead with the foreign keys, so their own indexes can go
+        migrations.AlterField(
+            model_name='album',
+            name='owner',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='album',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='flickrapp.album'),
+        ),
+    ]
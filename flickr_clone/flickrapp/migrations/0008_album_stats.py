@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_album_stats(apps, schema_editor):
+    Album = apps.get_model('flickrapp', 'Album')
+    Image = apps.get_model('flickrapp', 'Image')
+    ready = Image.objects.filter(album=OuterRef('pk'), status='ready')
+    count = ready.order_by().values('album').annotate(count=Count('id')).values('count')
+    Album.objects.update(
+        image_count=Coalesce(Subquery(count), 0),
+        last_uploaded=Subquery(ready.order_by('-date_uploaded').values('date_uploaded')[:1]),
+        cover_image=Subquery(ready.order_by('-date_uploaded', '-id').values('id')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flickrapp', '0007_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='album',
+            name='cover_image',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='flickrapp.image'),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='image_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='last_uploaded',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_album_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:46
+
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+# (table, text column) of every searchable model. The vectors use the 'simple' configuration:
+# names and titles are short and in any language, so words are matched as typed rather than
+# stemmed as English; partial words are matched by the trigram indexes.
+SEARCHABLE = [('flickrapp_album', 'name'), ('flickrapp_image', 'title')]
+
+
+def create_search_indexes(apps, schema_editor):
+    # tsvector, triggers and GIN are Postgres only; elsewhere search falls back to LIKE
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, column in SEARCHABLE:
+        schema_editor.execute(f'''
+            CREATE FUNCTION {table}_search_vector() RETURNS trigger AS $$
+            BEGIN
+                NEW.search_vector := to_tsvector('simple', coalesce(NEW.{column}, ''));
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+        ''')
+        # Triggers rather than signals, so bulk_create() and update() keep the vectors current too.
+        # save() writes the stale vector back, so updates of it recompute it as well.
+        schema_editor.execute(f'''
+            CREATE TRIGGER {table}_search_vector BEFORE INSERT OR UPDATE OF {column}, search_vector ON {table}
+            FOR EACH ROW EXECUTE PROCEDURE {table}_search_vector()
+        ''')
+        schema_editor.execute(f"UPDATE {table} SET search_vector = to_tsvector('simple', coalesce({column}, ''))")
+        schema_editor.execute(f'CREATE INDEX {table}_search_idx ON {table} USING gin (search_vector)')
+        schema_editor.execute(f'CREATE INDEX {table}_{column}_trgm_idx ON {table} USING gin ({column} gin_trgm_ops)')
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, column in SEARCHABLE:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {table}_{column}_trgm_idx')
+        schema_editor.execute(f'DROP INDEX IF EXISTS {table}_search_idx')
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {table}_search_vector ON {table}')
+        schema_editor.execute(f'DROP FUNCTION IF EXISTS {table}_search_vector()')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flickrapp', '0008_album_stats'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='album',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flickrapp', '0010_photo_import'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='camera_make',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='camera_model',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='exif',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='orientation',
+            field=models.CharField(blank=True, choices=[('landscape', 'Landscape'), ('portrait', 'Portrait'), ('square', 'Square')], max_length=10),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='taken_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['taken_at', 'id'], name='image_taken_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['camera_model'], name='image_camera_model_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(condition=models.Q(('exif__isnull', True)), fields=['id'], name='image_no_exif_idx'),
+        ),
+    ]
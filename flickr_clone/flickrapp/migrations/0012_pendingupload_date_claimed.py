@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flickrapp', '0011_image_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pendingupload',
+            name='date_claimed',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,25 +1,177 @@
 from django.conf import settings
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, router, transaction
+
+from .utils import file_utils
 
 
 class Album(models.Model):
-    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    # Indexed as the leading column of the composite indexes in Meta
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False)
     name = models.CharField(verbose_name="Album name", max_length=80)
     is_public = models.BooleanField(verbose_name="Public?")
     date_created = models.DateField()
+    # Denormalized from the album's ready images, see album_stats; kept up to date on every
+    # image write so the album lists don't have to aggregate over the image table
+    image_count = models.PositiveIntegerField(default=0)
+    last_uploaded = models.DateField(null=True, blank=True)
+    cover_image = models.ForeignKey('Image', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    # Full-text index of the name, written by a database trigger on Postgres, see search
+    search_vector = SearchVectorField(null=True, editable=False)
 
     def __str__(self):
         return self.name
 
     class Meta:
         ordering = ["date_created"]
+        # One index per list query, each in the (date_created, id) order the lists page by
+        indexes = [
+            # A user's own albums, API ?owner=
+            models.Index(fields=['owner', 'date_created', 'id'], name='album_owner_created_idx'),
+            # Another user's albums, which only include the public ones
+            models.Index(fields=['owner', 'date_created', 'id'], name='album_owner_public_idx',
+                         condition=models.Q(is_public=True)),
+            # All public albums
+            models.Index(fields=['date_created', 'id'], name='album_public_created_idx',
+                         condition=models.Q(is_public=True)),
+            # All albums (API)
+            models.Index(fields=['date_created', 'id'], name='album_created_idx'),
+            # The GIN indexes behind search are Postgres only, see migration 0009_search
+        ]
+
+
+class Blob(models.Model):
+    """
+    A stored object, keyed by the SHA-256 of its content and shared by every Image with that
+    content. ref_count is the number of Images pointing at it; the object is removed from
+    storage together with the row once it drops to zero.
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    object_name = models.CharField(max_length=120)
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    date_created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.sha256
 
 
 class Image(models.Model):
-    album = models.ForeignKey(Album, on_delete=models.CASCADE)
+    class Status(models.TextChoices):
+        # Stored in the staging area, waiting for an upload worker
+        PENDING = 'pending'
+        # Claimed by an upload worker
+        UPLOADING = 'uploading'
+        READY = 'ready'
+        FAILED = 'failed'
+
+    class Orientation(models.TextChoices):
+        LANDSCAPE = 'landscape'
+        PORTRAIT = 'portrait'
+        SQUARE = 'square'
+
+    # Indexed as the leading column of the composite indexes in Meta
+    album = models.ForeignKey(Album, on_delete=models.CASCADE, db_index=False)
     title = models.CharField(verbose_name="Photo title", max_length=80)
     location = models.CharField(max_length=120)
     date_uploaded = models.DateField()
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.READY)
+    # Smaller renditions stored next to the original, blank until they have been rendered
+    thumbnail_location = models.CharField(max_length=120, blank=True)
+    medium_location = models.CharField(max_length=120, blank=True)
+    # The stored content behind location; null until uploaded, and for images uploaded straight to storage
+    blob = models.ForeignKey(Blob, on_delete=models.PROTECT, null=True, blank=True, related_name='images')
+    # Full-text index of the title, written by a database trigger on Postgres, see search
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    # Read from the file header when the image is stored, see metadata. Dimensions and
+    # orientation are as displayed, i.e. after the EXIF rotation.
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    orientation = models.CharField(max_length=10, choices=Orientation.choices, blank=True)
+    # When the photo was taken according to the camera, which doesn't record a time zone
+    taken_at = models.DateTimeField(null=True, blank=True)
+    camera_make = models.CharField(max_length=64, blank=True)
+    camera_model = models.CharField(max_length=64, blank=True)
+    # Further EXIF tags, e.g. the exposure; null until the metadata was read
+    exif = models.JSONField(null=True, blank=True)
+
+    def save(self, *args, **kwargs):
+        # The post_save receivers update the album stats, which have to commit with the image.
+        # Deletes need no such care, Django runs their post_delete receivers in a transaction.
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(Image, instance=self)):
+            super().save(*args, **kwargs)
 
     class Meta:
         ordering = ['date_uploaded']
+        indexes = [
+            # An album's images (API ?album=)
+            models.Index(fields=['album', 'date_uploaded', 'id'], name='image_album_uploaded_idx'),
+            # An album's images that can be shown
+            models.Index(fields=['album', 'date_uploaded', 'id'], name='image_album_ready_idx',
+                         condition=models.Q(status='ready')),
+            # All images (API)
+            models.Index(fields=['date_uploaded', 'id'], name='image_uploaded_idx'),
+            # The upload workers' queue
+            models.Index(fields=['id'], name='image_pending_idx', condition=models.Q(status='pending')),
+            # Images by capture date (API ?ordering=taken_at, ?taken_at_after=)
+            models.Index(fields=['taken_at', 'id'], name='image_taken_idx'),
+            # Images by camera (API ?camera_model=)
+            models.Index(fields=['camera_model'], name='image_camera_model_idx'),
+            # Images whose metadata hasn't been read yet
+            models.Index(fields=['id'], name='image_no_exif_idx', condition=models.Q(exif__isnull=True)),
+            # The GIN indexes behind search are Postgres only, see migration 0009_search
+        ]
+
+    # Locations are storage keys; the URLs are resolved when shown, see file_utils.get_public_url()
+    @property
+    def url(self):
+        return file_utils.get_public_url(self.location)
+
+    @property
+    def thumbnail_url(self):
+        return file_utils.get_public_url(self.thumbnail_location or self.location)
+
+    @property
+    def medium_url(self):
+        return file_utils.get_public_url(self.medium_location or self.location)
+
+
+class PendingUpload(models.Model):
+    """
+    A staged file waiting to be pushed to object storage for its Image.
+    """
+    image = models.OneToOneField(Image, on_delete=models.CASCADE, related_name='pending_upload')
+    staging_path = models.CharField(max_length=255)
+    object_name = models.CharField(max_length=120)
+    content_type = models.CharField(max_length=100, blank=True)
+    # SHA-256 of the staged file, computed while it was received
+    sha256 = models.CharField(max_length=64, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    date_created = models.DateTimeField(auto_now_add=True)
+    # When a worker claimed the upload; claims older than settings.UPLOAD_CLAIM_TIMEOUT are
+    # taken to be from a worker that died and are put back in the queue
+    date_claimed = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['date_created']
+
+
+class PhotoImport(models.Model):
+    """
+    Progress of an import_photos run of a directory, so an interrupted import resumes after
+    the last file it finished instead of starting over.
+    """
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    root = models.CharField(max_length=255)
+    # Path of the last file handled, relative to root; files are handled in walk order
+    last_path = models.TextField(blank=True)
+    imported = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    date_started = models.DateTimeField(auto_now_add=True)
+    date_updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'root'], name='photo_import_owner_root_unique'),
+        ]
@@ -0,0 +1,153 @@
+import logging
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+
+from . import signals
+from .derivatives import get_derivative_object_name
+from .models import Blob, Image, PendingUpload
+from .utils import file_utils, placement
+
+
+logger = logging.getLogger(__name__)
+
+LOCATION_FIELDS = ['location'] + [f'{name}_location' for name in settings.IMAGE_RENDITIONS]
+
+
+def get_moves(object_name: str) -> Dict[str, str]:
+    """
+    Works out where an object and its renditions belong on the current storage nodes.
+
+    :param object_name: String name of an original object
+    :return: Dict of {current name: new name}, empty if the object is already on its node
+    """
+    parsed = placement.parse_key(object_name)
+    target = file_utils.place(parsed[1] if parsed else object_name)
+    # Objects stored before keys named their node move too, even if only their key changes
+    if parsed is not None and placement.parse_key(target)[0] == parsed[0]:
+        return {}
+    moves = {object_name: target}
+    moves.update({get_derivative_object_name(object_name, rendition): get_derivative_object_name(target, rendition)
+                  for rendition in settings.IMAGE_RENDITIONS})
+    if any(len(name) > file_utils.MAX_OBJECT_NAME_LENGTH for name in moves.values()):
+        logger.warning('Not moving %s, its new name would not fit the image location', object_name)
+        return {}
+    return moves
+
+
+def rebalance(dry_run: bool = False, limit: Optional[int] = None, log=None) -> int:
+    """
+    Moves stored objects to the node the hash ring puts them on, e.g. after a node was
+    added, along with objects stored before keys named their node. Shared blobs are moved
+    first, then images uploaded straight to storage. Every object is copied, the rows
+    pointing at it are updated, and the old copy is removed once that is committed, so
+    images can be shown throughout.
+
+    :param dry_run: True to only count what would be moved
+    :param limit: Optional integer number of objects to move at most
+    :param log: Optional callable taking a progress message
+    :return: Integer number of objects moved, not counting renditions
+    """
+    log = log or (lambda message: None)
+    count = 0
+    for move, row_id, object_name in _get_stored_objects():
+        if limit is not None and count >= limit:
+            break
+        if not get_moves(object_name):
+            continue
+        if dry_run or move(row_id):
+            count += 1
+            log(f'{"Would move" if dry_run else "Moved"} {object_name}')
+    return count
+
+
+def _get_stored_objects():
+    for blob_id, object_name in Blob.objects.order_by('id').values_list('id', 'object_name').iterator():
+        yield move_blob, blob_id, object_name
+    images = (Image.objects.filter(blob__isnull=True, status=Image.Status.READY).exclude(location='')
+              .order_by('id').values_list('id', 'location'))
+    for image_id, location in images.iterator():
+        if file_utils.is_stored(location):
+            yield move_image, image_id, file_utils.get_object_name_from_location(location)
+
+
+def move_blob(blob_id: int) -> bool:
+    """
+    Moves a blob's object and renditions to their node and points the blob and its images
+    at the new copies. Blobs with uploads of the same content in flight are left for the
+    next run, those uploads may already have read the blob's current name.
+
+    :param blob_id: Integer id of the Blob
+    :return: True if the blob was moved
+    """
+    blob = Blob.objects.filter(id=blob_id).first()
+    if blob is None or PendingUpload.objects.filter(sha256=blob.sha256).exists():
+        return False
+    moves = get_moves(blob.object_name)
+    copied = _copy(moves)
+    with transaction.atomic():
+        # Uploads of the same content take their reference through this row
+        unchanged = Blob.objects.select_for_update().filter(id=blob_id, object_name=blob.object_name).exists()
+        if not unchanged or PendingUpload.objects.filter(sha256=blob.sha256).exists():
+            transaction.on_commit(lambda: _remove(copied))
+            return False
+        Blob.objects.filter(id=blob_id).update(object_name=moves[blob.object_name])
+        _rewrite(Image.objects.select_for_update().filter(blob_id=blob_id), moves)
+        transaction.on_commit(lambda: _remove(moves))
+    return True
+
+
+def move_image(image_id: int) -> bool:
+    """
+    Moves the object and renditions of an image without a blob to their node and points the
+    image, and any other image registered for the same object, at the new copies. An image
+    whose locations change meanwhile, e.g. because its renditions were just rendered, is left
+    for the next run.
+
+    :param image_id: Integer id of the Image
+    :return: True if the image was moved
+    """
+    current = Image.objects.filter(id=image_id, blob__isnull=True).values(*LOCATION_FIELDS).first()
+    if current is None:
+        return False
+    moves = get_moves(file_utils.get_object_name_from_location(current['location']))
+    copied = _copy(moves)
+    with transaction.atomic():
+        images = list(Image.objects.select_for_update().filter(blob__isnull=True, location=current['location']))
+        if not any(image.id == image_id and all(getattr(image, field) == current[field] for field in LOCATION_FIELDS)
+                   for image in images):
+            transaction.on_commit(lambda: _remove(copied))
+            return False
+        _rewrite(images, moves)
+        transaction.on_commit(lambda: _remove(moves))
+    return True
+
+
+def _copy(moves: Dict[str, str]) -> List[str]:
+    # Renditions that were never rendered are skipped
+    return [target for object_name, target in moves.items()
+            if file_utils.get_uploader(target).copy(file_utils.get_uploader(object_name), object_name, target)]
+
+
+def _rewrite(images, moves: Dict[str, str]):
+    for image in images:
+        update = {}
+        for field in LOCATION_FIELDS:
+            location = getattr(image, field)
+            object_name = file_utils.get_object_name_from_location(location) if file_utils.is_stored(location) else ''
+            if object_name in moves:
+                update[field] = file_utils.get_location(moves[object_name])
+        if update:
+            Image.objects.filter(id=image.id).update(**update)
+        # update() doesn't send post_save; album lists show the cover image too
+        signals.invalidate_on_commit(signals.image_scopes(image))
+        signals.invalidate_album_on_commit(image.album_id)
+
+
+def _remove(object_names: Iterable[str]):
+    for object_name in object_names:
+        try:
+            file_utils.get_uploader(object_name).remove(object_name)
+        except Exception:
+            logger.exception('Removing %s from storage failed', object_name)
@@ -0,0 +1,84 @@
+from django.contrib.postgres.lookups import PostgresOperatorLookup
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import CharField, F, FloatField, Func, Q, QuerySet, Value
+from django.db.models.functions import Greatest
+
+from .models import Album, Image
+
+
+# Must match the configuration the triggers of migration 0009_search build the vectors with
+SEARCH_CONFIG = 'simple'
+
+
+# pg_trgm's word similarity matches a query against the most similar part of a text, so a
+# partial word finds a long title. Django only ships these from 4.0, so they are defined here.
+@CharField.register_lookup
+class TrigramWordSimilar(PostgresOperatorLookup):
+    lookup_name = 'trigram_word_similar'
+    postgres_operator = '%%>'
+
+
+class TrigramWordSimilarity(Func):
+    function = 'WORD_SIMILARITY'
+    output_field = FloatField()
+
+    def __init__(self, string, expression, **extra):
+        super().__init__(Value(string), expression, **extra)
+
+
+def _is_postgres() -> bool:
+    return connection.vendor == 'postgresql'
+
+
+def visible_albums(user, prefix: str = '') -> Q:
+    """
+    The albums a user may see: the public ones and their own.
+
+    :param user: User, or AnonymousUser
+    :param prefix: String path to the album from the model filtered, e.g. 'album__'
+    :return: Q filtering Albums
+    """
+    if user is not None and user.is_authenticated:
+        return Q(**{f'{prefix}is_public': True}) | Q(**{f'{prefix}owner': user})
+    return Q(**{f'{prefix}is_public': True})
+
+
+def _search(queryset: QuerySet, field: str, query: str) -> QuerySet:
+    if _is_postgres():
+        # Whole words through the tsvector GIN index, partial and misspelt words through the
+        # trigram GIN index; Postgres combines both index scans with a bitmap OR
+        search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type='websearch')
+        return (queryset.filter(Q(search_vector=search_query) | Q(**{f'{field}__trigram_word_similar': query}))
+                .annotate(rank=Greatest(SearchRank(F('search_vector'), search_query),
+                                        TrigramWordSimilarity(query, field)))
+                .order_by('-rank', '-id'))
+    # Other databases (the tests' SQLite) scan the table for every word
+    words = query.split()
+    if not words:
+        return queryset.none()
+    return queryset.filter(*[Q(**{f'{field}__icontains': word}) for word in words]).order_by('-id')
+
+
+def search_albums(query: str, user) -> QuerySet:
+    """
+    Finds the albums whose name matches a query, best matches first.
+
+    :param query: String the user searched for
+    :param user: User searching, or AnonymousUser; only albums they may see are returned
+    :return: QuerySet of Albums
+    """
+    return _search(Album.objects.filter(visible_albums(user)), 'name', query)
+
+
+def search_images(query: str, user) -> QuerySet:
+    """
+    Finds the ready images whose title matches a query, best matches first.
+
+    :param query: String the user searched for
+    :param user: User searching, or AnonymousUser; only images in albums they may see are returned
+    :return: QuerySet of Images
+    """
+    images = (Image.objects.filter(visible_albums(user, 'album__'), status=Image.Status.READY)
+              .select_related('album'))
+    return _search(images, 'title', query)
@@ -0,0 +1,140 @@
+from contextvars import ContextVar
+
+import django
+from django.core.signals import request_started
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import album_stats, blobs, list_cache
+from .models import Album, Image
+from .utils import metrics
+
+
+# Django 4.1+ checks persistent connections itself when CONN_HEALTH_CHECKS is set
+NATIVE_HEALTH_CHECKS = django.VERSION >= (4, 1)
+# Ids of the albums being deleted; their images are deleted with them and skip the
+# per-image bookkeeping, see album_deleting()
+_deleting_albums: ContextVar[frozenset] = ContextVar('deleting_albums', default=frozenset())
+
+
+def album_scopes(album: Album, was_public: bool = False) -> list:
+    """
+    The cached lists an album shows up in.
+
+    :param album: Album that was written
+    :param was_public: True if the album was public before the write
+    :return: List of cache scopes
+    """
+    scopes = [list_cache.all_albums_scope(),
+              list_cache.owner_albums_scope(album.owner_id),
+              list_cache.user_albums_scope(album.owner.username),
+              # The image list page shows the album's name and is only visible if it is public
+              list_cache.album_images_scope(album.id)]
+    if album.is_public or was_public:
+        scopes.append(list_cache.public_albums_scope())
+    return scopes
+
+
+def image_scopes(image: Image) -> list:
+    """
+    The cached lists an image shows up in.
+
+    :param image: Image that was written
+    :return: List of cache scopes
+    """
+    return [list_cache.all_images_scope(), list_cache.album_images_scope(image.album_id)]
+
+
+def invalidate_on_commit(scopes: list):
+    # Readers must not be able to cache the old rows under the new version, so wait until
+    # the write is visible to them
+    transaction.on_commit(lambda: list_cache.invalidate(scopes))
+
+
+def invalidate_album_on_commit(album_id: int):
+    """
+    Drops the cached lists an album shows up in once the transaction commits, e.g. after its
+    stats changed.
+
+    :param album_id: Integer id of the Album
+    """
+    def invalidate():
+        album = Album.objects.select_related('owner').filter(id=album_id).first()
+        if album is not None:
+            list_cache.invalidate(album_scopes(album))
+    transaction.on_commit(invalidate)
+
+
+@receiver(pre_save, sender=Album)
+def remember_album_visibility(sender, instance, **kwargs):
+    instance._was_public = bool(instance.pk and Album.objects.filter(pk=instance.pk, is_public=True).exists())
+
+
+@receiver(post_save, sender=Album)
+def album_saved(sender, instance, **kwargs):
+    invalidate_on_commit(album_scopes(instance, was_public=getattr(instance, '_was_public', False)))
+
+
+@receiver(pre_delete, sender=Album)
+def album_deleting(sender, instance, **kwargs):
+    _deleting_albums.set(_deleting_albums.get() | {instance.id})
+    # The album's images are deleted next; their stats go with the album, so only their blob
+    # references are dropped, all at once rather than one image at a time
+    blobs.release_many(Image.objects.filter(album_id=instance.id, blob__isnull=False)
+                       .values_list('blob_id', flat=True))
+    invalidate_on_commit([list_cache.all_images_scope(), list_cache.album_images_scope(instance.id)])
+
+
+@receiver(post_delete, sender=Album)
+def album_deleted(sender, instance, **kwargs):
+    _deleting_albums.set(_deleting_albums.get() - {instance.id})
+    invalidate_on_commit(album_scopes(instance))
+
+
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+def image_written(sender, instance, **kwargs):
+    if instance.album_id in _deleting_albums.get():
+        return
+    invalidate_on_commit(image_scopes(instance))
+
+
+@receiver(post_save, sender=Image)
+def image_created(sender, instance, created, **kwargs):
+    # Images become ready later through process_upload(), which counts them itself
+    if created and instance.status == Image.Status.READY:
+        album_stats.image_added(instance.album_id, instance.id, instance.date_uploaded)
+        invalidate_album_on_commit(instance.album_id)
+
+
+@receiver(post_delete, sender=Image)
+def image_deleted(sender, instance, **kwargs):
+    if instance.album_id in _deleting_albums.get():
+        return
+    if instance.status == Image.Status.READY:
+        album_stats.image_removed(instance.album_id, instance.date_uploaded)
+        invalidate_album_on_commit(instance.album_id)
+    # The stored content goes with the last image that references it
+    if instance.blob_id is not None:
+        blobs.release(instance.blob_id)
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    # Counts and times every query for the request metrics; reconnects reuse the wrapper list
+    if metrics.record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(metrics.record_query)
+
+
+@receiver(request_started)
+def check_connections(**kwargs):
+    # A persistent connection the database (or a pooler in front of it) dropped while it sat
+    # idle would otherwise fail the first query of the next request
+    if NATIVE_HEALTH_CHECKS:
+        return
+    for connection in connections.all():
+        if (connection.connection is not None and connection.settings_dict.get('CONN_HEALTH_CHECKS')
+                and not connection.is_usable()):
+            connection.close()
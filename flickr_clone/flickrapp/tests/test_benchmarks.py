@@ -0,0 +1,84 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from flickrapp import benchmarks
+from flickrapp.models import Album, Image
+
+
+class BenchmarkTest(TestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        staging_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(staging_dir.cleanup)
+        self.staging_dir = staging_dir.name
+        override = override_settings(UPLOAD_STAGING_DIR=self.staging_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_seed_spreads_rows_over_users_and_albums(self):
+        benchmarks.seed(users=3, albums=10, images=100, batch_size=7)
+        self.assertEqual(User.objects.filter(username__startswith=benchmarks.USERNAME_PREFIX).count(), 3)
+        self.assertEqual(Album.objects.count(), 10)
+        self.assertEqual(Album.objects.filter(is_public=False).count(), 2)
+        self.assertEqual(Image.objects.filter(status=Image.Status.READY).count(), 100)
+        self.assertTrue(self.client.login(username=f'{benchmarks.USERNAME_PREFIX}0', password=benchmarks.PASSWORD))
+
+    def test_clear_removes_seeded_rows(self):
+        benchmarks.seed(users=2, albums=4, images=20)
+        call_command('seed_benchmark', '--clear', '--batch-size', '7', stdout=StringIO())
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(Image.objects.exists())
+
+    def test_run_reports_every_endpoint(self):
+        benchmarks.seed(users=2, albums=4, images=20)
+        results = benchmarks.run(iterations=2)
+        self.assertEqual(set(results), set(benchmarks.get_endpoints()) | {'upload', 'upload worker'})
+        for name, summary in results.items():
+            self.assertEqual(summary['errors'], 0, name)
+            self.assertEqual(summary['requests'], 2, name)
+            self.assertGreater(summary['max_queries'], 0, name)
+        # The uploads were stored in fake storage by the worker
+        self.assertEqual(Image.objects.filter(title__startswith='Upload', status=Image.Status.READY).count(), 2)
+
+    def test_queries_on_replicas_are_counted(self):
+        summary = benchmarks.measure(lambda i: list(Album.objects.using('replica').all()), iterations=2)
+        self.assertEqual(summary['max_queries'], 1)
+
+    def test_command_fails_on_regression(self):
+        benchmarks.seed(users=1, albums=2, images=5)
+        baseline_path = os.path.join(self.staging_dir, 'baseline.json')
+        call_command('benchmark', '--iterations', '2', '--skip-uploads', '--output', baseline_path, stdout=StringIO())
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)
+        baseline['albums']['max_queries'] = 0
+        with open(baseline_path, 'w') as baseline_file:
+            json.dump(baseline, baseline_file)
+        with self.assertRaisesMessage(CommandError, 'albums: queries 0 ->'):
+            call_command('benchmark', '--iterations', '2', '--skip-uploads', '--baseline', baseline_path,
+                         '--tolerance', '100', stdout=StringIO())
+
+    def test_command_without_data(self):
+        with self.assertRaises(CommandError):
+            call_command('benchmark', '--iterations', '1', stdout=StringIO())
+
+    def test_connection_benchmark_restores_settings(self):
+        settings_dict = dict(connection.settings_dict)
+        results = benchmarks.compare_connections(iterations=3, max_age=30)
+        self.assertEqual(list(results), ['CONN_MAX_AGE=0', 'CONN_MAX_AGE=30', 'CONN_MAX_AGE=30, health checks'])
+        for name, summary in results.items():
+            self.assertEqual(summary['requests'], 3, name)
+        self.assertEqual(connection.settings_dict, settings_dict)
+
+    def test_connection_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_connections', '--iterations', '2', stdout=out)
+        self.assertIn('CONN_MAX_AGE=600, health checks', out.getvalue())
@@ -0,0 +1,101 @@
+from unittest.mock import Mock, patch
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from flickrapp import db_router, list_cache, signals
+from flickrapp.models import Album
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRouterTest(TestCase):
+    # The replica is a separate database, so every row shows where it was read from
+    databases = {'default', 'replica'}
+
+    @classmethod
+    def setUpTestData(cls):
+        primary_user = User.objects.create_user(username='testUser123', password='testUser123pass')
+        replica_user = User.objects.db_manager('replica').create_user(username='testUser123')
+        Album.objects.create(owner=primary_user, name='Primary album', is_public=True, date_created='2021-06-01')
+        Album.objects.using('replica').create(owner=replica_user, name='Replica album', is_public=True,
+                                              date_created='2021-06-01')
+
+    def tearDown(self):
+        db_router.finish_request()
+
+    def test_reads_outside_requests_use_primary(self):
+        self.assertEqual(Album.objects.all().db, 'default')
+
+    def test_request_reads_use_replica_until_it_writes(self):
+        db_router.start_request()
+        self.assertEqual(Album.objects.get().name, 'Replica album')
+        Album.objects.create(owner_id=1, name='New album', is_public=True, date_created='2022-01-01')
+        self.assertEqual(Album.objects.all().db, 'default')
+        self.assertEqual(Album.objects.count(), 2)
+
+    def test_pinned_request_reads_use_primary(self):
+        db_router.start_request(pinned=True)
+        self.assertEqual(Album.objects.get().name, 'Primary album')
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_reads_use_primary_without_replicas(self):
+        db_router.start_request()
+        self.assertEqual(Album.objects.all().db, 'default')
+
+    def test_migrations_skip_replicas(self):
+        router = db_router.ReplicaRouter()
+        self.assertTrue(router.allow_migrate('default', 'flickrapp'))
+        self.assertFalse(router.allow_migrate('replica', 'flickrapp'))
+
+    def test_get_request_reads_from_replica(self):
+        response = self.client.get('/api/v1/search/?q=album')
+        self.assertEqual([album['name'] for album in response.json()['albums']], ['Replica album'])
+        self.assertNotIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+
+    def test_writer_reads_from_primary_right_after_writing(self):
+        self.client.login(username='testUser123', password='testUser123pass')
+        response = self.client.post(reverse('create_album'), {'name': 'Labrador', 'is_public': True})
+        self.assertEqual(response.cookies[settings.REPLICA_PIN_COOKIE]['max-age'], settings.REPLICA_PIN_SECONDS)
+        self.assertTrue(Album.objects.filter(name='Labrador').exists())
+
+        response = self.client.get('/api/v1/search/?q=labrador')
+        self.assertEqual([album['name'] for album in response.json()['albums']], ['Labrador'])
+
+        # Once the pin expired the reads go back to the replica, which has caught up by then
+        del self.client.cookies[settings.REPLICA_PIN_COOKIE]
+        response = self.client.get('/api/v1/search/?q=labrador')
+        self.assertEqual(response.json()['albums'], [])
+
+    def test_recently_invalidated_list_is_built_from_primary(self):
+        db_router.start_request()
+        list_cache.invalidate([list_cache.public_albums_scope()])
+        list_cache.get_key([list_cache.public_albums_scope()], '/flickr/albums/')
+        self.assertTrue(db_router.is_pinned())
+
+    @override_settings(REPLICA_PIN_SECONDS=0)
+    def test_list_is_built_from_replica_once_replicas_caught_up(self):
+        db_router.start_request()
+        list_cache.get_key([list_cache.public_albums_scope()], '/flickr/albums/')
+        self.assertFalse(db_router.is_pinned())
+
+
+@patch('flickrapp.signals.NATIVE_HEALTH_CHECKS', False)
+class ConnectionHealthCheckTest(TestCase):
+    def get_connection(self, usable, health_checks=True):
+        return Mock(connection=object(), settings_dict={'CONN_HEALTH_CHECKS': health_checks},
+                    is_usable=Mock(return_value=usable))
+
+    def test_broken_connection_is_closed_before_request(self):
+        broken, working = self.get_connection(usable=False), self.get_connection(usable=True)
+        with patch('flickrapp.signals.connections', Mock(all=Mock(return_value=[broken, working]))):
+            signals.check_connections()
+        broken.close.assert_called_once_with()
+        working.close.assert_not_called()
+
+    def test_connections_not_checked_without_health_checks(self):
+        unchecked = self.get_connection(usable=False, health_checks=False)
+        with patch('flickrapp.signals.connections', Mock(all=Mock(return_value=[unchecked]))):
+            signals.check_connections()
+        unchecked.is_usable.assert_not_called()
@@ -0,0 +1,94 @@
+import csv
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from flickrapp import export
+from flickrapp.models import Album, Image
+
+
+class ExportTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        test_user = User.objects.create_user(username='testUser123')
+        cls.album = Album.objects.create(owner=test_user, name='Beach, "Summer" 2021', is_public=True,
+                                         date_created='2021-06-01')
+        for i in range(5):
+            Image.objects.create(album=cls.album, title=f'Beach house {i}', location=f'http://minio/{i}.jpg',
+                                 thumbnail_location=f'http://minio/{i}-thumbnail.jpg' if i % 2 else '',
+                                 date_uploaded='2021-06-02')
+
+    def test_ndjson(self):
+        lines = ''.join(export.export('albums', 'ndjson')).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [{
+            'id': self.album.id, 'owner': self.album.owner_id, 'name': 'Beach, "Summer" 2021', 'is_public': True,
+            'date_created': '2021-06-01', 'image_count': 5, 'last_uploaded': '2021-06-02',
+            'cover_image': Image.objects.order_by('-id').first().id,
+        }])
+
+    def test_csv_has_a_header_and_falls_back_to_the_original(self):
+        rows = list(csv.DictReader(StringIO(''.join(export.export('images', 'csv')))))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(list(rows[0]), list(export.FIELDS['images']))
+        self.assertEqual(rows[0]['thumbnail'], 'http://minio/0.jpg')
+        self.assertEqual(rows[1]['thumbnail'], 'http://minio/1-thumbnail.jpg')
+        self.assertEqual(rows[0]['status'], 'ready')
+
+    def test_rows_are_written_in_blocks(self):
+        blocks = list(export.export('images', 'ndjson', chunk_size=2))
+        self.assertEqual([block.count('\n') for block in blocks], [2, 2, 1])
+
+    def test_rows_are_read_a_page_per_query(self):
+        with CaptureQueriesContext(connection) as captured:
+            list(export.export('images', 'csv', chunk_size=2))
+        self.assertEqual(len(captured), 3)
+
+    def test_rows_are_paged_without_server_side_cursors(self):
+        # As behind a transaction pooler, where a cursor would fetch every row at once
+        with patch.dict(connection.settings_dict, DISABLE_SERVER_SIDE_CURSORS=True), \
+                CaptureQueriesContext(connection) as captured:
+            lines = ''.join(export.export('images', 'ndjson', chunk_size=2)).splitlines()
+        self.assertEqual([json.loads(line)['title'] for line in lines], [f'Beach house {i}' for i in range(5)])
+        self.assertEqual(len(captured), 3)
+        self.assertTrue(all('LIMIT 2' in query['sql'] for query in captured))
+
+    def test_async_export_is_the_same(self):
+        async def read():
+            return [block async for block in export.aexport('images', 'csv', chunk_size=2)]
+
+        self.assertEqual(async_to_sync(read)(), list(export.export('images', 'csv', chunk_size=2)))
+
+    def test_spooled_export_is_the_same(self):
+        content = b''.join(export.spool('images', 'csv', chunk_size=2)).decode()
+        self.assertEqual(content, ''.join(export.export('images', 'csv', chunk_size=2)))
+
+    def test_filters(self):
+        self.assertEqual(list(export.export('images', 'ndjson', album=self.album.id + 1)), [])
+
+    def test_unknown_export(self):
+        with self.assertRaises(ValueError):
+            export.export('users', 'csv')
+        with self.assertRaises(ValueError):
+            export.export('albums', 'xml')
+
+    def test_command_writes_a_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'images.csv')
+            call_command('export_data', 'images', '--format', 'csv', '--output', path)
+            with open(path, newline='') as output:
+                self.assertEqual(len(list(csv.reader(output))), 6)
+
+    def test_command_writes_to_stdout(self):
+        out = StringIO()
+        call_command('export_data', 'albums', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 1)
@@ -1,10 +1,12 @@
 from unittest.mock import patch
 
 from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
+from django.utils.datastructures import MultiValueDict
 
 from flickrapp.models import Album, Image
-from flickrapp.forms import CreateAlbumForm, UploadImageForm
+from flickrapp.forms import BulkUploadImageForm, CreateAlbumForm, UploadImageForm
 
 
 class CreateAlbumFormTest(TestCase):
@@ -32,10 +34,42 @@ class UploadImageFormTest(TestCase):
         for field in expected_fields:
             self.assertTrue(field in form.fields)
 
-    def test_upload_returns_location_from_utility(self):
-        expected_location = '/path/to/file.ext'
+    def test_queue_upload_hands_file_to_pipeline(self):
         test_user = User.objects.get(id=1)
+        album = Album.objects.get(id=1)
         form = UploadImageForm(user=test_user)
-        with patch('flickrapp.forms.file_utils.upload_file', return_value=expected_location):
-            actual_location = form.upload_image(None, 'Beach House (front)')
-        self.assertEqual(actual_location, expected_location)
\ No newline at end of file
+        form.cleaned_data = {'album': album, 'title': 'Beach House (front)'}
+        with patch('flickrapp.forms.uploads.queue_upload', return_value='pending image') as mock_queue_upload:
+            actual_image = form.queue_upload('uploaded file')
+        mock_queue_upload.assert_called_once_with('uploaded file', album=album, title='Beach House (front)')
+        self.assertEqual(actual_image, 'pending image')
+
+
+class BulkUploadImageFormTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user(username='testUser123')
+        test_user = User.objects.get(id=1)
+        Album.objects.create(owner=test_user, name='Beach Vacation Summer 2021', is_public=True,
+                             date_created='2021-06-01')
+
+    def test_fields(self):
+        expected_fields = ['album', 'files']
+        test_user = User.objects.get(id=1)
+        form = BulkUploadImageForm(user=test_user)
+        self.assertTrue(len(form.fields) == len(expected_fields))
+        for field in expected_fields:
+            self.assertTrue(field in form.fields)
+
+    def test_accepts_many_files(self):
+        test_user = User.objects.get(id=1)
+        files = MultiValueDict({'files': [SimpleUploadedFile('a.jpg', b'a'), SimpleUploadedFile('b.jpg', b'b')]})
+        form = BulkUploadImageForm({'album': 1}, files, user=test_user)
+        self.assertTrue(form.is_valid())
+        self.assertEqual([file.name for file in form.cleaned_data['files']], ['a.jpg', 'b.jpg'])
+
+    def test_requires_a_file(self):
+        test_user = User.objects.get(id=1)
+        form = BulkUploadImageForm({'album': 1}, MultiValueDict(), user=test_user)
+        self.assertFalse(form.is_valid())
+        self.assertIn('files', form.errors)
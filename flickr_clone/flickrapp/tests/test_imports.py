@@ -0,0 +1,149 @@
+import os
+import tempfile
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from flickrapp import imports
+from flickrapp.models import Album, Blob, Image, PhotoImport
+from flickrapp.utils import file_utils
+from flickrapp.utils.fake_storage import FakeMinio
+
+
+class ImportPhotosTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='testUser123')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        self.storage = FakeMinio()
+        file_utils.set_client(self.storage)
+        self.addCleanup(file_utils.reset_client)
+
+    def write(self, path, content=None):
+        full_path = os.path.join(self.root, *path.split('/'))
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'wb') as file:
+            file.write(content if content is not None else path.encode())
+
+    def importer(self, **kwargs):
+        kwargs.setdefault('album_per_folder', True)
+        kwargs.setdefault('retry_delay', 0)
+        return imports.Importer(self.root, self.user, workers=2, **kwargs)
+
+    def test_walk_is_sorted_and_skips_other_files(self):
+        for path in ['b.jpg', 'a/2.PNG', 'a/1.jpg', 'a-c/3.jpg', 'a.jpg', 'notes.txt', '.hidden/4.jpg']:
+            self.write(path)
+        self.assertEqual(list(imports.walk(self.root)), ['a/1.jpg', 'a/2.PNG', 'a-c/3.jpg', 'a.jpg', 'b.jpg'])
+
+    def test_walk_resumes_after_a_path(self):
+        for path in ['a/1.jpg', 'a/2.jpg', 'a-c/3.jpg', 'a.jpg', 'b/c/4.jpg']:
+            self.write(path)
+        self.assertEqual(list(imports.walk(self.root, after='a/1.jpg')), ['a/2.jpg', 'a-c/3.jpg', 'a.jpg', 'b/c/4.jpg'])
+        self.assertEqual(list(imports.walk(self.root, after='a-c/3.jpg')), ['a.jpg', 'b/c/4.jpg'])
+
+    def test_album_per_folder(self):
+        for path in ['beach/1.jpg', 'beach/2.jpg', 'ski/2021/1.jpg', 'top.jpg']:
+            self.write(path)
+        job = self.importer().run()
+        self.assertEqual((job.imported, job.failed, job.last_path), (4, 0, 'top.jpg'))
+        root_name = os.path.basename(self.root)
+        counts = dict(Album.objects.filter(owner=self.user).values_list('name', 'image_count'))
+        self.assertEqual(counts, {'beach': 2, 'ski/2021': 1, root_name: 1})
+        self.assertFalse(Album.objects.get(name='beach').is_public)
+        image = Image.objects.get(album__name='beach', title='1')
+        self.assertEqual(image.status, Image.Status.READY)
+        self.assertEqual(image.location, file_utils.get_location(image.blob.object_name))
+        self.assertIn(image.blob.object_name, self.storage.buckets['uploads'])
+
+    def test_single_album(self):
+        for path in ['beach/1.jpg', 'ski/1.jpg']:
+            self.write(path)
+        self.importer(album_per_folder=False, album_name='Imported').run()
+        self.assertEqual(Album.objects.get(name='Imported').image_count, 2)
+
+    def test_identical_files_are_stored_once(self):
+        self.write('a/1.jpg', b'same')
+        self.write('b/1.jpg', b'same')
+        with patch.object(self.storage, 'put_object', wraps=self.storage.put_object) as put_object:
+            self.importer().run()
+        put_object.assert_called_once()
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+
+    def test_interrupted_import_resumes(self):
+        for i in range(5):
+            self.write(f'beach/{i}.jpg')
+        importer = self.importer(batch_size=2)
+        import_batch = importer.import_batch
+        calls = []
+
+        def crash_on_second_batch(*args):
+            calls.append(args)
+            if len(calls) == 2:
+                raise KeyboardInterrupt()
+            return import_batch(*args)
+
+        with patch.object(importer, 'import_batch', side_effect=crash_on_second_batch), \
+                self.assertRaises(KeyboardInterrupt):
+            importer.run()
+        self.assertEqual(PhotoImport.objects.get().last_path, 'beach/1.jpg')
+        self.assertEqual(Image.objects.count(), 2)
+
+        job = self.importer(batch_size=2).run()
+        self.assertEqual(job.imported, 5)
+        self.assertEqual(sorted(Image.objects.values_list('title', flat=True)), ['0', '1', '2', '3', '4'])
+        self.assertEqual(Album.objects.get().image_count, 5)
+
+    def test_restart(self):
+        self.write('beach/1.jpg')
+        self.importer().run()
+        job = self.importer().run(restart=True)
+        self.assertEqual(job.imported, 1)
+        self.assertEqual(Image.objects.count(), 2)
+
+    def test_failed_uploads_are_retried(self):
+        self.write('beach/1.jpg')
+        with patch.object(self.storage, 'put_object', side_effect=[ConnectionError(), None]) as put_object, \
+                self.assertLogs('flickrapp.imports', 'WARNING'):
+            job = self.importer().run()
+        self.assertEqual(put_object.call_count, 2)
+        self.assertEqual(job.imported, 1)
+
+    def test_files_failing_every_attempt_are_skipped(self):
+        self.write('beach/1.jpg', b'broken')
+        self.write('beach/2.jpg', b'fine')
+        put_object = self.storage.put_object
+
+        def fail_broken(bucket_name, object_name, data, *args, **kwargs):
+            if data.read() == b'broken':
+                raise ConnectionError()
+            data.seek(0)
+            return put_object(bucket_name, object_name, data, *args, **kwargs)
+
+        with patch.object(self.storage, 'put_object', side_effect=fail_broken), \
+                self.assertLogs('flickrapp.imports', 'WARNING'):
+            job = self.importer(max_attempts=2).run()
+        self.assertEqual((job.imported, job.failed), (1, 1))
+        self.assertEqual(list(Image.objects.values_list('title', flat=True)), ['2'])
+
+    def test_command(self):
+        self.write('beach/1.jpg')
+        out = StringIO()
+        call_command('import_photos', self.root, '--user', 'testUser123', '--album-per-folder', '--public',
+                     stdout=out)
+        self.assertIn('Imported 1 photo(s), 0 failed', out.getvalue())
+        self.assertTrue(Album.objects.get(name='beach').is_public)
+
+    def test_command_needs_a_user_and_a_directory(self):
+        with self.assertRaises(CommandError):
+            call_command('import_photos', self.root, '--user', 'nobody', stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command('import_photos', os.path.join(self.root, 'missing'), '--user', 'testUser123',
+                         stdout=StringIO())
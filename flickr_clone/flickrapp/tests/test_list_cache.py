@@ -0,0 +1,90 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from flickrapp.models import Album, Image
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ListCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user(username='testUser123', password='testUser123pass')
+        User.objects.create_user(username='testUser789', password='testUser789pass')
+        test_user = User.objects.get(id=1)
+        Album.objects.create(owner=test_user, name='Beach Vacation Summer 2021', is_public=True,
+                             date_created='2021-06-01')
+        Album.objects.create(owner=test_user, name='Ski mountain 2021', is_public=False, date_created='2021-01-01')
+        album = Album.objects.get(id=1)
+        Image.objects.create(album=album, title='Beach house (front)', location='filename.ext',
+                             date_uploaded='2021-06-02')
+
+    def setUp(self):
+        cache.clear()
+
+    def write(self, func, *args, **kwargs):
+        # Invalidation waits for the write to be committed
+        with self.captureOnCommitCallbacks(execute=True):
+            return func(*args, **kwargs)
+
+    def test_cached_public_album_list_skips_database(self):
+        first = self.client.get(reverse('album_list'))
+        with self.assertNumQueries(0):
+            second = self.client.get(reverse('album_list'))
+        self.assertEqual(first.content, second.content)
+
+    def test_new_public_album_invalidates_public_album_list(self):
+        self.client.get(reverse('album_list'))
+        self.write(Album.objects.create, owner_id=2, name='Labrador', is_public=True, date_created='2022-01-01')
+        response = self.client.get(reverse('album_list'))
+        self.assertContains(response, 'Labrador')
+
+    def test_new_private_album_keeps_public_album_list(self):
+        self.client.get(reverse('album_list'))
+        self.write(Album.objects.create, owner_id=2, name='Labrador', is_public=False, date_created='2022-01-01')
+        with self.assertNumQueries(0):
+            self.client.get(reverse('album_list'))
+
+    def test_album_made_private_invalidates_public_album_list(self):
+        self.client.get(reverse('album_list'))
+        album = Album.objects.get(id=1)
+        album.is_public = False
+        self.write(album.save)
+        response = self.client.get(reverse('album_list'))
+        self.assertNotContains(response, 'Beach Vacation Summer 2021')
+
+    def test_user_album_list_varies_by_owner(self):
+        url = reverse('user_albums', kwargs={'username': 'testUser123'})
+        anonymous = self.client.get(url)
+        self.client.login(username='testUser123', password='testUser123pass')
+        owner = self.client.get(url)
+        self.assertNotContains(anonymous, 'Ski mountain 2021')
+        self.assertContains(owner, 'Ski mountain 2021')
+
+    def test_private_album_images_not_served_to_others_from_cache(self):
+        url = reverse('image_list', kwargs={'pk': 2})
+        self.client.login(username='testUser123', password='testUser123pass')
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.client.logout()
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_new_image_invalidates_only_its_album(self):
+        self.client.get(reverse('image_list', kwargs={'pk': 1}))
+        self.client.login(username='testUser123', password='testUser123pass')
+        self.client.get(reverse('image_list', kwargs={'pk': 2}))
+        self.client.logout()
+        self.write(Image.objects.create, album_id=1, title='Sunset', location='sunset.ext', date_uploaded='2021-06-03')
+        self.assertContains(self.client.get(reverse('image_list', kwargs={'pk': 1})), 'Sunset')
+        self.client.login(username='testUser123', password='testUser123pass')
+        # session and user lookups only, the page itself is still cached
+        with self.assertNumQueries(2):
+            self.client.get(reverse('image_list', kwargs={'pk': 2}))
+
+    def test_api_list_cached_and_invalidated(self):
+        self.client.get('/api/v1/images/?album=1')
+        with self.assertNumQueries(0):
+            self.client.get('/api/v1/images/?album=1')
+        self.write(Image.objects.filter(id=1).delete)
+        response = self.client.get('/api/v1/images/?album=1')
+        self.assertEqual(response.data['results'], [])
@@ -0,0 +1,73 @@
+from datetime import datetime, timezone
+from io import BytesIO, StringIO
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from PIL import Image as PILImage
+
+from flickrapp import metadata
+from flickrapp.models import Album, Image
+from flickrapp.utils import file_utils, image_utils
+from flickrapp.utils.fake_storage import FakeMinio
+
+
+def jpeg(size=(1200, 1600)):
+    exif = PILImage.Exif()
+    exif[image_utils.MODEL] = 'EOS 5D'
+    exif.get_ifd(image_utils.EXIF_IFD)[image_utils.DATE_TIME_ORIGINAL] = '2021:06:02 10:30:00'
+    data = BytesIO()
+    PILImage.new('RGB', size, 'blue').save(data, 'JPEG', exif=exif)
+    return data.getvalue()
+
+
+class MetadataTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        test_user = User.objects.create_user(username='testUser123')
+        cls.album = Album.objects.create(owner=test_user, name='Beach Vacation Summer 2021', is_public=True,
+                                         date_created='2021-06-01')
+
+    def setUp(self):
+        self.storage = FakeMinio()
+        file_utils.set_client(self.storage)
+        self.addCleanup(file_utils.reset_client)
+
+    def store(self, name, content):
+        self.storage.put_object('uploads', name, BytesIO(content), len(content))
+        return Image.objects.create(album=self.album, title=name, location=file_utils.get_location(name),
+                                    date_uploaded='2021-06-02')
+
+    def test_read_makes_the_capture_time_aware(self):
+        fields = metadata.read(BytesIO(jpeg()))
+        self.assertEqual(fields['taken_at'], datetime(2021, 6, 2, 10, 30, tzinfo=timezone.utc))
+        self.assertEqual(fields['orientation'], Image.Orientation.PORTRAIT)
+
+    def test_unreadable_files_are_not_tried_again(self):
+        self.assertEqual(metadata.read(BytesIO(b'Hello, world')), {'exif': {}})
+
+    def test_store_from_storage_reads_only_the_header(self):
+        image = self.store('beach.jpg', jpeg())
+        with override_settings(METADATA_HEADER_BYTES=2048), \
+                patch.object(self.storage, 'get_object', wraps=self.storage.get_object) as get_object:
+            self.assertTrue(metadata.store_from_storage(image.id))
+        self.assertEqual(get_object.call_args.kwargs['length'], 2048)
+        image.refresh_from_db()
+        self.assertEqual((image.width, image.height, image.camera_model), (1200, 1600, 'EOS 5D'))
+        self.assertEqual(image.exif, {})
+        # Done once
+        self.assertFalse(metadata.store_from_storage(image.id))
+
+    def test_backfill_command(self):
+        images = [self.store(f'beach{i}.jpg', jpeg()) for i in range(3)]
+        Image.objects.filter(id=images[0].id).update(exif={})
+        Image.objects.create(album=self.album, title='pending', location='pending.jpg', date_uploaded='2021-06-02',
+                             status=Image.Status.PENDING)
+        out = StringIO()
+        # The workers run on their own connections, which can't see the test's transaction
+        with patch('flickrapp.metadata.store_from_storage') as store_from_storage:
+            call_command('extract_metadata', '--workers', '1', stdout=out)
+        self.assertIn('Processed 2 image(s)', out.getvalue())
+        self.assertEqual(sorted(c.args[0] for c in store_from_storage.call_args_list),
+                         [images[1].id, images[2].id])
@@ -0,0 +1,133 @@
+import json
+import os
+import tempfile
+from io import BytesIO
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from flickrapp.models import Album, Image
+from flickrapp.utils import file_utils, metrics
+from flickrapp.utils.fake_storage import FakeMinio
+
+
+class RequestMetricsMiddlewareTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user(username='testUser123')
+        test_user = User.objects.get(id=1)
+        Album.objects.create(owner=test_user, name='Beach Vacation Summer 2021', is_public=True,
+                             date_created='2021-06-01')
+        Image.objects.create(album=Album.objects.get(id=1), title='Beach house (front)', location='filename.ext',
+                             date_uploaded='2021-06-02')
+
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    def test_request_is_logged_with_its_timings(self):
+        with self.assertLogs('flickrapp.requests', 'INFO') as logs:
+            self.client.get(reverse('album_list'))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'album_list')
+        self.assertEqual(record['status'], 200)
+        self.assertEqual(record['db_queries'], 2)
+        self.assertEqual(record['cache_misses'], 1)
+        self.assertEqual(record['storage_calls'], 0)
+        self.assertGreater(record['duration_ms'], 0)
+
+    def test_metrics_are_exposed(self):
+        self.client.get(reverse('image_list', kwargs={'pk': 1}))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertIn('http_requests_total{method="GET",status="200",view="image_list"} 1', content)
+        self.assertIn('http_request_duration_seconds_count{view="image_list"} 1', content)
+        self.assertIn('db_queries_total{view="image_list"} 3', content)
+        self.assertIn('cache_requests_total{result="miss",view="image_list"} 1', content)
+
+    def test_metrics_are_only_exposed_locally(self):
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(METRICS_ALLOWED_IPS=['127.0.0.1', '172.16.0.0/12'])
+    def test_metrics_are_exposed_to_allowed_networks(self):
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='172.18.0.5')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(SLOW_REQUEST_THRESHOLD=0, SLOW_REQUEST_SAMPLE_RATE=1)
+    def test_slow_request_is_logged_with_its_queries(self):
+        with self.assertLogs('flickrapp.slow_requests', 'WARNING') as logs:
+            self.client.get(reverse('image_list', kwargs={'pk': 1}))
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(len(record['queries']), 3)
+        self.assertIn('flickrapp_image', record['queries'][-1]['sql'])
+
+    @override_settings(SLOW_REQUEST_THRESHOLD=0, SLOW_REQUEST_SAMPLE_RATE=0)
+    def test_slow_requests_are_sampled(self):
+        with patch('flickrapp.middleware.slow_logger') as mock_logger:
+            self.client.get(reverse('album_list'))
+        mock_logger.warning.assert_not_called()
+
+    def test_storage_calls_outside_requests_are_background(self):
+        file_utils.set_client(FakeMinio())
+        self.addCleanup(file_utils.reset_client)
+        file = InMemoryUploadedFile(BytesIO(b'Hello, world'), 'file', 'beach.jpg', 'image/jpeg', 12, None)
+        file_utils.MinioUploader().upload(source=file, object_name='beach.jpg')
+        content = metrics.render()
+        self.assertIn('storage_calls_total{operation="upload",view="background"} 1', content)
+        self.assertIn('storage_bytes_total{operation="upload",view="background"} 12', content)
+
+
+class SharedMetricsTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.settings_override = override_settings(METRICS_DIR=directory.name, METRICS_FLUSH_INTERVAL=0)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    @skipUnless(hasattr(os, 'fork'), 'needs fork')
+    def test_metrics_of_all_processes_are_added_up(self):
+        metrics.inc('db_queries_total', 2, view='album_list')
+        pid = os.fork()
+        if pid == 0:
+            # A worker starts without the metrics of its parent
+            try:
+                metrics.inc('db_queries_total', 3, view='album_list')
+                metrics.flush()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+
+        self.assertIn('db_queries_total{view="album_list"} 5', metrics.render())
+
+    def test_metrics_of_a_retired_process_are_kept(self):
+        metrics.inc('http_requests_total', view='album_list', method='GET', status='200')
+        metrics.observe('http_request_duration_seconds', 0.2, view='album_list')
+        metrics.flush()
+        # The worker exits and is replaced
+        metrics.retire()
+        metrics.inc('http_requests_total', view='album_list', method='GET', status='200')
+        metrics.observe('http_request_duration_seconds', 0.02, view='album_list')
+
+        content = metrics.render()
+        self.assertIn('http_requests_total{method="GET",status="200",view="album_list"} 2', content)
+        self.assertIn('http_request_duration_seconds_bucket{view="album_list",le="0.025"} 1', content)
+        self.assertIn('http_request_duration_seconds_count{view="album_list"} 2', content)
+
+    def test_requests_write_the_metrics_of_their_process(self):
+        self.client.get(reverse('album_list'))
+
+        [path] = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith('.json')]
+        with open(path) as file:
+            written = json.load(file)
+        self.assertIn(['http_requests_total', [['method', 'GET'], ['status', '200'], ['view', 'album_list']], 1],
+                      written['counters'])
@@ -1,7 +1,16 @@
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import patch
+
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.db import DatabaseError, connection
+from django.core.management import call_command
+from django.db.models import Q
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 
-from flickrapp.models import Album, Image
+from flickrapp import album_stats
+from flickrapp.models import Album, Blob, Image
 
 
 class AlbumModelTest(TestCase):
@@ -65,3 +74,176 @@ class ImageModelTest(TestCase):
         field_ordering = image._meta.ordering
         self.assertEqual(len(field_ordering), 1)
         self.assertEqual(field_ordering[0], 'date_uploaded')
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Asserts on the SQLite query plan format')
+class AlbumStatsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        test_user = User.objects.create_user(username='testUser123')
+        cls.album = Album.objects.create(owner=test_user, name='Beach Vacation Summer 2021', is_public=True,
+                                         date_created='2021-06-01')
+
+    def add_image(self, title, date_uploaded, status=Image.Status.READY):
+        return Image.objects.create(album=self.album, title=title, location=f'http://minio/{title}.jpg',
+                                    date_uploaded=date_uploaded, status=status)
+
+    def test_new_album_is_empty(self):
+        self.assertEqual(self.album.image_count, 0)
+        self.assertIsNone(self.album.last_uploaded)
+        self.assertIsNone(self.album.cover_image)
+
+    def test_ready_images_are_counted(self):
+        self.add_image('first', '2021-06-02')
+        second = self.add_image('second', '2021-06-03')
+        self.add_image('pending', '2021-06-04', status=Image.Status.PENDING)
+        self.album.refresh_from_db()
+        self.assertEqual(self.album.image_count, 2)
+        self.assertEqual(str(self.album.last_uploaded), '2021-06-03')
+        self.assertEqual(self.album.cover_image, second)
+
+    def test_last_upload_never_goes_back(self):
+        self.add_image('first', '2021-06-03')
+        self.add_image('backdated', '2021-06-02')
+        self.album.refresh_from_db()
+        self.assertEqual(str(self.album.last_uploaded), '2021-06-03')
+
+    def test_deleting_the_cover_picks_the_next_latest(self):
+        first = self.add_image('first', '2021-06-02')
+        second = self.add_image('second', '2021-06-03')
+        second.delete()
+        self.album.refresh_from_db()
+        self.assertEqual(self.album.image_count, 1)
+        self.assertEqual(self.album.cover_image, first)
+        first.delete()
+        self.album.refresh_from_db()
+        self.assertEqual(self.album.image_count, 0)
+        self.assertIsNone(self.album.cover_image)
+
+    def test_deleting_the_latest_image_moves_the_last_upload_back(self):
+        self.add_image('first', '2021-06-02')
+        second = self.add_image('second', '2021-06-03')
+        second.delete()
+        self.album.refresh_from_db()
+        self.assertEqual(str(self.album.last_uploaded), '2021-06-02')
+        Image.objects.get(title='first').delete()
+        self.album.refresh_from_db()
+        self.assertIsNone(self.album.last_uploaded)
+
+    def test_deleting_an_album_costs_the_same_for_any_number_of_images(self):
+        def delete_album(images):
+            album = Album.objects.create(owner=self.album.owner, name='Gone', is_public=True, date_created='2021-06-01')
+            blobs = [Blob.objects.create(sha256=f'{images}-{i}', object_name=f'{images}-{i}.jpg', size=1, ref_count=3)
+                     for i in range(2)]
+            for i in range(images):
+                Image.objects.create(album=album, title=f'{i}', location=f'http://minio/{i}.jpg',
+                                     date_uploaded='2021-06-02', blob=blobs[i % 2])
+            with CaptureQueriesContext(connection) as captured:
+                album.delete()
+            self.assertEqual([blob.ref_count for blob in Blob.objects.filter(id__in=[blob.id for blob in blobs])],
+                             [3 - (images + 1) // 2, 3 - images // 2])
+            return len(captured)
+
+        self.assertEqual(delete_album(2), delete_album(6))
+
+    def test_recompute_repairs_drift(self):
+        image = self.add_image('first', '2021-06-02')
+        Album.objects.filter(id=self.album.id).update(image_count=7, last_uploaded=None, cover_image=None)
+        self.assertEqual(album_stats.recompute([self.album.id]), 1)
+        self.album.refresh_from_db()
+        self.assertEqual(self.album.image_count, 1)
+        self.assertEqual(str(self.album.last_uploaded), '2021-06-02')
+        self.assertEqual(self.album.cover_image, image)
+
+    def test_recompute_command(self):
+        Image.objects.bulk_create([Image(album=self.album, title=f'bulk{i}', location=f'http://minio/bulk{i}.jpg',
+                                         date_uploaded='2021-06-02') for i in range(3)])
+        call_command('recompute_album_stats', album=[self.album.id], stdout=StringIO())
+        self.album.refresh_from_db()
+        self.assertEqual(self.album.image_count, 3)
+
+
+class AlbumStatsTransactionTest(TransactionTestCase):
+    """
+    Runs in autocommit, as the app does, to show the stats commit or roll back with the image.
+    """
+    def setUp(self):
+        test_user = User.objects.create_user(username='testUser123')
+        self.album = Album.objects.create(owner=test_user, name='Beach Vacation Summer 2021', is_public=True,
+                                          date_created='2021-06-01')
+
+    def add_image(self, title, date_uploaded):
+        return Image.objects.create(album=self.album, title=title, location=f'{title}.jpg',
+                                    date_uploaded=date_uploaded)
+
+    def test_failed_stats_update_rolls_back_the_image(self):
+        with patch('flickrapp.signals.album_stats.image_added', side_effect=DatabaseError), \
+                self.assertRaises(DatabaseError):
+            self.add_image('first', '2021-06-02')
+        self.assertFalse(Image.objects.exists())
+
+    def test_failed_stats_update_rolls_back_the_delete(self):
+        image = self.add_image('first', '2021-06-02')
+        with patch('flickrapp.signals.album_stats.image_removed', side_effect=DatabaseError), \
+                self.assertRaises(DatabaseError):
+            image.delete()
+        self.assertTrue(Image.objects.filter(id=image.id).exists())
+        self.album.refresh_from_db()
+        self.assertEqual(self.album.image_count, 1)
+
+
+class ListQueryIndexTest(TestCase):
+    """
+    The list views and API page through these queries; each should be answered by walking
+    one index in order, without a table scan or a separate sort step.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user(username='testUser123')
+        test_user = User.objects.get(id=1)
+        Album.objects.create(owner=test_user, name='Beach Vacation Summer 2021', is_public=True,
+                             date_created='2021-06-01')
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(f'USING INDEX {index_name}', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_public_albums(self):
+        queryset = Album.objects.filter(is_public=True).order_by('date_created', 'id')
+        self.assertUsesIndex(queryset, 'album_public_created_idx')
+
+    def test_own_albums(self):
+        queryset = Album.objects.filter(owner_id=1).order_by('date_created', 'id')
+        self.assertUsesIndex(queryset, 'album_owner_created_idx')
+
+    def test_public_albums_of_user(self):
+        queryset = Album.objects.filter(owner_id=1).filter(is_public=True).order_by('date_created', 'id')
+        self.assertUsesIndex(queryset, 'album_owner_public_idx')
+
+    def test_all_albums_after_cursor(self):
+        # The seek filter used by api.pagination.KeysetPagination
+        after_cursor = Q(date_created__gt='2021-01-01') | Q(date_created='2021-01-01', id__gt=1)
+        queryset = Album.objects.filter(after_cursor).order_by('date_created', 'id')[:100]
+        self.assertUsesIndex(queryset, 'album_created_idx')
+
+    def test_ready_images_of_album(self):
+        queryset = Image.objects.filter(album_id=1, status=Image.Status.READY).order_by('date_uploaded', 'id')
+        self.assertUsesIndex(queryset, 'image_album_ready_idx')
+
+    def test_images_of_album(self):
+        queryset = Image.objects.filter(album_id=1).order_by('date_uploaded', 'id')
+        self.assertUsesIndex(queryset, 'image_album_uploaded_idx')
+
+    def test_all_images(self):
+        queryset = Image.objects.order_by('date_uploaded', 'id')[:100]
+        self.assertUsesIndex(queryset, 'image_uploaded_idx')
+
+    def test_last_upload_of_album(self):
+        queryset = (Image.objects.filter(album_id=1, status=Image.Status.READY)
+                    .order_by('-date_uploaded', '-id').values('date_uploaded')[:1])
+        self.assertUsesIndex(queryset, 'image_album_ready_idx')
+
+    def test_pending_uploads(self):
+        queryset = Image.objects.filter(status=Image.Status.PENDING).order_by('id')
+        self.assertUsesIndex(queryset, 'image_pending_idx')
@@ -0,0 +1,117 @@
+from io import BytesIO, StringIO
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.core.management import call_command
+from django.test import TestCase
+
+from flickrapp import derivatives, rebalance
+from flickrapp.models import Album, Blob, Image, PendingUpload
+from flickrapp.utils import file_utils, placement
+from flickrapp.utils.fake_storage import FakeMinio
+
+
+NODE_A = {'name': 'a', 'bucket': 'uploads', 'endpoint': 'minio-a:9000'}
+NODE_B = {'name': 'b', 'bucket': 'uploads', 'endpoint': 'minio-b:9000'}
+
+
+class RebalanceTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.album = Album.objects.create(owner=User.objects.create_user(username='testUser123'), name='Beach',
+                                         is_public=True, date_created='2021-06-01')
+
+    def setUp(self):
+        self.addCleanup(file_utils.reset_client)
+        self.storage = {'a': FakeMinio(), 'b': FakeMinio()}
+        # Objects are stored while there is only node a, then node b is added
+        self.use_nodes([NODE_A])
+        ring = placement.HashRing(['a', 'b'], points=file_utils.settings.STORAGE_RING_POINTS)
+        self.name = next(name for name in (f'beach-{i}.jpg' for i in range(100)) if ring.get_node(name) == 'b')
+
+    def use_nodes(self, nodes):
+        patcher = patch.object(file_utils.settings, 'STORAGE_NODES', nodes)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        file_utils.reset_client()
+        for name, client in self.storage.items():
+            file_utils.set_client(client, node=name)
+
+    def store(self, object_name):
+        file = InMemoryUploadedFile(BytesIO(b'Hello'), 'file', 'beach.jpg', 'image/jpeg', 5, None)
+        file_utils.get_uploader(object_name).upload(source=file, object_name=object_name)
+        return file_utils.get_location(object_name)
+
+    def stored(self, node):
+        return set(self.storage[node].buckets.get('uploads', {}))
+
+    def test_blob_moves_to_new_node(self):
+        object_name = file_utils.place(self.name)
+        thumbnail = derivatives.get_derivative_object_name(object_name, 'thumbnail')
+        blob = Blob.objects.create(sha256='abc', object_name=object_name, size=5, ref_count=2)
+        for _ in range(2):
+            Image.objects.create(album=self.album, title='Beach', location=self.store(object_name),
+                                 thumbnail_location=self.store(thumbnail), blob=blob, date_uploaded='2021-06-02')
+        self.use_nodes([NODE_A, NODE_B])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('rebalance_storage', stdout=StringIO())
+
+        blob.refresh_from_db()
+        self.assertEqual(file_utils.get_node(blob.object_name).name, 'b')
+        new_thumbnail = derivatives.get_derivative_object_name(blob.object_name, 'thumbnail')
+        self.assertEqual(self.stored('b'), {blob.object_name, new_thumbnail})
+        self.assertEqual(self.stored('a'), set())
+        for image in Image.objects.all():
+            self.assertEqual((image.location, image.thumbnail_location, image.medium_location),
+                             (blob.object_name, new_thumbnail, ''))
+
+    def test_objects_stored_before_keys_named_their_node_move(self):
+        self.store('beach.jpg')
+        image = Image.objects.create(album=self.album, title='Beach',
+                                     location='http://localhost:9000/uploads/beach.jpg', date_uploaded='2021-06-02')
+        external = Image.objects.create(album=self.album, title='Beach', location='https://example.com/beach.jpg',
+                                        date_uploaded='2021-06-02')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(rebalance.rebalance(), 1)
+
+        image.refresh_from_db()
+        self.assertEqual(image.location, file_utils.place('beach.jpg'))
+        self.assertEqual(self.stored('a'), {image.location})
+        external.refresh_from_db()
+        self.assertEqual(external.location, 'https://example.com/beach.jpg')
+        # Everything is in place now
+        self.assertEqual(rebalance.rebalance(), 0)
+
+    def test_dry_run_moves_nothing(self):
+        object_name = file_utils.place(self.name)
+        image = Image.objects.create(album=self.album, title='Beach', location=self.store(object_name),
+                                     date_uploaded='2021-06-02')
+        self.use_nodes([NODE_A, NODE_B])
+
+        out = StringIO()
+        call_command('rebalance_storage', dry_run=True, stdout=out)
+
+        self.assertIn('Would move 1 object(s)', out.getvalue())
+        image.refresh_from_db()
+        self.assertEqual(image.location, object_name)
+        self.assertEqual(self.stored('a'), {object_name})
+
+    def test_blob_with_upload_in_flight_is_left_for_next_run(self):
+        object_name = file_utils.place(self.name)
+        self.store(object_name)
+        Blob.objects.create(sha256='abc', object_name=object_name, size=5, ref_count=1)
+        image = Image.objects.create(album=self.album, title='Beach', location='', status=Image.Status.UPLOADING,
+                                     date_uploaded='2021-06-02')
+        PendingUpload.objects.create(image=image, staging_path='/tmp/beach.jpg', object_name=object_name,
+                                     sha256='abc')
+        self.use_nodes([NODE_A, NODE_B])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(rebalance.rebalance(), 0)
+
+        self.assertEqual(Blob.objects.get(sha256='abc').object_name, object_name)
+        self.assertEqual(self.stored('a'), {object_name})
+        self.assertEqual(self.stored('b'), set())
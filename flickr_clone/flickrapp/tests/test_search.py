@@ -0,0 +1,63 @@
+from unittest.mock import patch
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.db import connection
+from django.db.backends.postgresql.base import DatabaseWrapper
+from django.test import TestCase
+
+from flickrapp import search
+from flickrapp.models import Album, Image
+
+
+class SearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user(username='testUser123')
+        cls.other = User.objects.create_user(username='testUser789')
+        cls.public = Album.objects.create(owner=cls.owner, name='Beach Vacation Summer 2021', is_public=True,
+                                          date_created='2021-06-01')
+        cls.private = Album.objects.create(owner=cls.owner, name='Beach Secrets', is_public=False,
+                                           date_created='2021-07-01')
+        Album.objects.create(owner=cls.other, name='Ski mountain 2021', is_public=True, date_created='2021-01-01')
+        Image.objects.create(album=cls.public, title='Beach house (front)', location='front.jpg',
+                             date_uploaded='2021-06-02')
+        Image.objects.create(album=cls.public, title='Beach house (pending)', location='pending.jpg',
+                             date_uploaded='2021-06-02', status=Image.Status.PENDING)
+        Image.objects.create(album=cls.private, title='Beach house (back)', location='back.jpg',
+                             date_uploaded='2021-07-02')
+
+    def test_anonymous_users_only_find_public_albums(self):
+        albums = search.search_albums('beach', AnonymousUser())
+        self.assertEqual(list(albums), [self.public])
+
+    def test_owners_find_their_private_albums(self):
+        albums = search.search_albums('beach', self.owner)
+        self.assertEqual(set(albums), {self.public, self.private})
+        self.assertEqual(list(search.search_albums('beach', self.other)), [self.public])
+
+    def test_partial_words_match(self):
+        self.assertEqual(list(search.search_albums('vacat', AnonymousUser())), [self.public])
+
+    def test_every_word_must_match(self):
+        self.assertEqual(list(search.search_albums('beach 2021', AnonymousUser())), [self.public])
+        self.assertEqual(list(search.search_albums('beach ski', AnonymousUser())), [])
+
+    def test_only_ready_images_in_visible_albums_are_found(self):
+        titles = [image.title for image in search.search_images('house', AnonymousUser())]
+        self.assertEqual(titles, ['Beach house (front)'])
+        titles = sorted(image.title for image in search.search_images('house', self.owner))
+        self.assertEqual(titles, ['Beach house (back)', 'Beach house (front)'])
+
+    def test_blank_query_finds_nothing(self):
+        self.assertEqual(list(search.search_images('  ', self.owner)), [])
+
+    def test_postgres_query_uses_the_search_indexes(self):
+        # Compiled for Postgres without connecting to one
+        postgres = DatabaseWrapper({**connection.settings_dict, 'ENGINE': 'django.db.backends.postgresql'})
+        with patch('flickrapp.search._is_postgres', return_value=True):
+            queryset = search.search_images('beach house', AnonymousUser())
+        sql, _ = queryset.query.get_compiler(connection=postgres).as_sql()
+        self.assertIn('websearch_to_tsquery', sql)
+        self.assertIn('"flickrapp_image"."search_vector" @@', sql)
+        self.assertIn('"flickrapp_image"."title" %%> %s', sql)
+        self.assertIn('WORD_SIMILARITY', sql)
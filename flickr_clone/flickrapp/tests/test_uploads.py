@@ -0,0 +1,313 @@
+import hashlib
+import os
+import tempfile
+from datetime import timedelta
+from io import BytesIO
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from PIL import Image as PILImage
+
+from flickrapp import blobs, derivatives, uploads
+from flickrapp.models import Album, Blob, Image, PendingUpload
+from flickrapp.utils import placement
+
+
+class UploadPipelineTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user(username='testUser123')
+        test_user = User.objects.get(id=1)
+        Album.objects.create(owner=test_user, name='Beach Vacation Summer 2021', is_public=True,
+                             date_created='2021-06-01')
+
+    def setUp(self):
+        staging_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(staging_dir.cleanup)
+        self.staging_dir = staging_dir.name
+        override = override_settings(UPLOAD_STAGING_DIR=self.staging_dir, UPLOAD_MAX_ATTEMPTS=2,
+                                     DERIVATIVE_PROCESSES=0)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def queue_image(self):
+        album = Album.objects.get(id=1)
+        file = SimpleUploadedFile('beach.jpg', b'Hello, world', content_type='image/jpeg')
+        return uploads.queue_upload(file, album=album, title='Beach House (front)')
+
+    def test_in_memory_file_is_staged(self):
+        path = uploads.stage_file(SimpleUploadedFile('beach.jpg', b'Hello, world'))
+        self.assertEqual(os.path.dirname(path), self.staging_dir)
+        with open(path, 'rb') as staged:
+            self.assertEqual(staged.read(), b'Hello, world')
+
+    def test_temporary_file_is_moved_into_staging(self):
+        file = TemporaryUploadedFile('beach.jpg', 'image/jpeg', 12, None)
+        file.write(b'Hello, world')
+        file.flush()
+        original_path = file.temporary_file_path()
+        path = uploads.stage_file(file)
+        file.close()
+        self.assertFalse(os.path.exists(original_path))
+        with open(path, 'rb') as staged:
+            self.assertEqual(staged.read(), b'Hello, world')
+
+    def test_queue_upload_creates_pending_image(self):
+        image = self.queue_image()
+        self.assertEqual(image.status, Image.Status.PENDING)
+        pending = PendingUpload.objects.get(image=image)
+        self.assertEqual(pending.content_type, 'image/jpeg')
+        self.assertTrue(image.location.endswith(pending.object_name))
+
+    def test_queue_uploads_creates_all_images_at_once(self):
+        album = Album.objects.get(id=1)
+        files = [SimpleUploadedFile(f'beach{i}.jpg', b'Hello, world', content_type='image/jpeg') for i in range(5)]
+        with patch('flickrapp.uploads.submit') as mock_submit, \
+                self.captureOnCommitCallbacks(execute=True):
+            results = uploads.queue_uploads(files, album=album)
+        self.assertEqual([result['status'] for result in results], [Image.Status.PENDING] * 5)
+        self.assertEqual(Image.objects.filter(status=Image.Status.PENDING).count(), 5)
+        self.assertEqual(PendingUpload.objects.count(), 5)
+        self.assertEqual(sorted(Image.objects.values_list('title', flat=True)), [f'beach{i}' for i in range(5)])
+        # Every image is handed to the upload workers
+        self.assertEqual(sorted(c.args[0] for c in mock_submit.call_args_list),
+                         sorted(result['id'] for result in results))
+
+    def test_queue_uploads_reports_failed_files(self):
+        album = Album.objects.get(id=1)
+        files = [SimpleUploadedFile('beach.jpg', b'Hello, world'), SimpleUploadedFile('empty.jpg', b'')]
+        results = uploads.queue_uploads(files, album=album)
+        self.assertEqual(results[0]['status'], Image.Status.PENDING)
+        self.assertEqual(results[1],
+                         {'file': 'empty.jpg', 'status': Image.Status.FAILED, 'error': 'The file is empty.'})
+        self.assertEqual(Image.objects.count(), 1)
+
+    def test_successful_upload_marks_image_ready(self):
+        image = self.queue_image()
+        self.assertEqual(Album.objects.get(id=1).image_count, 0)
+        staging_path = image.pending_upload.staging_path
+        with patch('flickrapp.uploads.file_utils.MinioUploader') as mock_uploader, \
+                patch('flickrapp.uploads.derivatives.create_derivatives'):
+            self.assertTrue(uploads.process_upload(image.id))
+        mock_uploader.return_value.upload.assert_called_once()
+        image.refresh_from_db()
+        self.assertEqual(image.status, Image.Status.READY)
+        self.assertFalse(PendingUpload.objects.filter(image=image).exists())
+        self.assertFalse(os.path.exists(staging_path))
+        # Pending images don't count until they are ready
+        album = Album.objects.get(id=1)
+        self.assertEqual(album.image_count, 1)
+        self.assertEqual(album.cover_image_id, image.id)
+
+    def test_failed_upload_is_retried(self):
+        image = self.queue_image()
+        with patch('flickrapp.uploads.file_utils.MinioUploader') as mock_uploader, \
+                self.assertRaises(ConnectionError):
+            mock_uploader.return_value.upload.side_effect = ConnectionError()
+            uploads.process_upload(image.id)
+        image.refresh_from_db()
+        self.assertEqual(image.status, Image.Status.PENDING)
+        self.assertEqual(image.pending_upload.attempts, 1)
+
+    def test_upload_fails_after_max_attempts(self):
+        image = self.queue_image()
+        staging_path = image.pending_upload.staging_path
+        with patch('flickrapp.uploads.file_utils.MinioUploader') as mock_uploader:
+            mock_uploader.return_value.upload.side_effect = ConnectionError()
+            for _ in range(2):
+                with self.assertRaises(ConnectionError):
+                    uploads.process_upload(image.id)
+        image.refresh_from_db()
+        self.assertEqual(image.status, Image.Status.FAILED)
+        self.assertFalse(os.path.exists(staging_path))
+
+    def test_claimed_image_is_not_uploaded_twice(self):
+        image = self.queue_image()
+        Image.objects.filter(id=image.id).update(status=Image.Status.UPLOADING)
+        with patch('flickrapp.uploads.file_utils.MinioUploader') as mock_uploader:
+            self.assertFalse(uploads.process_upload(image.id))
+        mock_uploader.return_value.upload.assert_not_called()
+
+    def test_stale_claim_is_requeued(self):
+        image = self.queue_image()
+        Image.objects.filter(id=image.id).update(status=Image.Status.UPLOADING)
+        PendingUpload.objects.filter(image=image).update(date_claimed=timezone.now() - timedelta(hours=1))
+        self.assertEqual(uploads.requeue_stale_claims(), 1)
+        # The staged file is no image, so there are no renditions
+        with patch('flickrapp.uploads.file_utils.MinioUploader'), \
+                self.assertLogs('flickrapp.derivatives', 'WARNING'):
+            self.assertTrue(uploads.process_upload(image.id))
+        image.refresh_from_db()
+        self.assertEqual(image.status, Image.Status.READY)
+
+    def test_recent_claim_is_not_requeued(self):
+        image = self.queue_image()
+        Image.objects.filter(id=image.id).update(status=Image.Status.UPLOADING)
+        PendingUpload.objects.filter(image=image).update(date_claimed=timezone.now())
+        self.assertEqual(uploads.requeue_stale_claims(), 0)
+
+    def test_successful_upload_stores_renditions(self):
+        album = Album.objects.get(id=1)
+        jpeg = BytesIO()
+        PILImage.new('RGB', (1600, 1200), 'blue').save(jpeg, 'JPEG')
+        file = SimpleUploadedFile('beach.jpg', jpeg.getvalue(), content_type='image/jpeg')
+        image = uploads.queue_upload(file, album=album, title='Beach')
+        object_name = image.pending_upload.object_name
+        with patch('flickrapp.uploads.file_utils.MinioUploader') as mock_uploader, \
+                patch('flickrapp.derivatives.file_utils.MinioUploader', mock_uploader):
+            uploads.process_upload(image.id)
+        uploaded_names = [c.kwargs['object_name'] for c in mock_uploader.return_value.upload.call_args_list]
+        self.assertEqual(uploaded_names, [object_name,
+                                          derivatives.get_derivative_object_name(object_name, 'thumbnail'),
+                                          derivatives.get_derivative_object_name(object_name, 'medium')])
+        image.refresh_from_db()
+        self.assertEqual(image.status, Image.Status.READY)
+        self.assertTrue(image.thumbnail_url.endswith('.thumbnail.jpg'))
+        self.assertTrue(image.medium_url.endswith('.medium.jpg'))
+        self.assertEqual((image.width, image.height, image.orientation), (1600, 1200, Image.Orientation.LANDSCAPE))
+        # Only the renditions' temporary files are cleaned up, nothing is left in staging
+        self.assertEqual(os.listdir(self.staging_dir), [])
+
+    def test_undecodable_upload_falls_back_to_original(self):
+        image = self.queue_image()
+        with patch('flickrapp.uploads.file_utils.MinioUploader'), \
+                self.assertLogs('flickrapp.derivatives', 'WARNING'):
+            uploads.process_upload(image.id)
+        image.refresh_from_db()
+        self.assertEqual(image.status, Image.Status.READY)
+        self.assertEqual(image.thumbnail_url, image.url)
+        self.assertEqual(image.medium_url, image.url)
+
+
+class DeduplicationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user(username='testUser123')
+        test_user = User.objects.get(id=1)
+        Album.objects.create(owner=test_user, name='Beach Vacation Summer 2021', is_public=True,
+                             date_created='2021-06-01')
+        Album.objects.create(owner=test_user, name='Best of 2021', is_public=True, date_created='2021-12-31')
+
+    def setUp(self):
+        staging_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(staging_dir.cleanup)
+        override = override_settings(UPLOAD_STAGING_DIR=staging_dir.name, DERIVATIVE_PROCESSES=0)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def upload(self, album_id, name='beach.jpg', content=b'Hello, world'):
+        file = SimpleUploadedFile(name, content, content_type='image/jpeg')
+        image = uploads.queue_upload(file, album=Album.objects.get(id=album_id), title='Beach')
+        uploads.process_upload(image.id)
+        image.refresh_from_db()
+        return image
+
+    def test_object_is_named_by_content(self):
+        with patch('flickrapp.uploads.file_utils.MinioUploader'), \
+                patch('flickrapp.uploads.derivatives.create_derivatives'):
+            image = self.upload(1)
+        sha256 = hashlib.sha256(b'Hello, world').hexdigest()
+        self.assertEqual(image.location, placement.shard_key(f'{sha256}.jpg', 'uploads'))
+        self.assertEqual(image.blob.sha256, sha256)
+        self.assertEqual(image.blob.size, 12)
+        self.assertEqual(image.blob.ref_count, 1)
+
+    def test_duplicate_upload_skips_transfer_and_shares_renditions(self):
+        with patch('flickrapp.uploads.file_utils.MinioUploader') as mock_uploader, \
+                patch('flickrapp.uploads.derivatives.create_derivatives') as mock_create_derivatives:
+            first = self.upload(1)
+            Image.objects.filter(id=first.id).update(thumbnail_location='first.thumbnail.jpg',
+                                                     medium_location='first.medium.jpg')
+            second = self.upload(2, name='copy.JPG')
+        mock_uploader.return_value.upload.assert_called_once()
+        mock_create_derivatives.assert_called_once()
+        self.assertEqual(second.status, Image.Status.READY)
+        self.assertEqual(second.blob_id, first.blob_id)
+        self.assertEqual(second.location, first.location)
+        self.assertEqual(second.thumbnail_location, 'first.thumbnail.jpg')
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+
+    def test_different_content_is_stored_separately(self):
+        with patch('flickrapp.uploads.file_utils.MinioUploader') as mock_uploader, \
+                patch('flickrapp.uploads.derivatives.create_derivatives'):
+            first = self.upload(1)
+            second = self.upload(1, content=b'Goodbye, world')
+        self.assertEqual(mock_uploader.return_value.upload.call_count, 2)
+        self.assertNotEqual(first.blob_id, second.blob_id)
+
+    def test_blob_is_removed_with_its_last_image(self):
+        with patch('flickrapp.uploads.file_utils.MinioUploader'), \
+                patch('flickrapp.uploads.derivatives.create_derivatives'):
+            first = self.upload(1)
+            second = self.upload(2)
+        object_name = first.blob.object_name
+
+        with patch('flickrapp.blobs.file_utils.MinioUploader') as mock_uploader, \
+                self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        mock_uploader.return_value.remove.assert_not_called()
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+
+        with patch('flickrapp.blobs.file_utils.MinioUploader') as mock_uploader, \
+                self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(Blob.objects.exists())
+        removed = [c.args[0] for c in mock_uploader.return_value.remove.call_args_list]
+        self.assertEqual(removed, [object_name,
+                                   derivatives.get_derivative_object_name(object_name, 'thumbnail'),
+                                   derivatives.get_derivative_object_name(object_name, 'medium')])
+
+    def test_blob_referenced_again_before_removal_is_kept(self):
+        with patch('flickrapp.uploads.file_utils.MinioUploader'), \
+                patch('flickrapp.uploads.derivatives.create_derivatives'):
+            image = self.upload(1)
+        with self.captureOnCommitCallbacks() as callbacks:
+            image.delete()
+        # An upload of the same content comes in before the storage is cleared
+        self.assertTrue(blobs.add_reference(image.blob.sha256))
+        with patch('flickrapp.blobs.file_utils.MinioUploader') as mock_uploader:
+            for callback in callbacks:
+                callback()
+        mock_uploader.return_value.remove.assert_not_called()
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+
+    def test_image_deleted_during_upload_leaves_no_blob(self):
+        file = SimpleUploadedFile('beach.jpg', b'Hello, world', content_type='image/jpeg')
+        image = uploads.queue_upload(file, album=Album.objects.get(id=1), title='Beach')
+        staging_path = image.pending_upload.staging_path
+        object_name = image.pending_upload.object_name
+        with patch('flickrapp.uploads.file_utils.MinioUploader') as mock_uploader, \
+                patch('flickrapp.uploads.derivatives.create_derivatives') as mock_create_derivatives, \
+                self.captureOnCommitCallbacks(execute=True):
+            mock_uploader.return_value.upload.side_effect = lambda **kwargs: Image.objects.get(id=image.id).delete()
+            self.assertFalse(uploads.process_upload(image.id))
+        mock_create_derivatives.assert_not_called()
+        self.assertFalse(Blob.objects.exists())
+        # The content nobody references any more is removed again
+        removed = [c.args[0] for c in mock_uploader.return_value.remove.call_args_list]
+        self.assertEqual(removed[0], object_name)
+        self.assertFalse(os.path.exists(staging_path))
+
+    def test_duplicate_deleted_during_upload_releases_its_reference(self):
+        with patch('flickrapp.uploads.file_utils.MinioUploader'), \
+                patch('flickrapp.uploads.derivatives.create_derivatives') as mock_create_derivatives:
+            self.upload(1)
+            # The reference is on the image while its renditions are made, so deleting it releases that
+            mock_create_derivatives.side_effect = lambda image_id, *args: Image.objects.get(id=image_id).delete()
+            file = SimpleUploadedFile('copy.jpg', b'Hello, world', content_type='image/jpeg')
+            uploads.process_upload(uploads.queue_upload(file, album=Album.objects.get(id=2), title='Beach').id)
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        self.assertEqual(Image.objects.count(), 1)
+
+    def test_deleting_an_album_releases_its_images(self):
+        with patch('flickrapp.uploads.file_utils.MinioUploader'), \
+                patch('flickrapp.uploads.derivatives.create_derivatives'):
+            self.upload(1)
+            self.upload(2)
+        with patch('flickrapp.blobs.file_utils.MinioUploader'):
+            Album.objects.get(id=1).delete()
+        self.assertEqual(Blob.objects.get().ref_count, 1)
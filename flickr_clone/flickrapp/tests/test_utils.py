@@ -1,14 +1,33 @@
-from datetime import datetime
-from unittest.mock import patch
+import asyncio
+import hashlib
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+from io import BytesIO, StringIO
+from unittest.mock import AsyncMock, patch
 
+from django.core.exceptions import ImproperlyConfigured
 from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
-from django.test import TestCase
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.contrib.auth.models import User
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from PIL import Image as PILImage
 
 from flickr_clone import settings
-from flickrapp.utils.file_utils import MinioUploader, upload_file
+from flickrapp import derivatives
+from flickrapp.models import Album, Image
+from flickrapp.utils import file_utils, http_utils, image_utils, load_utils, placement
+from flickrapp.utils.fake_storage import FakeMinio
+from flickrapp.utils.file_utils import MinioUploader, get_client, upload_file
 
 
 class FileUtilTest(TestCase):
+    def setUp(self):
+        # Every test starts without a cached client or known buckets
+        file_utils.reset_client()
+
     def test_upload_file_returns_location(self):
         title = 'TestTitle'
         dt_now = datetime.now()
@@ -19,7 +38,7 @@ class FileUtilTest(TestCase):
                                          field_name=None,
                                          file=None,
                                          size=None)
-        expected_location = f'http://localhost:{settings.MINIO_PORT}/uploads/TestTitle-{timestamp}.txt'
+        expected_location = placement.shard_key(f'TestTitle-{timestamp}.txt', 'uploads')
         with patch('flickrapp.utils.file_utils.MinioUploader'), \
                 patch('flickrapp.utils.file_utils.MinioUploader.upload'), \
                 patch('flickrapp.utils.file_utils.datetime') as mock_datetime:
@@ -33,7 +52,7 @@ class FileUtilTest(TestCase):
         with patch('flickrapp.utils.file_utils.Minio') as mock_minio, \
                 patch('flickrapp.utils.file_utils.Minio.bucket_exists', return_value=False), \
                 patch('flickrapp.utils.file_utils.Minio.make_bucket') as mock_make_bucket, \
-                patch('flickrapp.utils.file_utils.Minio.fput_object'):
+                patch('flickrapp.utils.file_utils.Minio.put_object'):
             uploader = MinioUploader()
             uploader.client = mock_minio
             uploader.upload(source=mock_file, object_name="")
@@ -45,59 +64,450 @@ class FileUtilTest(TestCase):
         with patch('flickrapp.utils.file_utils.Minio') as mock_minio, \
                 patch('flickrapp.utils.file_utils.Minio.bucket_exists', return_value=True), \
                 patch('flickrapp.utils.file_utils.Minio.make_bucket') as mock_make_bucket, \
-                patch('flickrapp.utils.file_utils.Minio.fput_object'):
+                patch('flickrapp.utils.file_utils.Minio.put_object'):
             uploader = MinioUploader()
             uploader.client = mock_minio
             uploader.upload(source=mock_file, object_name="")
             mock_make_bucket.assert_not_called()
 
     @staticmethod
-    def test_in_memory_file_gets_written():
-        dt_now = datetime.now()
+    def test_bucket_checked_only_once_per_process():
+        mock_file = TemporaryUploadedFile('./test_data/file.txt', None, None, None, None)
+        with patch('flickrapp.utils.file_utils.Minio') as mock_minio, \
+                patch('flickrapp.utils.file_utils.Minio.bucket_exists', return_value=True) as mock_bucket_exists, \
+                patch('flickrapp.utils.file_utils.Minio.put_object'):
+            for _ in range(3):
+                uploader = MinioUploader()
+                uploader.client = mock_minio
+                uploader.upload(source=mock_file, object_name="")
+            mock_bucket_exists.assert_called_once()
+
+    def test_client_shared_across_uploaders(self):
+        self.assertIs(MinioUploader().client, MinioUploader().client)
+        self.assertIs(MinioUploader().client, get_client())
+
+    def test_download_url_is_stable_within_signing_time(self):
+        signed_at = datetime(2022, 6, 2, tzinfo=timezone.utc)
+        urls = {MinioUploader().get_download_url('beach.jpg', expires=timedelta(days=2), signed_at=signed_at,
+                                                 cache_control='public, max-age=60') for _ in range(2)}
+        self.assertEqual(len(urls), 1)
+        url = urls.pop()
+        self.assertTrue(url.startswith('http://localhost:9000/uploads/beach.jpg?'))
+        self.assertIn('response-cache-control=public%2C%20max-age%3D60', url)
+
+    def test_client_uses_configured_pool_size(self):
+        with patch('flickrapp.utils.file_utils.settings.MINIO_POOL_SIZE', 42):
+            client = get_client()
+        self.assertEqual(client._http.connection_pool_kw['maxsize'], 42)
+
+    @staticmethod
+    def test_in_memory_file_streamed_to_bucket():
         mock_file = InMemoryUploadedFile(name='filename.txt',
                                          charset=None,
                                          content_type='text/plain',
                                          field_name=None,
-                                         file=None,
-                                         size=None)
+                                         file=BytesIO(b'Hello, world'),
+                                         size=12)
         with patch('flickrapp.utils.file_utils.Minio') as mock_minio, \
                 patch('flickrapp.utils.file_utils.Minio.bucket_exists', return_value=True), \
-                patch('flickrapp.utils.file_utils.datetime') as mock_datetime, \
-                patch('flickrapp.utils.file_utils.MinioUploader._write_tmp_file', return_value='/path') as mock_write_tmp_file, \
-                patch('flickrapp.utils.file_utils.Minio.fput_object') as mock_fput:
+                patch('flickrapp.utils.file_utils.Minio.put_object') as mock_put:
+            uploader = MinioUploader()
+            uploader.client = mock_minio
+            uploader.upload(source=mock_file, object_name='testobject')
+            mock_put.assert_called_with(bucket_name='uploads',
+                                        object_name='testobject',
+                                        data=mock_file,
+                                        length=12,
+                                        content_type='text/plain',
+                                        part_size=settings.MINIO_PART_SIZE)
+
+    @staticmethod
+    def test_temporary_file_streamed_to_bucket():
+        mock_file = TemporaryUploadedFile('./test_data/file.txt', 'text/plain', 12, None, None)
+        with patch('flickrapp.utils.file_utils.Minio') as mock_minio, \
+                patch('flickrapp.utils.file_utils.Minio.bucket_exists', return_value=True), \
+                patch('flickrapp.utils.file_utils.Minio.put_object') as mock_put:
             uploader = MinioUploader()
             uploader.client = mock_minio
-            mock_datetime.now.return_value = dt_now
             uploader.upload(source=mock_file, object_name='testobject')
-            mock_write_tmp_file.assert_called_once()
-            mock_fput.assert_called_with(bucket_name='uploads',
-                                         object_name="testobject",
-                                         file_path='/path',
-                                         content_type='text/plain')
+            mock_put.assert_called_with(bucket_name='uploads',
+                                        object_name='testobject',
+                                        data=mock_file,
+                                        length=12,
+                                        content_type='text/plain',
+                                        part_size=settings.MINIO_PART_SIZE)
 
     @staticmethod
-    def test_temporary_file_returns_tmp_file_path():
-        mock_file = TemporaryUploadedFile('./test_data/file.txt', 'text/plain', None, None, None)
-        expected_path = mock_file.temporary_file_path()
+    def test_unknown_size_streams_until_exhausted():
+        mock_file = InMemoryUploadedFile(name='filename.txt',
+                                         charset=None,
+                                         content_type=None,
+                                         field_name=None,
+                                         file=BytesIO(b'Hello, world'),
+                                         size=None)
         with patch('flickrapp.utils.file_utils.Minio') as mock_minio, \
                 patch('flickrapp.utils.file_utils.Minio.bucket_exists', return_value=True), \
-                patch('flickrapp.utils.file_utils.Minio.fput_object') as mock_fput:
+                patch('flickrapp.utils.file_utils.Minio.put_object') as mock_put:
             uploader = MinioUploader()
             uploader.client = mock_minio
             uploader.upload(source=mock_file, object_name='testobject')
-            mock_fput.assert_called_with(bucket_name='uploads',
-                                         object_name="testobject",
-                                         file_path=expected_path,
-                                         content_type='text/plain')
+            mock_put.assert_called_with(bucket_name='uploads',
+                                        object_name='testobject',
+                                        data=mock_file,
+                                        length=-1,
+                                        content_type='application/octet-stream',
+                                        part_size=settings.MINIO_PART_SIZE)
 
     def test_incorrect_file_argument_returns_value_error(self):
         mock_file = "an incorrect type"
         with patch('flickrapp.utils.file_utils.Minio') as mock_minio, \
                 patch('flickrapp.utils.file_utils.Minio.bucket_exists', return_value=True), \
-                patch('flickrapp.utils.file_utils.Minio.fput_object') as mock_fput, \
+                patch('flickrapp.utils.file_utils.Minio.put_object') as mock_put, \
                 self.assertRaises(ValueError) as context:
             uploader = MinioUploader()
             uploader.client = mock_minio
             uploader.upload(source=mock_file, object_name='testobject')
             self.assertTrue(f'Expected type {type(InMemoryUploadedFile)} or {type(TemporaryUploadedFile)}' in context)
-            mock_fput.assert_not_called()
+            mock_put.assert_not_called()
+
+
+class ContentHashTest(TestCase):
+    def test_file_is_hashed_by_content(self):
+        file = InMemoryUploadedFile(BytesIO(b'Hello, world'), 'file', 'beach.jpg', 'image/jpeg', 12, None)
+        self.assertEqual(file_utils.get_content_hash(file), hashlib.sha256(b'Hello, world').hexdigest())
+        # The file can still be read from the start
+        self.assertEqual(file.read(), b'Hello, world')
+
+    def test_hash_from_upload_handler_is_used(self):
+        file = InMemoryUploadedFile(BytesIO(b'Hello, world'), 'file', 'beach.jpg', 'image/jpeg', 12, None)
+        file.sha256 = 'abc'
+        self.assertEqual(file_utils.get_content_hash(file), 'abc')
+
+    def test_blob_object_name_keeps_extension(self):
+        for file_name, name in (('Beach.JPG', 'abc.jpg'), ('beach', 'abc.bin'), ('beach.' + 'x' * 50, 'abc.bin')):
+            self.assertEqual(file_utils.get_blob_object_name('abc', file_name), placement.shard_key(name, 'uploads'))
+
+    def test_object_name_and_renditions_fit_the_image_location(self):
+        object_name = file_utils.get_object_name('beach.jpeg', 'Beach ' * 40)
+        self.assertTrue(object_name.endswith('.jpeg'))
+        for name in [object_name] + [derivatives.get_derivative_object_name(object_name, rendition)
+                                     for rendition in settings.IMAGE_RENDITIONS]:
+            self.assertLessEqual(len(name), file_utils.MAX_OBJECT_NAME_LENGTH)
+        self.assertEqual(file_utils.MAX_OBJECT_NAME_LENGTH, Image._meta.get_field('location').max_length)
+
+
+class FakeStorageTest(TestCase):
+    def setUp(self):
+        file_utils.set_client(FakeMinio())
+        self.addCleanup(file_utils.reset_client)
+
+    def test_uploaded_object_can_be_read_back(self):
+        file = InMemoryUploadedFile(BytesIO(b'Hello, world'), 'file', 'beach.jpg', 'image/jpeg', 12, None)
+        uploader = MinioUploader()
+        uploader.upload(source=file, object_name='beach.jpg')
+        stat = uploader.stat('beach.jpg')
+        self.assertEqual((stat.size, stat.content_type), (12, 'image/jpeg'))
+        self.assertEqual(b''.join(uploader.open('beach.jpg', offset=7, length=5).stream()), b'world')
+
+    def test_missing_object(self):
+        self.assertIsNone(MinioUploader().stat('missing.jpg'))
+
+
+class PlacementTest(TestCase):
+    def test_shard_key_names_node_and_prefixes_hash(self):
+        key = placement.shard_key('beach.jpg', 'a')
+        self.assertEqual(key, 'a/' + hashlib.md5(b'beach.jpg').hexdigest()[:2] + '/beach.jpg')
+        self.assertEqual(placement.parse_key(key), ('a', 'beach.jpg'))
+        self.assertEqual(placement.parse_key(placement.shard_key('beach.jpg', 'a', length=4)), ('a', 'beach.jpg'))
+        # Keys from before they named their node
+        self.assertIsNone(placement.parse_key('beach.jpg'))
+        self.assertIsNone(placement.parse_key('3f/beach.jpg'))
+
+    def test_ring_spreads_keys_over_nodes(self):
+        ring = placement.HashRing(['a', 'b', 'c'])
+        counts = {'a': 0, 'b': 0, 'c': 0}
+        for i in range(3000):
+            counts[ring.get_node(f'{i}.jpg')] += 1
+        for count in counts.values():
+            self.assertGreater(count, 600)
+
+    def test_adding_node_moves_few_keys(self):
+        keys = [f'{i}.jpg' for i in range(3000)]
+        before = placement.HashRing(['a', 'b', 'c'])
+        after = placement.HashRing(['a', 'b', 'c', 'd'])
+        moved = [key for key in keys if before.get_node(key) != after.get_node(key)]
+        # Only the keys taken over by the new node move, about a quarter of them
+        self.assertTrue(all(after.get_node(key) == 'd' for key in moved))
+        self.assertLess(len(moved), len(keys) / 3)
+
+    def test_ring_needs_nodes(self):
+        with self.assertRaises(ValueError):
+            placement.HashRing([])
+
+
+class StorageNodesTest(TestCase):
+    def setUp(self):
+        nodes = [{'name': 'a', 'bucket': 'uploads', 'endpoint': 'minio-a:9000', 'public_endpoint': 'a.example.com'},
+                 {'name': 'b', 'bucket': 'uploads', 'endpoint': 'minio-b:9000', 'public_endpoint': 'b.example.com'}]
+        patcher = patch.object(file_utils.settings, 'STORAGE_NODES', nodes)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(file_utils.reset_client)
+        file_utils.reset_client()
+        self.storage = {'a': FakeMinio(), 'b': FakeMinio()}
+        for name, client in self.storage.items():
+            file_utils.set_client(client, node=name)
+
+    def test_objects_are_spread_over_nodes(self):
+        for i in range(20):
+            object_name = file_utils.place(f'{i}.jpg')
+            file = InMemoryUploadedFile(BytesIO(b'Hello'), 'file', f'{i}.jpg', 'image/jpeg', 5, None)
+            file_utils.get_uploader(object_name).upload(source=file, object_name=object_name)
+            node = file_utils.get_node(object_name).name
+            self.assertEqual(placement.parse_key(object_name)[0], node)
+            self.assertIn(object_name, self.storage[node].buckets['uploads'])
+        self.assertTrue(all(client.buckets['uploads'] for client in self.storage.values()))
+
+    def test_keys_stay_on_their_node_when_settings_change(self):
+        object_name = placement.shard_key('beach.jpg', 'b')
+        nodes = settings.STORAGE_NODES + [{'name': 'c', 'bucket': 'uploads', 'endpoint': 'minio-c:9000'}]
+        with patch.object(file_utils.settings, 'STORAGE_NODES', nodes), \
+                patch.object(file_utils.settings, 'STORAGE_KEY_PREFIX_LENGTH', 4):
+            file_utils.reset_client()
+            self.assertEqual(file_utils.get_node(object_name).name, 'b')
+        file_utils.reset_client()
+
+    def test_keys_without_node_stay_on_first_node(self):
+        self.assertEqual(file_utils.get_node('beach.jpg').name, 'a')
+        self.assertEqual(file_utils.get_node('3f/beach.jpg').name, 'a')
+
+    def test_key_on_unknown_node_is_an_error(self):
+        with self.assertRaises(ImproperlyConfigured):
+            file_utils.get_node(placement.shard_key('beach.jpg', 'gone'))
+
+    def test_node_names_are_checked(self):
+        nodes = [{'name': 'Node A', 'bucket': 'uploads', 'endpoint': 'minio-a:9000'}]
+        with patch.object(file_utils.settings, 'STORAGE_NODES', nodes):
+            file_utils.reset_client()
+            with self.assertRaises(ImproperlyConfigured):
+                file_utils.get_nodes()
+        file_utils.reset_client()
+
+    def test_public_url_resolves_node(self):
+        object_name = file_utils.place('beach.jpg')
+        node = file_utils.get_node(object_name)
+        self.assertEqual(file_utils.get_public_url(object_name),
+                         f'http://{node.public_endpoint}/uploads/{object_name}')
+        # Locations stored as URLs follow the first node to its current endpoint
+        self.assertEqual(file_utils.get_public_url('http://localhost:9000/uploads/beach.jpg'),
+                         'http://a.example.com/uploads/beach.jpg')
+        self.assertEqual(file_utils.get_public_url(''), '')
+
+    def test_init_storage_creates_bucket_on_every_node(self):
+        call_command('init_storage', stdout=StringIO())
+        self.assertTrue(all('uploads' in client.buckets for client in self.storage.values()))
+
+
+class HttpUtilTest(TestCase):
+    def test_parse_range(self):
+        self.assertEqual(http_utils.parse_range('bytes=0-4', 10), (0, 4))
+        self.assertEqual(http_utils.parse_range('bytes=5-', 10), (5, 9))
+        self.assertEqual(http_utils.parse_range('bytes=-3', 10), (7, 9))
+        self.assertEqual(http_utils.parse_range('bytes=5-100', 10), (5, 9))
+
+    def test_unsupported_range_serves_whole_file(self):
+        for header in (None, 'items=0-4', 'bytes=0-1,4-5', 'bytes=a-b', 'bytes=5-2'):
+            self.assertIsNone(http_utils.parse_range(header, 10))
+
+    def test_range_outside_file_is_not_satisfiable(self):
+        for header in ('bytes=10-', 'bytes=-0'):
+            with self.assertRaises(http_utils.RangeNotSatisfiable):
+                http_utils.parse_range(header, 10)
+
+    def test_address_is_matched_against_addresses_and_networks(self):
+        allowed = ['127.0.0.1', '::1', '172.16.0.0/12']
+        self.assertTrue(http_utils.is_address_in('127.0.0.1', allowed))
+        self.assertTrue(http_utils.is_address_in('::1', allowed))
+        self.assertTrue(http_utils.is_address_in('172.18.0.5', allowed))
+        self.assertFalse(http_utils.is_address_in('10.0.0.1', allowed))
+        self.assertFalse(http_utils.is_address_in('', allowed))
+        self.assertFalse(http_utils.is_address_in(None, allowed))
+
+
+class ImageUtilTest(TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.source_path = os.path.join(tmp_dir.name, 'original')
+        PILImage.new('RGBA', (1600, 1200), 'blue').save(self.source_path, 'PNG')
+
+    def test_cropped_rendition_has_exact_size(self):
+        path = image_utils.render_derivative(self.source_path, f'{self.source_path}.thumb', (300, 200), crop=True)
+        with PILImage.open(path) as rendition:
+            self.assertEqual(rendition.size, (300, 200))
+            self.assertEqual(rendition.format, 'JPEG')
+
+    def test_fitted_rendition_keeps_aspect_ratio(self):
+        path = image_utils.render_derivative(self.source_path, f'{self.source_path}.medium', (1024, 1024), crop=False)
+        with PILImage.open(path) as rendition:
+            self.assertEqual(rendition.size, (1024, 768))
+
+    def test_render_derivatives_writes_next_to_original(self):
+        renditions = {'thumbnail': {'size': (300, 200), 'crop': True}}
+        paths = image_utils.render_derivatives(self.source_path, renditions)
+        self.assertEqual(paths, {'thumbnail': f'{self.source_path}.thumbnail.jpg'})
+        self.assertTrue(os.path.exists(paths['thumbnail']))
+
+    def exif_jpeg(self, orientation=1):
+        exif = PILImage.Exif()
+        exif[image_utils.MAKE] = 'Canon'
+        exif[image_utils.MODEL] = 'EOS 5D'
+        exif[image_utils.ORIENTATION] = orientation
+        details = exif.get_ifd(image_utils.EXIF_IFD)
+        details[image_utils.DATE_TIME_ORIGINAL] = '2021:06:02 10:30:00'
+        details[image_utils.EXIF_TAGS['iso']] = 200
+        data = BytesIO()
+        PILImage.new('RGB', (1600, 1200), 'blue').save(data, 'JPEG', exif=exif)
+        return data.getvalue()
+
+    def test_read_metadata(self):
+        metadata = image_utils.read_metadata(BytesIO(self.exif_jpeg()))
+        self.assertEqual(metadata, {'width': 1600, 'height': 1200, 'orientation': 'landscape',
+                                    'taken_at': datetime(2021, 6, 2, 10, 30), 'camera_make': 'Canon',
+                                    'camera_model': 'EOS 5D', 'exif': {'iso': 200}})
+
+    def test_read_metadata_applies_the_exif_rotation(self):
+        metadata = image_utils.read_metadata(BytesIO(self.exif_jpeg(orientation=6)))
+        self.assertEqual((metadata['width'], metadata['height'], metadata['orientation']), (1200, 1600, 'portrait'))
+
+    def test_read_metadata_only_needs_the_header(self):
+        header = self.exif_jpeg()[:1024]
+        self.assertEqual(image_utils.read_metadata(BytesIO(header))['camera_model'], 'EOS 5D')
+
+    def test_read_metadata_without_exif(self):
+        metadata = image_utils.read_metadata(self.source_path)
+        self.assertEqual((metadata['width'], metadata['orientation'], metadata['taken_at'], metadata['exif']),
+                         (1600, 'landscape', None, {}))
+
+
+class LoadUtilTest(TestCase):
+    def test_percentile_uses_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(load_utils.percentile(values, 50), 50)
+        self.assertEqual(load_utils.percentile(values, 99), 99)
+        self.assertEqual(load_utils.percentile([3.0], 95), 3.0)
+        self.assertEqual(load_utils.percentile([], 95), 0.0)
+
+    def test_run_load_against_local_server(self):
+        received = []
+        uploads = []
+
+        async def handle(reader, writer):
+            request_line = await reader.readline()
+            received.append(request_line.split()[0])
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.lower()] = value.strip()
+            if request_line.startswith(b'POST'):
+                uploads.append(headers)
+            try:
+                await reader.readexactly(int(headers.get('content-length', 0)))
+            except asyncio.IncompleteReadError:
+                # A slow upload cancelled once the measured requests are done
+                writer.close()
+                return
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\nSet-Cookie: csrftoken=abc; Path=/\r\n'
+                         b'Connection: close\r\n\r\nok')
+            await writer.drain()
+            writer.close()
+
+        async def run():
+            server = await asyncio.start_server(handle, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            url = f'http://127.0.0.1:{port}/'
+            try:
+                return await load_utils.run_load(url, requests=20, concurrency=4, slow_upload_url=url,
+                                                 slow_uploads=2, upload_size=100, upload_duration=0.2,
+                                                 headers={'Cookie': 'sessionid=xyz'})
+            finally:
+                server.close()
+                await server.wait_closed()
+
+        summary = asyncio.run(run())
+        self.assertEqual(summary['requests'], 20)
+        self.assertEqual(summary['errors'], 0)
+        self.assertLessEqual(summary['p50'], summary['p99'])
+        # One more GET for the CSRF token of the uploads
+        self.assertEqual(received.count(b'GET'), 21)
+        self.assertEqual(len(uploads), 2)
+        self.assertEqual(uploads[0]['cookie'], 'sessionid=xyz; csrftoken=abc')
+        self.assertEqual(uploads[0]['x-csrftoken'], 'abc')
+        self.assertTrue(uploads[0]['content-type'].startswith('multipart/form-data; boundary='))
+
+    def test_slow_upload_is_accepted_by_upload_view(self):
+        user = User.objects.create_user(username='testUser123')
+        album = Album.objects.create(owner=user, name='Beach', is_public=True, date_created='2021-06-01')
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(user)
+        client.get(reverse('upload_image'))
+        csrf_token = client.cookies['csrftoken'].value
+        content_type, head, tail = load_utils.multipart_upload({'album': str(album.id), 'title': 'Slow'}, 'file',
+                                                               'upload.jpg', 100)
+        with tempfile.TemporaryDirectory() as staging_dir, override_settings(UPLOAD_STAGING_DIR=staging_dir):
+            response = client.generic('POST', reverse('upload_image'), head + b'x' * 100 + tail,
+                                      content_type=content_type, HTTP_X_CSRFTOKEN=csrf_token)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Image.objects.get().title, 'Slow')
+
+    def test_slow_uploads_need_album_and_session(self):
+        with self.assertRaises(CommandError):
+            call_command('loadtest', 'http://localhost:8000/', '--slow-upload-url', 'http://localhost:8000/upload/',
+                         '--slow-uploads', '1', stdout=StringIO())
+
+    def test_loadtest_measures_every_url(self):
+        summary = {'requests': 5, 'errors': 0, 'rps': 10.0, 'p50': 1.0, 'p95': 2.0, 'p99': 3.0, 'max': 4.0}
+        urls = ['http://localhost:8001/flickr/albums/', 'http://localhost:8001/flickr/async/albums/']
+        out = StringIO()
+        with patch('flickrapp.utils.load_utils.run_load', new=AsyncMock(return_value=summary)) as mock_run_load:
+            call_command('loadtest', *urls, '--requests', '5', stdout=out)
+        self.assertEqual([call.kwargs['url'] for call in mock_run_load.await_args_list], urls)
+        self.assertEqual(out.getvalue().count('5 requests, 0 errors'), 2)
+
+    def test_compare_servers_requests_every_path_on_every_server(self):
+        received = []
+
+        async def handle(reader, writer):
+            received.append((writer.get_extra_info('sockname')[1], (await reader.readline()).split()[1]))
+            while (await reader.readline()) not in (b'\r\n', b''):
+                pass
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: close\r\n\r\nok')
+            await writer.drain()
+            writer.close()
+
+        async def run():
+            servers = [await asyncio.start_server(handle, '127.0.0.1', 0) for _ in range(2)]
+            urls = {f'server{i}': f'http://127.0.0.1:{server.sockets[0].getsockname()[1]}/'
+                    for i, server in enumerate(servers)}
+            try:
+                return await load_utils.compare_servers(urls, ['/albums/', '/api/albums/'], requests=5,
+                                                        concurrency=2)
+            finally:
+                for server in servers:
+                    server.close()
+                    await server.wait_closed()
+
+        results = asyncio.run(run())
+        self.assertEqual(list(results), ['server0', 'server1'])
+        for summaries in results.values():
+            self.assertEqual(list(summaries), ['/albums/', '/api/albums/'])
+            self.assertEqual([summary['requests'] for summary in summaries.values()], [5, 5])
+        self.assertEqual(len(received), 20)
+        self.assertEqual(len({port for port, _ in received}), 2)
+
+    def test_benchmark_servers_needs_named_servers(self):
+        with self.assertRaises(CommandError):
+            call_command('benchmark_servers', '--server', 'http://localhost:8000', stdout=StringIO())
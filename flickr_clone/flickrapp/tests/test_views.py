@@ -1,10 +1,17 @@
-from unittest.mock import patch
+import hashlib
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+from unittest.mock import Mock, patch
 
+from asgiref.sync import async_to_sync
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import AsyncRequestFactory, TestCase
 from django.urls import reverse
 
-from flickrapp.models import Album, Image
+from flickrapp import async_views
+from flickrapp.models import Album, Blob, Image
 
 
 class CreateAlbumViewTest(TestCase):
@@ -88,6 +95,27 @@ class AlbumListViewTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.context['album_list']), len(public_albums))
 
+    def test_list_is_paginated(self):
+        test_user = User.objects.get(id=1)
+        for i in range(settings.LIST_PAGE_SIZE):
+            Album.objects.create(owner=test_user, name=f'Public album {i}', is_public=True, date_created='2021-02-01')
+        response = self.client.get(reverse('album_list'))
+        self.assertTrue(response.context['is_paginated'])
+        self.assertEqual(len(response.context['album_list']), settings.LIST_PAGE_SIZE)
+        response = self.client.get(reverse('album_list') + '?page=2')
+        # 5 public albums from the fixture + LIST_PAGE_SIZE new ones
+        self.assertEqual(len(response.context['album_list']), 5)
+
+    def test_query_count_does_not_grow_with_albums(self):
+        # count for the paginator, then public albums + their owners in a single query
+        with self.assertNumQueries(2):
+            self.client.get(reverse('album_list'))
+        test_user2 = User.objects.create_user(username='testUser789')
+        for i in range(10):
+            Album.objects.create(owner=test_user2, name=f'Other album {i}', is_public=True, date_created='2021-02-01')
+        with self.assertNumQueries(2):
+            self.client.get(reverse('album_list'))
+
 
 class AlbumListForUserViewTest(TestCase):
     @classmethod
@@ -198,6 +226,17 @@ class ImageListForAlbumViewTest(TestCase):
         self.assertTrue('album' in response.context)
         self.assertEqual(response.context['album'], album)
 
+    def test_query_count_does_not_grow_with_images(self):
+        # album + owner, count for the paginator, then the images
+        with self.assertNumQueries(3):
+            self.client.get(reverse('image_list', kwargs={'pk': 1}))
+        album = Album.objects.get(id=1)
+        for i in range(20):
+            Image.objects.create(album=album, title=f'Beach {i}', location=f'file{i}.ext', date_uploaded='2021-06-03')
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('image_list', kwargs={'pk': 1}))
+        self.assertEqual(len(response.context['image_list']), 21)
+
 
 class UploadImageViewTest(TestCase):
     @classmethod
@@ -239,12 +278,12 @@ class UploadImageViewTest(TestCase):
                 'title': 'Temporary file',
                 'file': file
             }
-            # mock out the actual file upload function
-            with patch('flickrapp.forms.UploadImageForm.upload_image', return_value='file_location.ext'):
+            # mock out staging the file
+            with patch('flickrapp.uploads.stage_file', return_value='/staging/file'):
                 response = self.client.post(reverse('upload_image'), data=form_data)
                 self.assertRedirects(response, reverse('profile'))
 
-    def test_image_model_saves(self):
+    def test_image_model_saves_as_pending(self):
         # login
         self.client.login(username='testuser', password='testpassword')
         album = Album.objects.get(id=1)
@@ -254,11 +293,259 @@ class UploadImageViewTest(TestCase):
                 'title': 'Temporary file',
                 'file': file
             }
-            # mock out the actual file upload function
-            with patch('flickrapp.forms.UploadImageForm.upload_image', return_value='file_location.ext'):
+            # mock out staging the file
+            with patch('flickrapp.uploads.stage_file', return_value='/staging/file'), \
+                    patch('flickrapp.uploads.submit') as mock_submit, \
+                    self.captureOnCommitCallbacks(execute=True):
                 self.client.post(reverse('upload_image'), data=form_data)
-            # Assert image model saved
+            # Assert image model saved, waiting for the upload workers
             image = Image.objects.get(id=1)
             self.assertEqual(image.album.id, form_data['album'])
             self.assertEqual(image.title, form_data['title'])
-            self.assertEqual(image.location, 'file_location.ext')
\ No newline at end of file
+            self.assertEqual(image.status, Image.Status.PENDING)
+            self.assertEqual(image.pending_upload.staging_path, '/staging/file')
+            # Hashed by the upload handlers while the request was received
+            with open('./test_data/file.txt', 'rb') as content:
+                self.assertEqual(image.pending_upload.sha256, hashlib.sha256(content.read()).hexdigest())
+            # Handed to the upload workers once committed
+            mock_submit.assert_called_once_with(image.id)
+
+
+
+class BulkUploadImageViewTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user(username='testuser', password='testpassword')
+        test_user = User.objects.get(id=1)
+        Album.objects.create(owner=test_user, name='Beach Vacation Summer 2021', is_public=True,
+                             date_created='2021-06-01')
+
+    def test_redirect_if_not_logged_in(self):
+        response = self.client.get(reverse('bulk_upload_images'))
+        self.assertRedirects(response, '/accounts/login/?next=/flickr/upload-images/')
+
+    def test_logged_in_view_uses_correct_template(self):
+        self.client.login(username='testuser', password='testpassword')
+        response = self.client.get(reverse('bulk_upload_images'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'user/bulk-upload-images.html')
+
+    def test_images_save_as_pending_and_results_are_reported(self):
+        self.client.login(username='testuser', password='testpassword')
+        album = Album.objects.get(id=1)
+        form_data = {
+            'album': album.id,
+            'files': [SimpleUploadedFile('front.jpg', b'front'), SimpleUploadedFile('back.jpg', b'back')],
+        }
+        # mock out staging the files
+        with patch('flickrapp.uploads.stage_file', return_value='/staging/file'):
+            response = self.client.post(reverse('bulk_upload_images'), data=form_data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['file'] for result in response.context['results']], ['front.jpg', 'back.jpg'])
+        self.assertEqual(Image.objects.filter(album=album, status=Image.Status.PENDING).count(), 2)
+
+
+class SearchViewTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user(username='testUser123')
+        test_user = User.objects.get(id=1)
+        Album.objects.create(owner=test_user, name='Beach Vacation Summer 2021', is_public=True,
+                             date_created='2021-06-01')
+        Album.objects.create(owner=test_user, name='Beach Secrets', is_public=False, date_created='2021-07-01')
+        Image.objects.create(album=Album.objects.get(id=1), title='Beach house (front)', location='filename.ext',
+                             date_uploaded='2021-06-02')
+
+    def test_empty_search_shows_the_form(self):
+        response = self.client.get(reverse('search'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'albums/search.html')
+        self.assertNotIn('album_list', response.context)
+
+    def test_search_shows_visible_matches(self):
+        response = self.client.get(reverse('search'), {'q': 'beach'})
+        self.assertEqual([album.name for album in response.context['album_list']], ['Beach Vacation Summer 2021'])
+        self.assertContains(response, 'Beach house (front)')
+        self.assertNotContains(response, 'Beach Secrets')
+
+    def test_owner_sees_private_matches(self):
+        self.client.force_login(User.objects.get(id=1))
+        response = self.client.get(reverse('search'), {'q': 'secrets'})
+        self.assertContains(response, 'Beach Secrets')
+
+
+class AsgiTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user(username='testUser123')
+        test_user = User.objects.get(id=1)
+        Album.objects.create(owner=test_user, name='Beach Vacation Summer 2021', is_public=True,
+                             date_created='2021-06-01')
+        Image.objects.create(album=Album.objects.get(id=1), title='Beach house (front)', location='filename.ext',
+                             date_uploaded='2021-06-02')
+
+    def test_sync_views_are_served_over_asgi(self):
+        response = async_to_sync(self.async_client.get)('/flickr/albums/1/images')
+        self.assertContains(response, 'Beach house (front)')
+
+    def test_async_list_pages_match_the_sync_ones(self):
+        pages = [('album_list', {}), ('image_list', {'pk': 1}), ('user_albums', {'username': 'testUser123'})]
+        for name, kwargs in pages:
+            response = async_to_sync(self.async_client.get)(reverse(f'async_{name}', kwargs=kwargs))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, self.client.get(reverse(name, kwargs=kwargs)).content)
+
+    def test_async_image_list_of_private_album_is_forbidden(self):
+        album = Album.objects.create(owner=User.objects.get(id=1), name='Private', is_public=False,
+                                     date_created='2021-06-01')
+        response = async_to_sync(self.async_client.get)(reverse('async_image_list', kwargs={'pk': album.id}))
+        self.assertEqual(response.status_code, 403)
+
+    def test_async_upload_redirects_if_not_logged_in(self):
+        response = async_to_sync(self.async_client.get)(reverse('async_upload_image'))
+        self.assertRedirects(response, '/accounts/login/?next=/flickr/async/upload-image/',
+                             fetch_redirect_response=False)
+
+    def test_async_upload_form_posts_to_itself(self):
+        self.async_client.force_login(User.objects.get(id=1))
+        response = async_to_sync(self.async_client.get)(reverse('async_upload_image'))
+        self.assertContains(response, 'action="/flickr/async/upload-image/"')
+
+    def test_async_upload_saves_a_pending_image(self):
+        request = AsyncRequestFactory().post(reverse('async_upload_image'), {
+            'album': 1, 'title': 'Temporary file', 'file': SimpleUploadedFile('file.txt', b'Hello, world')})
+        # Django 3.2's test client gives the view a body that fails a read past its end, as the
+        # multipart parser does; a server's body just ends
+        request._stream = BytesIO(request._stream.read())
+        request.user = User.objects.get(id=1)
+        with patch('flickrapp.uploads.stage_file', return_value='/staging/file'), \
+                patch('flickrapp.uploads.submit') as mock_submit, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = async_to_sync(async_views.upload_image)(request)
+        self.assertEqual((response.status_code, response.url), (302, reverse('profile')))
+        image = Image.objects.get(title='Temporary file')
+        self.assertEqual(image.status, Image.Status.PENDING)
+        self.assertEqual(image.pending_upload.staging_path, '/staging/file')
+        mock_submit.assert_called_once_with(image.id)
+
+
+class ImageFileViewTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user(username='testUser123', password='testUser123pass')
+        test_user = User.objects.get(id=1)
+        Album.objects.create(owner=test_user, name='Beach Vacation Summer 2021', is_public=True,
+                             date_created='2021-06-01')
+        Album.objects.create(owner=test_user, name='Beach Vacation Summer 2022', is_public=False,
+                             date_created='2022-06-01')
+        blob = Blob.objects.create(sha256='a' * 64, object_name=f'{"a" * 64}.jpg', size=10, ref_count=1)
+        Image.objects.create(album=Album.objects.get(id=1), title='Beach house (front)', blob=blob,
+                             location=f'http://localhost:9000/uploads/{"a" * 64}.jpg', date_uploaded='2021-06-02',
+                             thumbnail_location=f'http://localhost:9000/uploads/{"a" * 64}.thumbnail.jpg')
+        Image.objects.create(album=Album.objects.get(id=2), title='Ice cream', date_uploaded='2022-06-02',
+                             location='http://localhost:9000/uploads/ice-cream.jpg')
+
+    def setUp(self):
+        patcher = patch('flickrapp.views.file_utils.MinioUploader')
+        self.mock_uploader = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_uploader.return_value.open.side_effect = self.open_object
+        self.mock_uploader.return_value.get_download_url.return_value = 'http://minio/signed'
+        self.mock_uploader.return_value.stat.return_value = Mock(
+            etag='0123', size=10, content_type='image/jpeg', last_modified=datetime(2022, 6, 2, tzinfo=timezone.utc))
+
+    @staticmethod
+    def open_object(object_name, offset=0, length=0):
+        content = b'0123456789'
+        stored = Mock()
+        stored.stream.return_value = iter([content[offset:offset + length] if length else content[offset:]])
+        return stored
+
+    def test_original_is_streamed_with_validators(self):
+        response = self.client.get(reverse('image_file', kwargs={'pk': 1}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(response['ETag'], f'"{"a" * 64}"')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        # Content-addressed originals are described by their blob, storage is only asked for the bytes
+        self.mock_uploader.return_value.stat.assert_not_called()
+
+    def test_matching_etag_returns_304_without_touching_storage(self):
+        response = self.client.get(reverse('image_file', kwargs={'pk': 1}), HTTP_IF_NONE_MATCH=f'"{"a" * 64}"')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], f'"{"a" * 64}"')
+        self.mock_uploader.return_value.open.assert_not_called()
+        self.mock_uploader.return_value.stat.assert_not_called()
+
+    def test_unmodified_since_returns_304(self):
+        first = self.client.get(reverse('image_file', kwargs={'pk': 1}))
+        response = self.client.get(reverse('image_file', kwargs={'pk': 1}),
+                                   HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_byte_range_is_requested_from_storage(self):
+        response = self.client.get(reverse('image_file', kwargs={'pk': 1}), HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(response['Content-Length'], '4')
+        self.mock_uploader.return_value.open.assert_called_once_with(f'{"a" * 64}.jpg', offset=2, length=4)
+
+    def test_stale_if_range_returns_whole_file(self):
+        response = self.client.get(reverse('image_file', kwargs={'pk': 1}), HTTP_RANGE='bytes=2-5',
+                                   HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+
+    def test_unsatisfiable_range_returns_416(self):
+        response = self.client.get(reverse('image_file', kwargs={'pk': 1}), HTTP_RANGE='bytes=20-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    def test_content_addressed_rendition_is_fetched_from_storage(self):
+        with patch('flickrapp.views.time.time', return_value=2 * 86400 + 3600):
+            response = self.client.get(reverse('image_rendition', kwargs={'pk': 1, 'rendition': 'thumbnail'}))
+        self.assertRedirects(response, 'http://minio/signed', fetch_redirect_response=False)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=82800')
+        self.mock_uploader.return_value.get_download_url.assert_called_once_with(
+            f'{"a" * 64}.thumbnail.jpg', expires=timedelta(days=2),
+            signed_at=datetime(1970, 1, 3, tzinfo=timezone.utc),
+            cache_control='public, max-age=31536000, immutable')
+        self.mock_uploader.return_value.stat.assert_not_called()
+        self.mock_uploader.return_value.open.assert_not_called()
+
+    def test_rendition_is_validated_against_storage(self):
+        Image.objects.filter(id=2).update(thumbnail_location='ice-cream.thumbnail.jpg')
+        self.client.login(username='testUser123', password='testUser123pass')
+        response = self.client.get(reverse('image_rendition', kwargs={'pk': 2, 'rendition': 'thumbnail'}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], '"0123"')
+        self.assertEqual(response['Cache-Control'], f'private, max-age={settings.IMAGE_CACHE_MAX_AGE}')
+        self.mock_uploader.return_value.stat.assert_called_once_with('ice-cream.thumbnail.jpg')
+
+    def test_missing_rendition_falls_back_to_original(self):
+        self.client.get(reverse('image_rendition', kwargs={'pk': 1, 'rendition': 'medium'}))
+        self.mock_uploader.return_value.open.assert_called_once_with(f'{"a" * 64}.jpg', offset=0, length=0)
+
+    def test_unknown_rendition_returns_404(self):
+        response = self.client.get(reverse('image_rendition', kwargs={'pk': 1, 'rendition': 'huge'}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_private_image_is_forbidden_to_others(self):
+        response = self.client.get(reverse('image_file', kwargs={'pk': 2}))
+        self.assertEqual(response.status_code, 403)
+
+    def test_private_image_is_served_privately_to_owner(self):
+        self.client.login(username='testUser123', password='testUser123pass')
+        response = self.client.get(reverse('image_file', kwargs={'pk': 2}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], f'private, max-age={settings.IMAGE_CACHE_MAX_AGE}')
+
+    def test_head_does_not_open_storage(self):
+        response = self.client.head(reverse('image_file', kwargs={'pk': 1}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], '10')
+        self.mock_uploader.return_value.open.assert_not_called()
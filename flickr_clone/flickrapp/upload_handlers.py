@@ -0,0 +1,34 @@
+import hashlib
+
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+
+class HashingUploadHandlerMixin:
+    """
+    Hashes an uploaded file while Django receives it, so the upload never has to be read a
+    second time to find duplicates. The hex SHA-256 ends up on the file as ``sha256``.
+    """
+    def new_file(self, *args, **kwargs):
+        # Before super(), the memory handler stops the other handlers by raising from new_file
+        self.hasher = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        # The memory handler passes large files on to the next handler without keeping them
+        if getattr(self, 'activated', True):
+            self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.hasher.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadHandlerMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadHandlerMixin, TemporaryFileUploadHandler):
+    pass
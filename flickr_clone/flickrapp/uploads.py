@@ -0,0 +1,327 @@
+import logging
+import os
+import shutil
+import uuid
+from datetime import date, timedelta
+from typing import List, Optional, Tuple, Union
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import album_stats, blobs, derivatives, metadata, signals, workers
+from .models import Album, Blob, Image, PendingUpload
+from .utils import file_utils
+
+
+logger = logging.getLogger(__name__)
+
+
+def stage_file(file: Union[InMemoryUploadedFile, TemporaryUploadedFile]) -> str:
+    """
+    Stores an uploaded file in the staging area until an upload worker picks it up. Files
+    Django already spooled to disk are moved instead of copied; in-memory files are written
+    out chunk by chunk.
+
+    :param file: Django UploadedFile
+    :return: String path of the staged file
+    """
+    os.makedirs(settings.UPLOAD_STAGING_DIR, exist_ok=True)
+    path = os.path.join(settings.UPLOAD_STAGING_DIR, uuid.uuid4().hex)
+    if isinstance(file, TemporaryUploadedFile):
+        # Django ignores the missing file when it later closes the upload
+        shutil.move(file.temporary_file_path(), path)
+    else:
+        with open(path, 'wb') as out:
+            for chunk in file.chunks():
+                out.write(chunk)
+    return path
+
+
+def queue_upload(file: Union[InMemoryUploadedFile, TemporaryUploadedFile], album: Album, title: str) -> Image:
+    """
+    Stages a file and creates its Image in the pending state. The transfer to object storage
+    is handed to the upload workers once the surrounding transaction commits.
+
+    :param file: Django UploadedFile
+    :param album: Album the image belongs to
+    :param title: String title of the image provided by the User
+    :return: The pending Image
+    """
+    # Hash before staging, which may move the file away
+    sha256 = file_utils.get_content_hash(file)
+    object_name = file_utils.get_blob_object_name(sha256, file.name)
+    staging_path = stage_file(file)
+    with transaction.atomic():
+        image = Image.objects.create(album=album,
+                                     title=title,
+                                     location=file_utils.get_location(object_name),
+                                     date_uploaded=date.today(),
+                                     status=Image.Status.PENDING)
+        PendingUpload.objects.create(image=image,
+                                     staging_path=staging_path,
+                                     object_name=object_name,
+                                     content_type=file.content_type or '',
+                                     sha256=sha256)
+        transaction.on_commit(lambda: submit(image.id))
+    return image
+
+
+def get_title(file_name: str) -> str:
+    """
+    Derives an image title from a file name, for uploads that don't come with one.
+
+    :param file_name: String name of the uploaded file
+    :return: String title
+    """
+    stem = os.path.splitext(os.path.basename(file_name))[0]
+    return stem[:Image._meta.get_field('title').max_length] or 'Untitled'
+
+
+def queue_uploads(files: List[Union[InMemoryUploadedFile, TemporaryUploadedFile]], album: Album) -> List[dict]:
+    """
+    Stages many files for one album and creates all their pending Images with a single
+    bulk_create. Once committed, every image is handed to the upload workers, which push
+    them to object storage concurrently. A file that can't be staged doesn't stop the others.
+
+    :param files: List of Django UploadedFiles
+    :param album: Album the images belong to
+    :return: List of per-file results: {'file', 'status', 'id'} or {'file', 'status', 'error'}
+    """
+    results = []
+    staged = []
+    for file in files:
+        if not file.size:
+            results.append({'file': file.name, 'status': Image.Status.FAILED, 'error': 'The file is empty.'})
+            continue
+        title = get_title(file.name)
+        try:
+            sha256 = file_utils.get_content_hash(file)
+            object_name = file_utils.get_blob_object_name(sha256, file.name)
+            staging_path = stage_file(file)
+        except OSError as e:
+            logger.exception('Staging %s failed', file.name)
+            results.append({'file': file.name, 'status': Image.Status.FAILED, 'error': str(e)})
+            continue
+        image = Image(album=album,
+                      title=title,
+                      location=file_utils.get_location(object_name),
+                      date_uploaded=date.today(),
+                      status=Image.Status.PENDING)
+        pending = PendingUpload(staging_path=staging_path, object_name=object_name,
+                                content_type=file.content_type or '', sha256=sha256)
+        result = {'file': file.name, 'status': Image.Status.PENDING}
+        results.append(result)
+        staged.append((image, pending, result))
+
+    if not staged:
+        return results
+
+    with transaction.atomic():
+        images = [image for image, _, _ in staged]
+        if connection.features.can_return_rows_from_bulk_insert:
+            Image.objects.bulk_create(images)
+        else:
+            # Without RETURNING the new ids are unknown, and the PendingUploads need them
+            for image in images:
+                image.save()
+        for image, pending, result in staged:
+            pending.image = image
+            result['id'] = image.id
+        PendingUpload.objects.bulk_create([pending for _, pending, _ in staged])
+        # bulk_create doesn't send post_save
+        signals.invalidate_on_commit(signals.image_scopes(images[0]))
+        image_ids = [image.id for image in images]
+        transaction.on_commit(lambda: submit_many(image_ids))
+    return results
+
+
+def register_direct_upload(album: Album, object_name: str, title: str) -> Optional[Image]:
+    """
+    Creates the Image for an object a client uploaded straight to object storage with a
+    presigned URL, after checking the object is really there. Registering the same object
+    twice returns the existing Image.
+
+    :param album: Album the image belongs to
+    :param object_name: String name the object was uploaded under
+    :param title: String title of the image
+    :return: The ready Image, or None if nothing was uploaded under that name
+    """
+    location = file_utils.get_location(object_name)
+    existing = Image.objects.filter(album=album, location=location).first()
+    if existing is not None:
+        return existing
+    if file_utils.get_uploader(object_name).stat(object_name) is None:
+        return None
+    # The album stats are updated together with the image
+    with transaction.atomic():
+        image = Image.objects.create(album=album,
+                                     title=title,
+                                     location=location,
+                                     date_uploaded=date.today(),
+                                     status=Image.Status.READY)
+        transaction.on_commit(lambda: derivatives.schedule_from_storage(image.id))
+        transaction.on_commit(lambda: metadata.schedule_from_storage(image.id))
+    return image
+
+
+def submit(image_id: int):
+    """
+    Hands an image to the in-process upload workers, if there are any.
+
+    :param image_id: Integer id of a pending Image
+    """
+    workers.submit(process_upload, image_id)
+
+
+def submit_many(image_ids: List[int]):
+    """
+    Hands several images to the in-process upload workers, which upload them concurrently.
+
+    :param image_ids: List of integer ids of pending Images
+    """
+    for image_id in image_ids:
+        submit(image_id)
+
+
+def run_upload(image_id: int):
+    """
+    Uploads an image on a background worker. Errors are logged rather than raised, the image
+    stays pending and is retried by the process_uploads command.
+
+    :param image_id: Integer id of a pending Image
+    """
+    workers.run_task(process_upload, image_id)
+
+
+def process_upload(image_id: int) -> bool:
+    """
+    Pushes a staged file and its renditions to object storage and marks its Image ready. The image is claimed
+    first, so the thread pool and the management command never upload the same file twice.
+    Content that is already stored is not transferred again; the image shares the existing
+    blob and its renditions. A failed transfer is retried up to settings.UPLOAD_MAX_ATTEMPTS times.
+    An image deleted during its upload leaves no reference on the blob behind.
+
+    :param image_id: Integer id of a pending Image
+    :return: True if the image was uploaded by this call
+    """
+    with transaction.atomic():
+        claimed = Image.objects.filter(id=image_id, status=Image.Status.PENDING).update(status=Image.Status.UPLOADING)
+        if not claimed:
+            return False
+        PendingUpload.objects.filter(image_id=image_id).update(date_claimed=timezone.now())
+
+    # The image is read along, its album is still needed if it is deleted during the upload
+    pending = PendingUpload.objects.select_related('image').get(image_id=image_id)
+    blob = None
+    # Uploads staged before content hashing have no blob
+    if pending.sha256:
+        exists, blob = _reference_blob(image_id, pending, stored=False)
+        if not exists:
+            _discard_staged_file(pending.staging_path)
+            return False
+    duplicate = blob is not None
+    if not duplicate:
+        try:
+            with open(pending.staging_path, 'rb') as staged:
+                file_utils.get_uploader(pending.object_name).upload(source=File(staged),
+                                                                    object_name=pending.object_name,
+                                                                    content_type=pending.content_type)
+        except Exception:
+            PendingUpload.objects.filter(id=pending.id).update(attempts=F('attempts') + 1)
+            if pending.attempts + 1 >= settings.UPLOAD_MAX_ATTEMPTS:
+                Image.objects.filter(id=image_id).update(status=Image.Status.FAILED)
+                _discard_staged_file(pending.staging_path)
+            else:
+                Image.objects.filter(id=image_id).update(status=Image.Status.PENDING)
+            raise
+
+    if pending.sha256 and not duplicate:
+        exists, blob = _reference_blob(image_id, pending, stored=True)
+        if not exists:
+            _discard_staged_file(pending.staging_path)
+            return False
+
+    object_name = blob.object_name if blob is not None else pending.object_name
+    renditions = blobs.get_renditions(blob) if duplicate else {}
+    if renditions:
+        Image.objects.filter(id=image_id).update(**renditions)
+    else:
+        try:
+            derivatives.create_derivatives(image_id, pending.staging_path, object_name)
+        except Exception:
+            # The original is stored, so the image can still be shown without its renditions
+            logger.exception('Storing derivatives of image %s failed', image_id)
+
+    # Only the header is parsed, which is cheap enough to do right here on the upload worker
+    image_metadata = metadata.read(pending.staging_path, image_id)
+
+    with transaction.atomic():
+        update = {'status': Image.Status.READY, **image_metadata}
+        if blob is not None:
+            # A duplicate is served from wherever its content was first stored
+            update.update(blob=blob, location=file_utils.get_location(object_name))
+        if Image.objects.filter(id=image_id).update(**update):
+            # update() doesn't send post_save, so count the image in its album here
+            album_stats.image_added(pending.image.album_id, image_id, pending.image.date_uploaded)
+            signals.invalidate_album_on_commit(pending.image.album_id)
+        pending.delete()
+        # update() doesn't send post_save, so drop the cached lists the image now shows up in
+        signals.invalidate_on_commit(signals.image_scopes(pending.image))
+    _discard_staged_file(pending.staging_path)
+    return True
+
+
+def _reference_blob(image_id: int, pending: PendingUpload, stored: bool) -> Tuple[bool, Optional[Blob]]:
+    """
+    Takes an image's reference on the blob with its content and records it on the image, in
+    one transaction that holds the image row. Deleting the image from then on releases the
+    reference; an image deleted before that never keeps one.
+
+    :param image_id: Integer id of the Image being uploaded
+    :param pending: PendingUpload of the image
+    :param stored: True if the content was just uploaded, so its blob is created if needed
+    :return: Tuple of True if the image still exists, and the Blob, None if no blob has the content yet
+    """
+    with transaction.atomic():
+        image = Image.objects.select_for_update().filter(id=image_id).values('blob_id').first()
+        if image is not None and image['blob_id'] is not None:
+            # Taken by an earlier attempt that didn't finish
+            return True, Blob.objects.get(id=image['blob_id'])
+        if stored:
+            blob = blobs.store_reference(pending.sha256, pending.object_name, os.path.getsize(pending.staging_path))
+        elif image is not None and blobs.add_reference(pending.sha256):
+            blob = Blob.objects.get(sha256=pending.sha256)
+        else:
+            return image is not None, None
+        if image is None:
+            # Deleted during the upload; the content goes too, unless another image uses it
+            blobs.release(blob.id)
+            return False, None
+        Image.objects.filter(id=image_id).update(blob=blob)
+    return True, blob
+
+
+def requeue_stale_claims() -> int:
+    """
+    Puts uploads back in the queue that were claimed longer than settings.UPLOAD_CLAIM_TIMEOUT
+    ago, e.g. by a worker that crashed in the middle of the transfer. Their staged files are
+    still there, so they are simply uploaded again.
+
+    :return: Integer number of requeued uploads
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.UPLOAD_CLAIM_TIMEOUT)
+    # Claims from before claims were timestamped have none
+    stale = Q(pending_upload__date_claimed__lt=cutoff) | Q(pending_upload__date_claimed__isnull=True)
+    return (Image.objects.filter(stale, status=Image.Status.UPLOADING, pending_upload__isnull=False)
+            .update(status=Image.Status.PENDING))
+
+
+def _discard_staged_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
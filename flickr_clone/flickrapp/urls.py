@@ -1,14 +1,25 @@
 from django.shortcuts import redirect
 from django.urls import path
 
-from .views import CreateAlbumView, AlbumListView, AlbumListForUserView, ImageListForAlbumView, UploadImageView
+from . import async_views
+from .views import (CreateAlbumView, AlbumListView, AlbumListForUserView, BulkUploadImageView, ImageFileView,
+                    ImageListForAlbumView, SearchView, UploadImageView)
 
 
 urlpatterns = [
     path('', lambda request: redirect('albums/', permanent=True)),
     path('create-album/', CreateAlbumView.as_view(), name='create_album'),
     path('upload-image/', UploadImageView.as_view(), name='upload_image'),
+    path('upload-images/', BulkUploadImageView.as_view(), name='bulk_upload_images'),
     path('albums/', AlbumListView.as_view(), name='album_list'),
     path('albums/<pk>/images', ImageListForAlbumView.as_view(), name='image_list'),
+    path('search/', SearchView.as_view(), name='search'),
+    path('images/<int:pk>', ImageFileView.as_view(), name='image_file'),
+    path('images/<int:pk>/<rendition>', ImageFileView.as_view(), name='image_rendition'),
     path('<username>/albums', AlbumListForUserView.as_view(), name='user_albums'),
+    # The same pages as async views, see flickrapp.async_views
+    path('async/upload-image/', async_views.upload_image, name='async_upload_image'),
+    path('async/albums/', async_views.album_list, name='async_album_list'),
+    path('async/albums/<pk>/images', async_views.image_list, name='async_image_list'),
+    path('async/<username>/albums', async_views.user_albums, name='async_user_albums'),
 ]
@@ -0,0 +1,83 @@
+import hashlib
+import threading
+from datetime import datetime, timezone
+
+from minio.datatypes import Object
+from minio.error import S3Error
+
+
+class FakeObjectResponse:
+    """
+    Stands in for the urllib3 response Minio.get_object returns.
+    """
+    def __init__(self, data: bytes):
+        self.data = data
+        self.position = 0
+
+    def read(self, amt=None):
+        end = len(self.data) if amt is None else self.position + amt
+        chunk = self.data[self.position:end]
+        self.position += len(chunk)
+        return chunk
+
+    def stream(self, amt=64 * 1024):
+        while True:
+            chunk = self.read(amt)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        pass
+
+    def release_conn(self):
+        pass
+
+
+class FakeMinio:
+    """
+    An in-memory stand-in for the parts of the Minio client the app uses, for benchmarks
+    and local runs without object storage. Objects live for the lifetime of the process.
+    """
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket_exists(self, bucket_name):
+        return bucket_name in self.buckets
+
+    def make_bucket(self, bucket_name, *args, **kwargs):
+        with self.lock:
+            self.buckets.setdefault(bucket_name, {})
+
+    def put_object(self, bucket_name, object_name, data, length, content_type='application/octet-stream', **kwargs):
+        content = data.read() if length < 0 else data.read(length)
+        with self.lock:
+            self.buckets.setdefault(bucket_name, {})[object_name] = (content, content_type, datetime.now(timezone.utc))
+
+    def _get(self, bucket_name, object_name):
+        try:
+            return self.buckets[bucket_name][object_name]
+        except KeyError:
+            raise S3Error(code='NoSuchKey', message='Object does not exist', resource=f'/{bucket_name}/{object_name}',
+                          request_id=None, host_id=None, response=None)
+
+    def stat_object(self, bucket_name, object_name, *args, **kwargs):
+        content, content_type, last_modified = self._get(bucket_name, object_name)
+        return Object(bucket_name=bucket_name, object_name=object_name, last_modified=last_modified,
+                      etag=hashlib.md5(content).hexdigest(), size=len(content), content_type=content_type)
+
+    def get_object(self, bucket_name, object_name, offset=0, length=0, *args, **kwargs):
+        content = self._get(bucket_name, object_name)[0]
+        return FakeObjectResponse(content[offset:offset + length] if length else content[offset:])
+
+    def fget_object(self, bucket_name, object_name, file_path, *args, **kwargs):
+        with open(file_path, 'wb') as out:
+            out.write(self._get(bucket_name, object_name)[0])
+
+    def remove_object(self, bucket_name, object_name, *args, **kwargs):
+        with self.lock:
+            self.buckets.get(bucket_name, {}).pop(object_name, None)
+
+    def presigned_put_object(self, bucket_name, object_name, expires=None):
+        return f'http://fake-storage/{bucket_name}/{object_name}'
@@ -1,11 +1,38 @@
+import hashlib
+import os
+import threading
 from abc import ABC, abstractmethod
-from datetime import datetime
-from typing import Union
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple, Union
 
+import urllib3
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File
 from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
 from minio import Minio
+from minio.error import S3Error
 
 from flickr_clone import settings
+from flickrapp.utils import metrics, placement
+
+
+# One client (and so one pool of keep-alive connections) per storage node is shared by every
+# uploader in the process
+_clients: Dict[str, Minio] = {}
+# Sign URLs for the nodes' public endpoints; never open a connection themselves
+_public_clients: Dict[str, Minio] = {}
+# Replaces the clients of every node, see set_client()
+_client_override = None
+_client_lock = threading.Lock()
+# Buckets that are known to exist, by node, so we don't have to ask Minio before every upload
+_ready_buckets = set()
+# The storage nodes and the hash ring spreading objects over them, built on first use
+_placement = None
+
+# Object names are stored in Image.location and the rendition locations, which hold this many characters
+MAX_OBJECT_NAME_LENGTH = 120
+# Longer extensions, or ones with other than letters and digits, are stored as .bin
+MAX_EXTENSION_LENGTH = 8
 
 
 class FileUploader(ABC):
@@ -14,56 +41,445 @@ class FileUploader(ABC):
         pass
 
 
-class MinioUploader(FileUploader):
-    def __init__(self):
-        self.client = Minio(endpoint=f'{settings.MINIO_ENDPOINT}:{settings.MINIO_PORT}',
-                            access_key=settings.MINIO_USERNAME,
-                            secret_key=settings.MINIO_PASSWORD,
-                            secure=False)  # b/c we're in a local dev environment
-        self.bucket_name = 'uploads'
+class StorageNode:
+    """
+    A bucket on a Minio endpoint that objects are stored in, see settings.STORAGE_NODES.
+    """
+    def __init__(self, name: str, bucket: str, endpoint: str, public_endpoint: Optional[str] = None):
+        self.name = name
+        self.bucket = bucket
+        self.endpoint = endpoint
+        # host:port clients reach the node on, used for presigned and public URLs
+        self.public_endpoint = public_endpoint or endpoint
+
+    def __repr__(self):
+        return f'<StorageNode {self.name}: {self.endpoint}/{self.bucket}>'
+
+
+def _get_placement() -> Tuple[List[StorageNode], Dict[str, StorageNode], placement.HashRing]:
+    global _placement
+    if _placement is None:
+        with _client_lock:
+            if _placement is None:
+                nodes = [StorageNode(name=node.get('name') or node['bucket'], bucket=node.get('bucket') or node['name'],
+                                     endpoint=node['endpoint'], public_endpoint=node.get('public_endpoint'))
+                         for node in settings.STORAGE_NODES]
+                for node in nodes:
+                    if not placement.NODE_NAME_RE.match(node.name):
+                        raise ImproperlyConfigured(f'Storage node name {node.name!r} must be at most '
+                                                   f'{placement.MAX_NODE_NAME_LENGTH} lowercase letters, '
+                                                   f'digits, - or _')
+                ring = placement.HashRing([node.name for node in nodes], points=settings.STORAGE_RING_POINTS)
+                _placement = (nodes, {node.name: node for node in nodes}, ring)
+    return _placement
+
+
+def get_nodes() -> List[StorageNode]:
+    """
+    :return: List of the configured StorageNodes, the first one is the default
+    """
+    return _get_placement()[0]
+
+
+def get_node(object_name: str) -> StorageNode:
+    """
+    Finds the node an object is stored on, which its key names, see place().
+
+    :param object_name: String name of the object
+    :return: StorageNode
+    """
+    nodes, nodes_by_name, ring = _get_placement()
+    parsed = placement.parse_key(object_name)
+    # Objects stored before keys named their node were all put on the first node
+    if parsed is None:
+        return nodes[0]
+    try:
+        return nodes_by_name[parsed[0]]
+    except KeyError:
+        raise ImproperlyConfigured(f'{object_name} is stored on storage node {parsed[0]!r}, '
+                                   f'which is not in settings.STORAGE_NODES')
+
+
+def place(name: str) -> str:
+    """
+    Builds the key a new object is stored under. The hash ring picks the node, and the key
+    records it, so adding a node never changes where existing objects are looked for; run
+    the rebalance_storage command to move them.
+
+    :param name: String object name
+    :return: String key, see placement.shard_key()
+    """
+    nodes, nodes_by_name, ring = _get_placement()
+    return placement.shard_key(name, ring.get_node(name), settings.STORAGE_KEY_PREFIX_LENGTH)
+
+
+def get_client(node: Optional[StorageNode] = None) -> Minio:
+    """
+    Returns the process-wide Minio client of a storage node, creating it on first use. The
+    client is backed by a urllib3 connection pool of settings.MINIO_POOL_SIZE connections, so
+    uploads reuse open connections instead of paying for a new TCP handshake every time.
+
+    :param node: StorageNode, the first configured node by default
+    :return: Shared Minio client
+    """
+    node = node or get_nodes()[0]
+    client = _clients.get(node.name) or _client_override
+    if client is None:
+        with _client_lock:
+            client = _clients.get(node.name)
+            if client is None:
+                http_client = urllib3.PoolManager(
+                    maxsize=settings.MINIO_POOL_SIZE,
+                    timeout=urllib3.Timeout(connect=settings.MINIO_CONNECT_TIMEOUT,
+                                            read=settings.MINIO_READ_TIMEOUT),
+                    retries=urllib3.Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+                )
+                client = _clients[node.name] = Minio(endpoint=node.endpoint,
+                                                     access_key=settings.MINIO_USERNAME,
+                                                     secret_key=settings.MINIO_PASSWORD,
+                                                     secure=False,  # b/c we're in a local dev environment
+                                                     http_client=http_client)
+    return client
+
+
+def get_public_client(node: Optional[StorageNode] = None) -> Minio:
+    """
+    Returns a Minio client for the endpoint browsers and API clients reach a storage node on.
+    It is only used to sign URLs; the region is configured so signing doesn't need to ask Minio.
 
-    def _write_tmp_file(self, source: InMemoryUploadedFile):
+    :param node: StorageNode, the first configured node by default
+    :return: Shared Minio client for the public endpoint
+    """
+    node = node or get_nodes()[0]
+    client = _public_clients.get(node.name) or _client_override
+    if client is None:
+        with _client_lock:
+            client = _public_clients.get(node.name)
+            if client is None:
+                client = _public_clients[node.name] = Minio(endpoint=node.public_endpoint,
+                                                             access_key=settings.MINIO_USERNAME,
+                                                             secret_key=settings.MINIO_PASSWORD,
+                                                             secure=False,  # b/c we're in a local dev environment
+                                                             region=settings.MINIO_REGION)
+    return client
+
+
+def reset_client():
+    """
+    Drops the shared clients, the known buckets and the storage nodes, e.g. after the storage
+    settings changed or in a forked worker process.
+    """
+    global _client_override, _placement
+    with _client_lock:
+        _clients.clear()
+        _public_clients.clear()
+        _client_override = None
+        _ready_buckets.clear()
+        _placement = None
+
+
+def set_client(client, node: Optional[str] = None):
+    """
+    Replaces the shared clients, e.g. with a FakeMinio for benchmarks.
+
+    :param client: Object with the Minio client api
+    :param node: String name of the storage node to replace the clients of, all nodes by default
+    """
+    global _client_override
+    with _client_lock:
+        if node is None:
+            _clients.clear()
+            _public_clients.clear()
+            _client_override = client
+        else:
+            _clients[node] = _public_clients[node] = client
+        _ready_buckets.clear()
+
+
+class MinioUploader(FileUploader):
+    def __init__(self, node: Optional[StorageNode] = None):
+        """
+        :param node: StorageNode to store objects on, the first configured node by default.
+            Use get_uploader() for the node an object belongs on.
         """
-        Writes InMemoryUploadedFile to a temporary file location.
+        self.node = node or get_nodes()[0]
+        self.client = get_client(self.node)
+        self.bucket_name = self.node.bucket
 
-        :param source: Django UploadedFile subclass for an uploaded file
-        :return: String path to the temporary file
+    def ensure_bucket(self):
         """
-        path = f'/tmp/{datetime.now().timestamp()}'
-        with open(path, 'wb+') as out:
-            out.write(source.read())
-        return path
+        Creates the upload bucket if it does not exist yet. The result is remembered for the
+        lifetime of the process, so only the first call talks to Minio.
+        """
+        if (self.node.name, self.bucket_name) in _ready_buckets:
+            return
+        with metrics.storage_call('bucket'):
+            exists = self.client.bucket_exists(self.bucket_name)
+        if not exists:
+            try:
+                with metrics.storage_call('bucket'):
+                    self.client.make_bucket(self.bucket_name)
+            except S3Error as e:
+                # Another process created it between our check and make_bucket
+                if e.code not in ('BucketAlreadyOwnedByYou', 'BucketAlreadyExists'):
+                    raise
+        _ready_buckets.add((self.node.name, self.bucket_name))
 
-    def upload(self, source: Union[InMemoryUploadedFile, TemporaryUploadedFile], object_name: str):
+    def upload(self, source: File, object_name: str, content_type: Optional[str] = None):
         """
-        Uploads the given file to Minio using the Minio client api. Django stores uploaded
-        files either in memory or in a temporary location, depending on file size. If the
-        file is already in a temporary location, we can supply that location to Minio.
-        Otherwise, we need to write the file to a temporary location before giving that
-        to Minio.
+        Uploads the given file to Minio using the Minio client api. The file is streamed to
+        the bucket in parts of settings.MINIO_PART_SIZE bytes, so neither the whole file nor
+        a copy of it is ever held in memory or written to local disk. Minio switches to a
+        multipart upload on its own once the file is larger than a single part.
 
-        :param source: Django UploadedFile subclass for an uploaded file
+        :param source: Django File, usually an UploadedFile subclass for an uploaded file
         :param object_name: String name of the object when stored in Minio
+        :param content_type: String content type, defaults to the one sent by the client
         :return:
         """
-        # Need to make sure the upload bucket exists
-        if not self.client.bucket_exists(self.bucket_name):
-            self.client.make_bucket(self.bucket_name)
-
-        # Get the path of the file
-        if isinstance(source, InMemoryUploadedFile):
-            path = self._write_tmp_file(source)
-        elif isinstance(source, TemporaryUploadedFile):
-            path = source.temporary_file_path()
-        else:
+        if not isinstance(source, File):
             raise ValueError(f'Expected type {type(InMemoryUploadedFile)} or {type(TemporaryUploadedFile)} '
                              f'but got {type(source)}')
 
+        # Need to make sure the upload bucket exists; this is a no-op once it is known to
+        self.ensure_bucket()
+
+        # The form may already have read from the file (e.g. for validation)
+        source.seek(0)
+        # An unknown size (-1) makes Minio read parts until the stream is exhausted
+        length = source.size if source.size is not None else -1
+        content_type = content_type or getattr(source, 'content_type', None)
+
         # Upload the file to the bucket
-        self.client.fput_object(bucket_name=self.bucket_name,
-                                object_name=object_name,
-                                file_path=path,
-                                content_type=source.content_type)
+        with metrics.storage_call('upload') as call:
+            self.client.put_object(bucket_name=self.bucket_name,
+                                   object_name=object_name,
+                                   data=source,
+                                   length=length,
+                                   content_type=content_type or 'application/octet-stream',
+                                   part_size=settings.MINIO_PART_SIZE)
+            call.bytes = max(length, 0)
+
+    def get_upload_url(self, object_name: str, expires: timedelta) -> str:
+        """
+        Creates a presigned URL that lets a client PUT the object straight into Minio.
+
+        :param object_name: String name of the object to be uploaded
+        :param expires: How long the URL can be used for
+        :return: String URL on the public endpoint
+        """
+        self.ensure_bucket()
+        return get_public_client(self.node).presigned_put_object(self.bucket_name, object_name, expires=expires)
+
+    def get_download_url(self, object_name: str, expires: timedelta, signed_at: Optional[datetime] = None,
+                         cache_control: Optional[str] = None) -> str:
+        """
+        Creates a presigned URL that lets a client GET the object straight from Minio.
+
+        :param object_name: String name of the object
+        :param expires: How long the URL can be used for
+        :param signed_at: Optional datetime the URL is signed at, now by default; URLs signed at
+            the same time are the same, so browsers can cache what they point to
+        :param cache_control: Optional string Cache-Control header Minio responds with
+        :return: String URL on the public endpoint
+        """
+        response_headers = {'response-cache-control': cache_control} if cache_control else None
+        return get_public_client(self.node).presigned_get_object(self.bucket_name, object_name, expires=expires,
+                                                                 response_headers=response_headers,
+                                                                 request_date=signed_at)
+
+    def stat(self, object_name: str):
+        """
+        Looks up a stored object.
+
+        :param object_name: String name of the object in Minio
+        :return: Minio Object with its size, etag and content type, or None if there is no such object
+        """
+        try:
+            with metrics.storage_call('stat'):
+                return self.client.stat_object(self.bucket_name, object_name)
+        except S3Error as e:
+            if e.code == 'NoSuchKey':
+                return None
+            raise
+
+    def download(self, object_name: str, path: str):
+        """
+        Streams a stored object to a local file.
+
+        :param object_name: String name of the object in Minio
+        :param path: String path of the file to write
+        """
+        with metrics.storage_call('download') as call:
+            self.client.fget_object(self.bucket_name, object_name, path)
+            call.bytes = os.path.getsize(path)
+
+    def open(self, object_name: str, offset: int = 0, length: int = 0):
+        """
+        Opens a stored object for streaming, optionally only a byte range of it.
+
+        :param object_name: String name of the object in Minio
+        :param offset: Integer index of the first byte to read
+        :param length: Integer number of bytes to read, 0 reads to the end
+        :return: urllib3 HTTPResponse; read it with stream() and close() and release_conn() it when done
+        """
+        # Times the wait for the first byte; the body is read later, by whoever streams it
+        with metrics.storage_call('open') as call:
+            response = self.client.get_object(self.bucket_name, object_name, offset=offset, length=length)
+            call.bytes = int(getattr(response, 'headers', {}).get('Content-Length', 0))
+        return response
+
+    def copy(self, source: 'MinioUploader', source_name: str, object_name: str) -> bool:
+        """
+        Streams an object from a node to this one. Minio only copies objects within a node,
+        so the content passes through this process, a part at a time.
+
+        :param source: MinioUploader of the node the object is stored on
+        :param source_name: String name of the object on that node
+        :param object_name: String name to store the copy under
+        :return: False if there is no such object to copy
+        """
+        stat = source.stat(source_name)
+        if stat is None:
+            return False
+        self.ensure_bucket()
+        stored = source.open(source_name)
+        try:
+            with metrics.storage_call('upload') as call:
+                self.client.put_object(bucket_name=self.bucket_name,
+                                       object_name=object_name,
+                                       data=stored,
+                                       length=stat.size,
+                                       content_type=stat.content_type or 'application/octet-stream',
+                                       part_size=settings.MINIO_PART_SIZE)
+                call.bytes = stat.size
+        finally:
+            stored.close()
+            stored.release_conn()
+        return True
+
+    def remove(self, object_name: str):
+        """
+        Deletes a stored object. Deleting an object that doesn't exist is not an error.
+
+        :param object_name: String name of the object in Minio
+        """
+        with metrics.storage_call('remove'):
+            self.client.remove_object(self.bucket_name, object_name)
+
+
+def get_uploader(object_name: str) -> MinioUploader:
+    """
+    :param object_name: String name of an object
+    :return: MinioUploader for the storage node the object belongs on
+    """
+    return MinioUploader(get_node(object_name))
+
+
+def get_extension(file_name: str) -> str:
+    """
+    :param file_name: String name of a file as uploaded by the User
+    :return: String lowercase extension of the file, 'bin' if it has none or an unusable one
+    """
+    extension = file_name.rsplit('.', 1)[-1].lower() if '.' in file_name else ''
+    if not (extension.isascii() and extension.isalnum() and len(extension) <= MAX_EXTENSION_LENGTH):
+        return 'bin'
+    return extension
+
+
+def get_object_name(file_name: str, title: str) -> str:
+    """
+    Builds the name an uploaded file is stored under in Minio. Long titles are cut, so the
+    name and those of its renditions fit in MAX_OBJECT_NAME_LENGTH characters.
+
+    :param file_name: String name of the file as uploaded by the User
+    :param title: String title of the file
+    :return: String object name
+    """
+    extension = get_extension(file_name)
+    suffix = f'-{datetime.now().timestamp()}'
+    # A rendition's name replaces the extension with '.<rendition>.jpg'
+    ending = max([len(extension) + 1] + [len(f'.{rendition}.jpg') for rendition in settings.IMAGE_RENDITIONS])
+    prefix = placement.MAX_NODE_NAME_LENGTH + 1 + settings.STORAGE_KEY_PREFIX_LENGTH + 1
+    title_length = MAX_OBJECT_NAME_LENGTH - prefix - len(suffix) - ending
+    return place(f'{title[:max(title_length, 0)]}{suffix}.{extension}')
+
+
+def get_content_hash(file: File) -> str:
+    """
+    Returns the SHA-256 of a file's content. Files received by the hashing upload handlers
+    already carry it; anything else is read once, chunk by chunk.
+
+    :param file: Django File
+    :return: String hex digest
+    """
+    sha256 = getattr(file, 'sha256', None)
+    if sha256:
+        return sha256
+    hasher = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks():
+        hasher.update(chunk)
+    file.seek(0)
+    return hasher.hexdigest()
+
+
+def get_blob_object_name(sha256: str, file_name: str) -> str:
+    """
+    Builds the content-addressed name a file is stored under, so identical files share one object.
+
+    :param sha256: String hex SHA-256 of the file's content
+    :param file_name: String name of the file as uploaded by the User, for its extension
+    :return: String object name
+    """
+    return place(f'{sha256}.{get_extension(file_name)}')
+
+
+def get_location(object_name: str) -> str:
+    """
+    Builds the location stored for an object. It is the object's logical key, not a URL: the
+    node and URL are resolved from it when it is shown, see get_public_url(), so endpoints can
+    change without rewriting stored locations.
+
+    :param object_name: String name of the object in Minio
+    :return: String location of the object
+    """
+    return object_name
+
+
+def get_object_name_from_location(location: str) -> str:
+    """
+    Reverses get_location.
+
+    :param location: String location of a stored object
+    :return: String name of the object in Minio
+    """
+    # Locations stored before they were keys are URLs into the uploads bucket
+    if '://' in location:
+        return location.split('/uploads/', 1)[-1]
+    return location
+
+
+def is_stored(location: str) -> bool:
+    """
+    :param location: String location of an object
+    :return: False for an empty location or a URL of an object stored elsewhere
+    """
+    return bool(location) and ('://' not in location or '/uploads/' in location)
+
+
+def get_public_url(location: str) -> str:
+    """
+    Resolves a stored location to the URL clients fetch the object from.
+
+    :param location: String location of a stored object
+    :return: String URL, empty for an empty location
+    """
+    if not is_stored(location):
+        return location
+    object_name = get_object_name_from_location(location)
+    node = get_node(object_name)
+    return f'http://{node.public_endpoint}/{node.bucket}/{object_name}'
 
 
 def upload_file(file: Union[InMemoryUploadedFile, TemporaryUploadedFile], title: str) -> str:
@@ -74,10 +490,7 @@ def upload_file(file: Union[InMemoryUploadedFile, TemporaryUploadedFile], title:
     :param title: String title of the file
     :return: String final location of the file
     """
-    object_name = f'{title}-{datetime.now().timestamp()}.{file.name.split(".")[-1]}'
-    uploader = MinioUploader()
+    object_name = get_object_name(file.name, title)
+    uploader = get_uploader(object_name)
     uploader.upload(source=file, object_name=object_name)
-    # Should probably refactor upload_location into a separate method that could
-    # determine bucket location based on timezone or something like it
-    upload_location = f'http://localhost:{settings.MINIO_PORT}/uploads/{object_name}'
-    return upload_location
+    return get_location(object_name)
@@ -0,0 +1,55 @@
+import ipaddress
+from typing import Iterable, Optional, Tuple
+
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parses the Range header of a request for a file of the given size. Only single byte
+    ranges are supported; anything else is ignored, which means serving the whole file.
+
+    :param header: String value of the Range header, or None
+    :param size: Integer size of the file in bytes
+    :return: Tuple of the first and last byte position (inclusive), or None for the whole file
+    :raises RangeNotSatisfiable: if the range lies entirely outside the file
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    first, _, last = header[len('bytes='):].strip().partition('-')
+    try:
+        first = int(first) if first else None
+        last = int(last) if last else None
+    except ValueError:
+        return None
+
+    if first is None:
+        # A suffix range: the last n bytes
+        if last is None:
+            return None
+        if last <= 0 or size == 0:
+            raise RangeNotSatisfiable(header)
+        return max(size - last, 0), size - 1
+    if first < 0 or (last is not None and last < first):
+        return None
+    if first >= size:
+        raise RangeNotSatisfiable(header)
+    return first, size - 1 if last is None else min(last, size - 1)
+
+
+def is_address_in(address: Optional[str], networks: Iterable[str]) -> bool:
+    """
+    Tells whether an IP address is one of the given addresses or lies in one of the networks.
+
+    :param address: String IP address, e.g. REMOTE_ADDR of a request
+    :param networks: Strings of addresses or networks, e.g. '127.0.0.1' or '172.16.0.0/12'
+    :return: False for a missing or malformed address
+    """
+    try:
+        address = ipaddress.ip_address(address or '')
+    except ValueError:
+        return False
+    networks = (network.strip() for network in networks)
+    return any(address in ipaddress.ip_network(network, strict=False) for network in networks if network)
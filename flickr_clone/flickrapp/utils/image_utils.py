@@ -0,0 +1,113 @@
+import math
+from datetime import datetime
+from typing import BinaryIO, Dict, Optional, Tuple, Union
+
+from PIL import Image as PILImage, ImageOps
+
+
+def render_derivative(source_path: str, destination_path: str, size: Tuple[int, int], crop: bool) -> str:
+    """
+    Renders a smaller JPEG rendition of an image. This is CPU bound and only depends on
+    Pillow, so it can run in a separate process.
+
+    :param source_path: String path of the original image
+    :param destination_path: String path to write the rendition to
+    :param size: (width, height) of the rendition
+    :param crop: True to crop to exactly the given size, False to fit inside it
+    :return: String path of the rendition
+    """
+    with PILImage.open(source_path) as img:
+        # Let the JPEG decoder skip detail we are going to throw away anyway
+        img.draft('RGB', size)
+        img = ImageOps.exif_transpose(img)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        if crop:
+            img = ImageOps.fit(img, size, method=PILImage.LANCZOS)
+        else:
+            img.thumbnail(size, PILImage.LANCZOS)
+        img.save(destination_path, 'JPEG', quality=85, optimize=True, progressive=True)
+    return destination_path
+
+
+def render_derivatives(source_path: str, renditions: Dict[str, dict]) -> Dict[str, str]:
+    """
+    Renders every configured rendition of an image next to the original file.
+
+    :param source_path: String path of the original image
+    :param renditions: Dict of rendition name to {'size': (width, height), 'crop': bool}
+    :return: Dict of rendition name to the String path of the rendered file
+    """
+    return {name: render_derivative(source_path, f'{source_path}.{name}.jpg', tuple(spec['size']), spec['crop'])
+            for name, spec in renditions.items()}
+
+
+# EXIF tags kept in Image.exif, by name
+EXIF_TAGS = {
+    'lens_model': 0xA434,
+    'iso': 0x8827,
+    'exposure_time': 0x829A,
+    'f_number': 0x829D,
+    'focal_length': 0x920A,
+}
+EXIF_IFD = 0x8769
+MAKE = 0x010F
+MODEL = 0x0110
+ORIENTATION = 0x0112
+DATE_TIME = 0x0132
+DATE_TIME_ORIGINAL = 0x9003
+# EXIF orientations that rotate the image by 90 degrees
+ROTATED = {5, 6, 7, 8}
+
+
+def _json_value(value):
+    # Rationals (e.g. the exposure time) become floats, anything else that isn't JSON a string
+    if isinstance(value, str):
+        return value.strip('\x00 ')
+    if isinstance(value, int):
+        return value
+    try:
+        value = float(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return str(value)
+    return value if math.isfinite(value) else None
+
+
+def _parse_exif_datetime(value) -> Optional[datetime]:
+    try:
+        return datetime.strptime(str(value).strip('\x00 '), '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        return None
+
+
+def read_metadata(source: Union[str, BinaryIO]) -> dict:
+    """
+    Reads the dimensions and EXIF metadata of an image. Pillow only parses the header to
+    open a file, so the pixels are never decoded and a truncated file (e.g. the first bytes
+    of an object in storage) is enough.
+
+    :param source: String path or binary file object of the image
+    :return: Dict of width, height, orientation, taken_at (naive datetime or None),
+        camera_make, camera_model and exif (dict of EXIF_TAGS found)
+    :raises PIL.UnidentifiedImageError: if the file is not an image Pillow can read
+    """
+    with PILImage.open(source) as img:
+        width, height = img.size
+        exif = img.getexif()
+    details = exif.get_ifd(EXIF_IFD)
+    if exif.get(ORIENTATION) in ROTATED:
+        width, height = height, width
+    if width == height:
+        orientation = 'square'
+    else:
+        orientation = 'landscape' if width > height else 'portrait'
+    taken_at = details.get(DATE_TIME_ORIGINAL) or exif.get(DATE_TIME)
+    return {
+        'width': width,
+        'height': height,
+        'orientation': orientation,
+        'taken_at': _parse_exif_datetime(taken_at) if taken_at else None,
+        'camera_make': str(exif.get(MAKE, '')).strip('\x00 ')[:64],
+        'camera_model': str(exif.get(MODEL, '')).strip('\x00 ')[:64],
+        'exif': {name: _json_value(details[tag]) for name, tag in EXIF_TAGS.items() if tag in details},
+    }
@@ -0,0 +1,269 @@
+import asyncio
+import math
+import ssl
+import time
+import uuid
+from http.cookies import SimpleCookie
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """
+    Nearest-rank percentile.
+
+    :param values: List of numbers
+    :param pct: Float percentile between 0 and 100
+    :return: The value at that percentile, 0 for an empty list
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict[str, float]:
+    """
+    Summarizes the latencies of a load test run.
+
+    :param latencies: List of float seconds each successful request took
+    :param errors: Integer number of failed requests
+    :param elapsed: Float seconds the whole run took
+    :return: Dict of requests, errors, rps and p50/p95/p99/max in milliseconds
+    """
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 50) * 1000,
+        'p95': percentile(latencies, 95) * 1000,
+        'p99': percentile(latencies, 99) * 1000,
+        'max': max(latencies, default=0.0) * 1000,
+    }
+
+
+async def _open(url: str):
+    parts = urlsplit(url)
+    secure = parts.scheme == 'https'
+    port = parts.port or (443 if secure else 80)
+    reader, writer = await asyncio.open_connection(parts.hostname, port,
+                                                   ssl=ssl.create_default_context() if secure else None)
+    target = parts.path or '/'
+    if parts.query:
+        target += '?' + parts.query
+    return reader, writer, parts.netloc, target
+
+
+async def _read_response(reader) -> Tuple[int, List[Tuple[str, str]]]:
+    status_line = await reader.readline()
+    headers = []
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers.append((name.strip().lower(), value.strip()))
+    # Drain the rest of the response; the server closes the connection when it's done
+    while await reader.read(64 * 1024):
+        pass
+    try:
+        return int(status_line.split()[1]), headers
+    except (IndexError, ValueError):
+        return 0, headers
+
+
+async def _read_status(reader) -> int:
+    return (await _read_response(reader))[0]
+
+
+def _write_head(writer, method: str, host: str, target: str, headers: Dict[str, str]):
+    lines = [f'{method} {target} HTTP/1.1', f'Host: {host}', 'Connection: close']
+    lines += [f'{name}: {value}' for name, value in headers.items()]
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+
+async def fetch(url: str, headers: Optional[Dict[str, str]] = None) -> int:
+    """
+    Sends a GET request and reads the whole response.
+
+    :param url: String http(s) URL
+    :param headers: Optional dict of extra request headers, e.g. a session cookie
+    :return: Integer HTTP status, 0 if the response couldn't be parsed
+    """
+    reader, writer, host, target = await _open(url)
+    try:
+        _write_head(writer, 'GET', host, target, headers or {})
+        await writer.drain()
+        return await _read_status(reader)
+    finally:
+        writer.close()
+
+
+async def get_csrf_token(url: str, headers: Optional[Dict[str, str]] = None, cookie_name: str = 'csrftoken') -> str:
+    """
+    Fetches a form page and returns the CSRF token the server set in its cookie, which a POST
+    has to send back in the cookie and the X-CSRFToken header.
+
+    :param url: String http(s) URL of a page with a form, e.g. the upload page
+    :param headers: Optional dict of extra request headers, e.g. a session cookie
+    :param cookie_name: String name of the CSRF cookie, settings.CSRF_COOKIE_NAME
+    :return: String CSRF token
+    """
+    reader, writer, host, target = await _open(url)
+    try:
+        _write_head(writer, 'GET', host, target, headers or {})
+        await writer.drain()
+        status, response_headers = await _read_response(reader)
+    finally:
+        writer.close()
+    for name, value in response_headers:
+        if name == 'set-cookie':
+            cookie = SimpleCookie(value)
+            if cookie_name in cookie:
+                return cookie[cookie_name].value
+    raise ValueError(f'{url} answered {status} without a {cookie_name} cookie; is the session cookie valid?')
+
+
+def multipart_upload(fields: Dict[str, str], file_field: str, file_name: str, size: int) -> Tuple[str, bytes, bytes]:
+    """
+    Builds a multipart/form-data body around a file of ``size`` bytes, in pieces so the file
+    content can be sent in between at any pace.
+
+    :param fields: Dict of form field names to values
+    :param file_field: String name of the file field
+    :param file_name: String name of the uploaded file
+    :param size: Integer number of bytes of file content
+    :return: Tuple of the Content-Type header, the bytes before the file content and the bytes after it
+    """
+    boundary = uuid.uuid4().hex
+    head = b''.join(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+                    for name, value in fields.items())
+    head += (f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{file_name}"\r\n'
+             f'Content-Type: application/octet-stream\r\n\r\n').encode()
+    return f'multipart/form-data; boundary={boundary}', head, f'\r\n--{boundary}--\r\n'.encode()
+
+
+async def trickle_upload(url: str, size: int, duration: float, headers: Optional[Dict[str, str]] = None,
+                         fields: Optional[Dict[str, str]] = None, csrf_token: Optional[str] = None) -> int:
+    """
+    Uploads a file whose content arrives slowly, like an upload from a client on a poor
+    connection. The request is a regular form upload, so the server only answers it once the
+    whole body was received. The file content is filler bytes; the point is to hold the
+    connection for ``duration``.
+
+    :param url: String http(s) URL of the upload form
+    :param size: Integer number of file bytes to send
+    :param duration: Float seconds to spread the file over
+    :param headers: Optional dict of extra request headers, e.g. a session cookie
+    :param fields: Optional dict of the other form fields, e.g. the album and title
+    :param csrf_token: Optional string CSRF token, see get_csrf_token()
+    :return: Integer HTTP status of the response
+    """
+    content_type, head, tail = multipart_upload(fields or {}, 'file', 'upload.jpg', size)
+    request_headers = dict(headers or {})
+    request_headers.update({'Content-Type': content_type, 'Content-Length': str(len(head) + size + len(tail))})
+    if csrf_token:
+        cookie = request_headers.get('Cookie')
+        request_headers['Cookie'] = f'{cookie}; csrftoken={csrf_token}' if cookie else f'csrftoken={csrf_token}'
+        request_headers['X-CSRFToken'] = csrf_token
+        # Checked by Django for https requests
+        request_headers['Referer'] = url
+
+    reader, writer, host, target = await _open(url)
+    try:
+        _write_head(writer, 'POST', host, target, request_headers)
+        writer.write(head)
+        chunks = max(int(duration * 10), 1)
+        chunk = b'x' * max(size // chunks, 1)
+        sent = 0
+        while sent < size:
+            data = chunk[:size - sent]
+            writer.write(data)
+            await writer.drain()
+            sent += len(data)
+            await asyncio.sleep(duration / chunks)
+        writer.write(tail)
+        await writer.drain()
+        return await _read_status(reader)
+    finally:
+        writer.close()
+
+
+async def run_load(url: str, requests: int, concurrency: int, slow_upload_url: Optional[str] = None,
+                   slow_uploads: int = 0, upload_size: int = 0, upload_duration: float = 0,
+                   upload_fields: Optional[Dict[str, str]] = None,
+                   headers: Optional[Dict[str, str]] = None) -> Dict[str, float]:
+    """
+    Measures GET latency while, optionally, slow uploads hold connections open against the same server.
+    A server whose workers are tied up by the uploads shows it in the tail latencies.
+
+    :param url: String URL requested by the measured clients
+    :param requests: Integer total number of measured requests
+    :param concurrency: Integer number of measured clients sending requests at the same time
+    :param slow_upload_url: Optional string URL the slow uploads are sent to
+    :param slow_uploads: Integer number of concurrent slow uploads
+    :param upload_size: Integer bytes per slow upload
+    :param upload_duration: Float seconds each slow upload takes
+    :param upload_fields: Optional dict of the upload form's other fields, e.g. the album and title
+    :param headers: Optional dict of extra request headers for every request, e.g. a session cookie
+    :return: Dict summary, see summarize()
+    """
+    uploads = []
+    if slow_upload_url and slow_uploads:
+        # The uploads have to get past the CSRF check, or the server rejects them before reading their bodies
+        csrf_token = await get_csrf_token(slow_upload_url, headers)
+        uploads = [asyncio.ensure_future(trickle_upload(slow_upload_url, upload_size, upload_duration, headers,
+                                                        fields=upload_fields, csrf_token=csrf_token))
+                   for _ in range(slow_uploads)]
+    if uploads:
+        # Let the uploads occupy the server before measuring
+        await asyncio.sleep(min(upload_duration / 10, 1))
+
+    latencies = []
+    errors = 0
+    remaining = requests
+
+    async def client():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                status = await fetch(url, headers)
+            except OSError:
+                status = 0
+            if 200 <= status < 400:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    for upload in uploads:
+        upload.cancel()
+    await asyncio.gather(*uploads, return_exceptions=True)
+    return summarize(latencies, errors, elapsed)
+
+
+async def compare_servers(servers: Dict[str, str], paths: List[str], requests: int, concurrency: int,
+                          headers: Optional[Dict[str, str]] = None) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """
+    Measures the throughput and latency of the same paths on several deployments of the app,
+    one deployment and path at a time so they don't compete for the machine.
+
+    :param servers: Dict of deployment name to base URL, e.g. {'gunicorn': 'http://localhost:8080'}
+    :param paths: List of string paths requested on every deployment
+    :param requests: Integer number of requests per deployment and path
+    :param concurrency: Integer number of clients sending requests at the same time
+    :param headers: Optional dict of extra request headers for every request
+    :return: Dict of deployment name to dict of path to summary, see summarize()
+    """
+    results = {}
+    for name, base_url in servers.items():
+        results[name] = {}
+        for path in paths:
+            results[name][path] = await run_load(base_url.rstrip('/') + path, requests, concurrency, headers=headers)
+    return results
@@ -0,0 +1,353 @@
+import fcntl
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+# Process-wide Prometheus-style metrics. Every worker process keeps its own; with
+# settings.METRICS_DIR set they write them to a file there now and then, and render() adds up
+# the files of all processes, so any worker reports the totals of the server.
+HELP = {
+    'http_requests_total': ('counter', 'Requests served'),
+    'http_request_duration_seconds': ('histogram', 'Time spent serving a request'),
+    'db_queries_total': ('counter', 'Database queries run'),
+    'db_query_duration_seconds_total': ('counter', 'Time spent in database queries'),
+    'cache_requests_total': ('counter', 'List cache lookups by result'),
+    'storage_calls_total': ('counter', 'Object storage calls'),
+    'storage_bytes_total': ('counter', 'Bytes sent to or received from object storage'),
+    'storage_duration_seconds_total': ('counter', 'Time spent in object storage calls'),
+}
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+# Label of work done outside a request, e.g. by the upload workers
+BACKGROUND = 'background'
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, tuple], float] = defaultdict(float)
+_histograms: Dict[Tuple[str, tuple], list] = {}
+# Serialises the writes of this process's file, so an older snapshot never replaces a newer one
+_flush_lock = threading.Lock()
+_last_flush = 0.0
+# Name of this process's file in settings.METRICS_DIR, unique even if a pid is reused
+_file_name: Optional[str] = None
+# Holds the metrics of processes that exited, see retire()
+RETIRED_FILE = 'retired.json'
+
+
+class RequestStats:
+    """
+    What one request spent its time on.
+    """
+    def __init__(self, max_queries: int):
+        self.view = None
+        self.start = time.perf_counter()
+        self.max_queries = max_queries
+        self.queries = 0
+        self.query_time = 0.0
+        # (sql, seconds) of the first max_queries queries, for the slow request log
+        self.query_log = []
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.storage_calls = 0
+        self.storage_bytes = 0
+        self.storage_time = 0.0
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar('request_stats', default=None)
+
+
+def _labels(**labels) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _view() -> str:
+    stats = _current.get()
+    return (stats.view or 'unresolved') if stats is not None else BACKGROUND
+
+
+def inc(name: str, value: float = 1, **labels):
+    with _lock:
+        _counters[(name, _labels(**labels))] += value
+
+
+def observe(name: str, value: float, **labels):
+    with _lock:
+        histogram = _histograms.setdefault((name, _labels(**labels)), [0] * len(BUCKETS) + [0.0])
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram[i] += 1
+        histogram[-1] += value
+
+
+def start_request(max_queries: int = 100) -> RequestStats:
+    """
+    Starts collecting the stats of the current request.
+
+    :param max_queries: Integer number of queries whose SQL is kept
+    :return: RequestStats of the request
+    """
+    stats = RequestStats(max_queries)
+    _current.set(stats)
+    return stats
+
+
+def finish_request(stats: RequestStats, method: str, status: int) -> float:
+    """
+    Stops collecting the stats of the current request and records it.
+
+    :param stats: RequestStats from start_request()
+    :param method: String HTTP method
+    :param status: Integer HTTP status
+    :return: Float seconds the request took
+    """
+    duration = time.perf_counter() - stats.start
+    _current.set(None)
+    view = stats.view or 'unresolved'
+    inc('http_requests_total', view=view, method=method, status=str(status))
+    observe('http_request_duration_seconds', duration, view=view)
+    if settings.METRICS_DIR and time.monotonic() - _last_flush >= settings.METRICS_FLUSH_INTERVAL:
+        try:
+            flush()
+        except OSError:
+            logger.exception('Writing the metrics to %s failed', settings.METRICS_DIR)
+    return duration
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper that counts and times every query.
+    """
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - start
+        stats = _current.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.query_time += duration
+            if len(stats.query_log) < stats.max_queries:
+                stats.query_log.append((sql, duration))
+        view = _view()
+        inc('db_queries_total', view=view)
+        inc('db_query_duration_seconds_total', duration, view=view)
+
+
+def record_cache(hit: bool):
+    stats = _current.get()
+    if stats is not None:
+        if hit:
+            stats.cache_hits += 1
+        else:
+            stats.cache_misses += 1
+    inc('cache_requests_total', view=_view(), result='hit' if hit else 'miss')
+
+
+class StorageCall:
+    def __init__(self):
+        self.bytes = 0
+
+
+@contextmanager
+def storage_call(operation: str):
+    """
+    Counts and times an object storage call. Set ``bytes`` on the yielded object to record
+    the amount of data transferred.
+
+    :param operation: String name of the call, e.g. 'upload'
+    """
+    call = StorageCall()
+    start = time.perf_counter()
+    try:
+        yield call
+    finally:
+        duration = time.perf_counter() - start
+        stats = _current.get()
+        if stats is not None:
+            stats.storage_calls += 1
+            stats.storage_bytes += call.bytes
+            stats.storage_time += duration
+        view = _view()
+        inc('storage_calls_total', view=view, operation=operation)
+        inc('storage_bytes_total', call.bytes, view=view, operation=operation)
+        inc('storage_duration_seconds_total', duration, view=view, operation=operation)
+
+
+def _format_labels(labels: tuple, **extra) -> str:
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in items)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(items, escaped)) + '}'
+
+
+def _dump(counters: dict, histograms: dict) -> dict:
+    return {
+        'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+        'histograms': [[name, labels, list(value)] for (name, labels), value in histograms.items()],
+    }
+
+
+def _snapshot(clear: bool = False) -> dict:
+    with _lock:
+        snapshot = _dump(_counters, _histograms)
+        if clear:
+            _counters.clear()
+            _histograms.clear()
+    return snapshot
+
+
+def _merge(counters: dict, histograms: dict, snapshot: dict):
+    for name, labels, value in snapshot['counters']:
+        key = (name, tuple(tuple(label) for label in labels))
+        counters[key] = counters.get(key, 0) + value
+    for name, labels, value in snapshot['histograms']:
+        key = (name, tuple(tuple(label) for label in labels))
+        total = histograms.setdefault(key, [0] * len(value))
+        for i, count in enumerate(value):
+            total[i] += count
+
+
+def _read(path: str) -> dict:
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {'counters': [], 'histograms': []}
+
+
+def _write(path: str, snapshot: dict):
+    # Written next to the file and renamed over it, so readers never see half a file
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as file:
+            json.dump(snapshot, file)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+@contextmanager
+def _directory_lock(exclusive: bool):
+    # Readers of the directory share it, retire() takes it for itself
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    fd = os.open(os.path.join(settings.METRICS_DIR, '.lock'), os.O_CREAT | os.O_RDWR)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+    finally:
+        os.close(fd)
+
+
+def flush():
+    """
+    Writes the metrics of this process to its file in settings.METRICS_DIR, where render()
+    in every process of the server reads them. Runs after a request at most every
+    settings.METRICS_FLUSH_INTERVAL seconds, and on every render().
+    """
+    global _file_name, _last_flush
+    if not settings.METRICS_DIR:
+        return
+    with _flush_lock:
+        _last_flush = time.monotonic()
+        if _file_name is None:
+            os.makedirs(settings.METRICS_DIR, exist_ok=True)
+            _file_name = f'process-{os.getpid()}-{uuid.uuid4().hex}.json'
+        _write(os.path.join(settings.METRICS_DIR, _file_name), _snapshot())
+
+
+def retire():
+    """
+    Adds the metrics of this process to those of the processes that exited before, for a
+    worker that is about to exit, so the totals keep growing after it is replaced. Called
+    by gunicorn's worker_exit hook; a worker that is killed leaves its file behind instead.
+    """
+    global _file_name
+    if not settings.METRICS_DIR:
+        return
+    with _flush_lock, _directory_lock(exclusive=True):
+        retired_path = os.path.join(settings.METRICS_DIR, RETIRED_FILE)
+        counters, histograms = {}, {}
+        _merge(counters, histograms, _read(retired_path))
+        _merge(counters, histograms, _snapshot(clear=True))
+        _write(retired_path, _dump(counters, histograms))
+        if _file_name is not None:
+            try:
+                os.unlink(os.path.join(settings.METRICS_DIR, _file_name))
+            except FileNotFoundError:
+                pass
+        _file_name = None
+
+
+def _collect() -> Tuple[dict, dict]:
+    if not settings.METRICS_DIR:
+        with _lock:
+            return dict(_counters), {key: list(value) for key, value in _histograms.items()}
+    flush()
+    counters, histograms = {}, {}
+    with _directory_lock(exclusive=False):
+        for path in glob.glob(os.path.join(settings.METRICS_DIR, '*.json')):
+            _merge(counters, histograms, _read(path))
+    return counters, histograms
+
+
+def render() -> str:
+    """
+    Renders all metrics in the Prometheus text exposition format: those of every process
+    sharing settings.METRICS_DIR, or of this process only without it.
+
+    :return: String
+    """
+    counters, histograms = _collect()
+    lines = []
+    for name, (kind, help_text) in HELP.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+        for (metric, labels), histogram in sorted(histograms.items()):
+            if metric != name:
+                continue
+            # Buckets are already cumulative, every observation is counted in each bucket it fits
+            for bound, count in zip(BUCKETS, histogram):
+                le = '+Inf' if bound == float('inf') else str(bound)
+                lines.append(f'{name}_bucket{_format_labels(labels, le=le)} {count}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {histogram[-1]}')
+            lines.append(f'{name}_count{_format_labels(labels)} {histogram[len(BUCKETS) - 1]}')
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """
+    Forgets all recorded metrics.
+    """
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def _forget_parent():
+    global _lock, _flush_lock, _file_name
+    # A forked worker starts from nothing, whatever the parent recorded stays the parent's
+    _lock = threading.Lock()
+    _flush_lock = threading.Lock()
+    _file_name = None
+    _counters.clear()
+    _histograms.clear()
+
+
+os.register_at_fork(after_in_child=_forget_parent)
@@ -0,0 +1,70 @@
+import bisect
+import hashlib
+import re
+from typing import List, Optional, Tuple
+
+
+# Node names are part of every key stored on the node, so they are short and plain
+MAX_NODE_NAME_LENGTH = 20
+NODE_NAME_RE = re.compile(rf'^[a-z0-9_-]{{1,{MAX_NODE_NAME_LENGTH}}}$')
+# A key made by shard_key(): '{node}/{hex digits}/{name}'
+KEY_RE = re.compile(rf'^([a-z0-9_-]{{1,{MAX_NODE_NAME_LENGTH}}})/[0-9a-f]+/(.+)$', re.DOTALL)
+
+
+def _hash(value: str) -> int:
+    return int(hashlib.md5(value.encode('utf-8')).hexdigest()[:16], 16)
+
+
+class HashRing:
+    """
+    Consistent hashing of keys onto nodes. Every node is put on a ring at a number of
+    pseudo-random points, and a key belongs to the first node point at or after the key's own
+    point. Adding or removing a node only moves the keys next to its points, about 1/n of
+    them, where plain modulo hashing would move nearly all.
+    """
+    def __init__(self, nodes: List[str], points: int = 100):
+        """
+        :param nodes: String names of the nodes; a node's points only depend on its name
+        :param points: Integer number of points per node, more spread the keys more evenly
+        """
+        if not nodes:
+            raise ValueError('A hash ring needs at least one node')
+        ring = sorted((_hash(f'{node}#{i}'), node) for node in nodes for i in range(points))
+        self.points = [point for point, _ in ring]
+        self.nodes = [node for _, node in ring]
+
+    def get_node(self, key: str) -> str:
+        """
+        :param key: String key, e.g. an object name
+        :return: String name of the node the key belongs to
+        """
+        i = bisect.bisect_left(self.points, _hash(key))
+        return self.nodes[i % len(self.nodes)]
+
+
+def shard_key(name: str, node: str, length: int = 2) -> str:
+    """
+    Builds the key an object is stored under: the node it is stored on, hex digits of its
+    hash and its name. Object stores partition their keys by prefix, and names that sort
+    together (e.g. ending in a timestamp, or uploaded in a burst) would otherwise all hit the
+    same partition. The node is part of the key, so an object is found where it was put even
+    after nodes are added or the prefix length changes.
+
+    :param name: String object name
+    :param node: String name of the node the object is stored on
+    :param length: Integer number of hex digits in the prefix
+    :return: String key, e.g. 'uploads/3f/beach.jpg'
+    """
+    return f'{node}/{hashlib.md5(name.encode("utf-8")).hexdigest()[:length]}/{name}'
+
+
+def parse_key(key: str) -> Optional[Tuple[str, str]]:
+    """
+    Reverses shard_key.
+
+    :param key: String object key
+    :return: Tuple of the node name and the object name, None for keys stored before they
+        named their node
+    """
+    match = KEY_RE.match(key)
+    return (match.group(1), match.group(2)) if match else None
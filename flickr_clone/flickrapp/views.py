@@ -1,14 +1,47 @@
-from datetime import date
+import calendar
+import mimetypes
+import time
+from datetime import date, datetime, timedelta, timezone
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views import View
+from django.views.generic.base import TemplateView
 from django.views.generic.list import ListView
 from django.views.generic.edit import FormView
 
-from .forms import CreateAlbumForm, UploadImageForm
+from . import derivatives, list_cache, search
+from .forms import BulkUploadImageForm, CreateAlbumForm, UploadImageForm
 from .models import Album, Image
+from .utils import file_utils, http_utils, metrics
+
+
+class CachedListMixin:
+    """
+    Serves a list page from the cache. Views name the cache scopes the page is built from,
+    and the page is cached separately for every visibility context, e.g. anonymous visitors
+    vs. the owner of the albums.
+    """
+    def get_cache_scopes(self):
+        raise NotImplementedError()
+
+    def get_visibility(self):
+        return 'authenticated' if self.request.user.is_authenticated else 'anonymous'
+
+    def get(self, request, *args, **kwargs):
+        key = list_cache.get_key(self.get_cache_scopes(), request.get_full_path(), self.get_visibility())
+        content = list_cache.lookup(key)
+        if content is not None:
+            return HttpResponse(content)
+        response = super().get(request, *args, **kwargs)
+        response.add_post_render_callback(lambda rendered: list_cache.store(key, rendered.content))
+        return response
 
 
 class CreateAlbumView(LoginRequiredMixin, FormView):
@@ -24,19 +57,34 @@ class CreateAlbumView(LoginRequiredMixin, FormView):
         return super().form_valid(form)
 
 
-class AlbumListView(ListView):
+class AlbumListView(CachedListMixin, ListView):
     template_name = "albums/list-all-albums.html"
+    paginate_by = settings.LIST_PAGE_SIZE
+
+    def get_cache_scopes(self):
+        return [list_cache.public_albums_scope()]
 
     def get_queryset(self):
         # Only retrieve public albums
         # Not including the possible authenticated user's private albums b/c
         # they can go to their own profile to see those
-        album_list = Album.objects.filter(is_public=True)
+        # The template shows each album's owner, so fetch them in the same query
+        album_list = Album.objects.filter(is_public=True).select_related('owner').order_by('date_created', 'id')
         return album_list
 
 
-class AlbumListForUserView(ListView):
+class AlbumListForUserView(CachedListMixin, ListView):
     template_name = 'albums/list-albums.html'
+    paginate_by = settings.LIST_PAGE_SIZE
+
+    def get_cache_scopes(self):
+        return [list_cache.user_albums_scope(self.kwargs['username'])]
+
+    def get_visibility(self):
+        # Owners see their private albums as well
+        if self.request.user.is_authenticated and self.request.user.username == self.kwargs['username']:
+            return 'owner'
+        return super().get_visibility()
 
     def get_queryset(self):
         user = get_object_or_404(User, username=self.kwargs['username'])
@@ -48,7 +96,8 @@ class AlbumListForUserView(ListView):
             # The requested albums do not belong to the active user
             # A user is not allowed to see others' private albums
             album_list = Album.objects.filter(owner=user).filter(is_public=True)
-        return album_list
+        # id breaks ties between albums created on the same day, so pages never overlap
+        return album_list.order_by('date_created', 'id')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -56,20 +105,50 @@ class AlbumListForUserView(ListView):
         return context
 
 
-class ImageListForAlbumView(ListView):
+class ImageListForAlbumView(CachedListMixin, ListView):
     template_name = 'albums/list-images.html'
+    paginate_by = settings.LIST_PAGE_SIZE
+
+    def get_cache_scopes(self):
+        try:
+            album_id = int(self.kwargs['pk'])
+        except ValueError:
+            raise Http404()
+        return [list_cache.album_images_scope(album_id)]
+
+    def get_visibility(self):
+        # Whether a private album can be seen depends on who is asking
+        if self.request.user.is_authenticated:
+            return f'user:{self.request.user.id}'
+        return 'anonymous'
 
     def get_queryset(self):
-        album = get_object_or_404(Album, id=self.kwargs.get('pk'))
+        # Keep the album (and its owner, shown on every row) around for the context
+        self.album = get_object_or_404(Album.objects.select_related('owner'), id=self.kwargs.get('pk'))
         # login is not required, but users cannot request another user's private album
-        if not album.is_public and album.owner != self.request.user:
+        if not self.album.is_public and self.album.owner_id != self.request.user.id:
             raise PermissionDenied()
-        image_list = Image.objects.filter(album=album)
+        # Images still on their way to storage have nothing to show yet
+        image_list = Image.objects.filter(album=self.album, status=Image.Status.READY).order_by('date_uploaded', 'id')
         return image_list
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['album'] = Album.objects.get(id=self.kwargs.get('pk'))
+        context['album'] = self.album
+        return context
+
+
+class SearchView(TemplateView):
+    template_name = 'albums/search.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        query = self.request.GET.get('q', '').strip()
+        context['query'] = query
+        if query:
+            limit = settings.SEARCH_MAX_RESULTS
+            context['album_list'] = search.search_albums(query, self.request.user).select_related('owner')[:limit]
+            context['image_list'] = search.search_images(query, self.request.user)[:limit]
         return context
 
 
@@ -85,11 +164,140 @@ class UploadImageView(LoginRequiredMixin, FormView):
         return kwargs
 
     def form_valid(self, form):
-        # Upload file
-        upload_location = form.upload_image(self.request.FILES['file'], form.cleaned_data['title'])
-        # Save image data to database
-        Image.objects.create(album=form.cleaned_data['album'],
-                             title=form.cleaned_data['title'],
-                             location=upload_location,
-                             date_uploaded=date.today())
+        # Stage the file and save a pending image; the transfer to storage happens in the background
+        form.queue_upload(self.request.FILES['file'])
         return super().form_valid(form)
+
+
+class BulkUploadImageView(LoginRequiredMixin, FormView):
+    template_name = "user/bulk-upload-images.html"
+    form_class = BulkUploadImageForm
+
+    def get_form_kwargs(self):
+        # We need the authenticated user to get the list of albums owned by the user
+        kwargs = super(BulkUploadImageView, self).get_form_kwargs()
+        kwargs.update({'user': self.request.user})
+        return kwargs
+
+    def form_valid(self, form):
+        # Stage every file and save pending images; they are pushed to storage concurrently in the background
+        results = form.queue_uploads()
+        return self.render_to_response(self.get_context_data(form=form, results=results))
+
+
+class ImageFileView(View):
+    """
+    Serves an image, or one of its renditions, from object storage. Responses carry ETag and
+    Last-Modified so browsers revalidate with a cheap 304, support single byte ranges, and
+    are streamed from storage without being buffered. Content-addressed originals never
+    change, so they are cached as immutable and validated without asking storage.
+
+    Renditions of content-addressed images never change either, and list pages embed many of
+    them, so browsers are redirected to fetch those straight from storage instead of through
+    an app worker.
+    """
+    # Seconds a browser may keep an image that can't change
+    immutable_max_age = 365 * 24 * 60 * 60
+
+    def get(self, request, pk, rendition='original'):
+        image = get_object_or_404(Image.objects.select_related('album', 'blob'), id=pk, status=Image.Status.READY)
+        # login is not required, but users cannot request images of another user's private album
+        if not image.album.is_public and image.album.owner_id != request.user.id:
+            raise PermissionDenied()
+        if rendition == 'original':
+            location = image.location
+        elif rendition in settings.IMAGE_RENDITIONS:
+            location = getattr(image, f'{rendition}_location') or image.location
+        else:
+            raise Http404()
+        object_name = file_utils.get_object_name_from_location(location)
+        audience = 'public' if image.album.is_public else 'private'
+
+        if image.blob is not None and rendition != 'original' and \
+                object_name == derivatives.get_derivative_object_name(image.blob.object_name, rendition):
+            return self.get_storage_redirect(object_name, audience)
+
+        immutable = image.blob is not None and location == image.location
+        if immutable:
+            etag = image.blob.sha256
+            last_modified = image.blob.date_created
+            size = image.blob.size
+            content_type = mimetypes.guess_type(object_name)[0]
+        else:
+            stat = file_utils.get_uploader(object_name).stat(object_name)
+            if stat is None:
+                raise Http404()
+            etag, last_modified, size, content_type = stat.etag, stat.last_modified, stat.size, stat.content_type
+        etag = quote_etag(etag)
+        last_modified = calendar.timegm(last_modified.utctimetuple())
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = self.get_content_response(request, object_name, size,
+                                                 content_type or 'application/octet-stream', etag)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        response['Accept-Ranges'] = 'bytes'
+        if immutable:
+            response['Cache-Control'] = f'{audience}, max-age={self.immutable_max_age}, immutable'
+        else:
+            response['Cache-Control'] = f'{audience}, max-age={settings.IMAGE_CACHE_MAX_AGE}'
+        return response
+
+    def get_storage_redirect(self, object_name, audience):
+        # Signed at the start of the period, so the URL and the browser's copy of the image are
+        # reused until the period ends
+        period = settings.IMAGE_URL_SIGNING_PERIOD
+        now = int(time.time())
+        signed_at = now - now % period
+        url = file_utils.get_uploader(object_name).get_download_url(
+            object_name, expires=timedelta(seconds=2 * period),
+            signed_at=datetime.fromtimestamp(signed_at, timezone.utc),
+            cache_control=f'{audience}, max-age={self.immutable_max_age}, immutable')
+        response = HttpResponseRedirect(url)
+        response['Cache-Control'] = f'{audience}, max-age={signed_at + period - now}'
+        return response
+
+    def get_content_response(self, request, object_name, size, content_type, etag):
+        byte_range = None
+        # A stale If-Range means the client's partial copy is outdated, so it gets the whole file
+        if request.META.get('HTTP_IF_RANGE', etag) == etag:
+            try:
+                byte_range = http_utils.parse_range(request.META.get('HTTP_RANGE'), size)
+            except http_utils.RangeNotSatisfiable:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{size}'
+                return response
+
+        first, last = byte_range or (0, size - 1)
+        length = last - first + 1 if size else 0
+        if request.method == 'HEAD':
+            response = HttpResponse(content_type=content_type, status=206 if byte_range else 200)
+        else:
+            stored = file_utils.get_uploader(object_name).open(object_name, offset=first,
+                                                               length=length if byte_range else 0)
+            response = StreamingHttpResponse(_stream(stored), content_type=content_type,
+                                             status=206 if byte_range else 200)
+        response['Content-Length'] = str(length)
+        if byte_range:
+            response['Content-Range'] = f'bytes {first}-{last}/{size}'
+        return response
+
+
+class MetricsView(View):
+    """
+    Exposes the request metrics in the Prometheus text format, to the scrapers allowed by
+    settings.METRICS_ALLOWED_IPS only.
+    """
+    def get(self, request):
+        if not http_utils.is_address_in(request.META.get('REMOTE_ADDR'), settings.METRICS_ALLOWED_IPS):
+            raise PermissionDenied()
+        return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _stream(stored):
+    try:
+        yield from stored.stream(settings.IMAGE_STREAM_CHUNK_SIZE)
+    finally:
+        stored.close()
+        stored.release_conn()
@@ -0,0 +1,62 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> Optional[ThreadPoolExecutor]:
+    """
+    Returns the process-wide pool of background worker threads, or None when background work
+    is left to the management commands (settings.UPLOAD_WORKER_THREADS = 0).
+    """
+    global _executor
+    if settings.UPLOAD_WORKER_THREADS <= 0:
+        return None
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=settings.UPLOAD_WORKER_THREADS,
+                                               thread_name_prefix='upload')
+    return _executor
+
+
+def run_task(func: Callable, *args):
+    """
+    Runs a background task. Errors are logged rather than raised, whatever the task left
+    unfinished is picked up again by the management commands.
+
+    :param func: Callable to run
+    :param args: Arguments to call it with
+    """
+    # Worker threads get their own DB connection; make sure it doesn't outlive the task
+    close_old_connections()
+    try:
+        func(*args)
+    except Exception:
+        logger.exception('Background task %s%s failed', func.__name__, args)
+    finally:
+        close_old_connections()
+
+
+def submit(func: Callable, *args) -> bool:
+    """
+    Hands a task to the background worker threads, if there are any.
+
+    :param func: Callable to run
+    :param args: Arguments to call it with
+    :return: True if the task was submitted
+    """
+    executor = get_executor()
+    if executor is None:
+        return False
+    executor.submit(run_task, func, *args)
+    return True
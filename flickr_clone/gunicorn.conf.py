@@ -0,0 +1,68 @@
+"""
+Gunicorn settings for serving the app in production, read by `gunicorn` from the working
+directory. Every setting can be changed with an environment variable.
+
+For more information on these settings, see
+https://docs.gunicorn.org/en/stable/settings.html
+"""
+
+import multiprocessing
+import os
+import shutil
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+
+# With SERVE_ASGI the app is served over ASGI by uvicorn workers, otherwise over WSGI
+if os.getenv('SERVE_ASGI', 'False') == 'True':
+    wsgi_app = 'flickr_clone.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'flickr_clone.wsgi:application'
+    # Threads let a worker overlap requests waiting on the database or storage
+    worker_class = 'gthread'
+
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+
+# Load the app once before forking the workers, so they share its memory and start faster.
+# The Minio client, the upload threads and the rendering processes are all created on first
+# use, so nothing a worker needs is created before the fork.
+preload_app = os.getenv('GUNICORN_PRELOAD', 'True') == 'True'
+
+# Replace a worker after this many requests (0 never does), to bound slow memory growth;
+# the jitter keeps the workers from restarting at the same time
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+# Seconds a worker may be silent before it is killed and restarted
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+# Seconds workers get to finish their requests on a restart or shutdown
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+# Seconds an idle keep-alive connection from the proxy is kept open
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+# The workers' heartbeat files, on tmpfs rather than the container's overlay filesystem
+worker_tmp_dir = os.getenv('GUNICORN_WORKER_TMP_DIR', '/dev/shm' if os.path.isdir('/dev/shm') else None)
+
+# The workers share their request metrics through this directory, on tmpfs too, so /metrics
+# of any worker reports the totals of the server (see flickrapp.utils.metrics). Set before the
+# app, and with it the Django settings, is loaded.
+metrics_dir = os.environ.setdefault(
+    'METRICS_DIR', os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else '/tmp', 'flickr_clone_metrics'))
+
+# Requests are logged by flickrapp.middleware.RequestMetricsMiddleware
+accesslog = os.getenv('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def on_starting(server):
+    # The files of a previous run would be added to this one's
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def worker_exit(server, worker):
+    # Keeps the metrics of a worker that is replaced, e.g. after max_requests, in the totals
+    from flickrapp.utils import metrics
+    metrics.retire()